@@ -0,0 +1,8 @@
+"""
+Allows to run the command line interface with python -m air_quality_dashboard
+"""
+
+import sys
+from air_quality_dashboard.cli import main
+
+sys.exit(main())
@@ -0,0 +1,437 @@
+"""
+Command line interface of the air quality dashboard:
+
+    python -m air_quality_dashboard build      # ingest the data and write the cache artifacts
+    python -m air_quality_dashboard validate   # verify the artifacts of the current build
+    python -m air_quality_dashboard startup    # measure the cold start of the dashboard
+    python -m air_quality_dashboard snapshots  # compare the snapshot store with the pickle file
+    python -m air_quality_dashboard report     # render the static reports of the figures
+
+The build derives everything the web process would otherwise compute at import (dtype-converted
+dataframes, dropdown options, geocodes, aggregates), so that a container can start serving
+immediately.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+import pandas as pd
+from air_quality_dashboard import reports, startup
+from air_quality_dashboard.data_parser import artifacts, fetch, local_data, sources, who_data
+from air_quality_dashboard.data_parser import comparison, snapshot_store
+
+BUILD_FORMAT = 2  # increase if the artifacts change, so that the version changes as well
+DEFAULT_WHO_INPUT = os.path.join("data", "air_quality_data.xz")
+DEFAULT_LOCAL_INPUT = os.path.join("data", "local_air_quality_data_Switzerland.xz")
+
+
+def _is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def read_input(source: str, timeout: float = 60) -> bytes:
+    """
+    Returns the raw content of an input, which is either a local file or an URL.
+    """
+    if _is_url(source):
+        return fetch.shared_fetcher().get(source, timeout=timeout)
+    with open(source, "rb") as file:
+        return file.read()
+
+
+def _read_pickle(content: bytes, source: str) -> pd.DataFrame:
+    compression = "xz" if source.endswith(".xz") else None
+    return pd.read_pickle(io.BytesIO(content), compression=compression)
+
+
+def parse_who_input(content: bytes, source: str) -> pd.DataFrame:
+    """
+    Parses the WHO data, either the excel file of the WHO or a pickle file of this dashboard.
+    """
+    if _is_url(source) or source.endswith(".xlsx"):
+        return who_data.read_who_air_quality_excel(content)
+    return _read_pickle(content, source)
+
+
+def parse_local_input(
+    content: bytes, source: str, source_name: str = "Switzerland"
+) -> pd.DataFrame:
+    """
+    Parses the local data, either a snapshot (html page of the NABEL database) or
+    an archive of snapshots (pickle file of this dashboard).
+    """
+    if _is_url(source) or source.endswith((".html", ".htm")):
+        nabel_source = sources.SOURCES[source_name](url=source, name=source_name)
+        return nabel_source.map_schema(nabel_source.parse(content))
+    return _read_pickle(content, source)
+
+
+@contextlib.contextmanager
+def timed(step: str, timings: dict):
+    """
+    Measures the duration of a build step and prints it.
+    """
+    start = time.perf_counter()
+    yield
+    timings[step] = round(time.perf_counter() - start, 3)
+    print(f"{step:<32} {timings[step]:8.3f} s")
+
+
+def build(
+    who_input: str = DEFAULT_WHO_INPUT,
+    local_inputs: list = (DEFAULT_LOCAL_INPUT,),
+    output: str = artifacts.BUILD_DIRECTORY,
+    local_source_name: str = "Switzerland",
+    geocode: bool = True,
+) -> dict:
+    """
+    Ingests the WHO and local data and writes the cache artifacts into a new build version.
+
+    Args:
+    who_input (str): file or URL of the WHO data (excel or pickle)
+    local_inputs (list): files or URLs of the local data (html snapshots or pickle archives),
+    the snapshots are combined in the given order
+    output (str): the build directory
+    local_source_name (str): the name of the local data source
+    geocode (bool): geocode the local sites (needs network access)
+
+    Returns:
+    dict: the manifest of the build
+    """
+    timings = {}
+    with timed("read inputs", timings):
+        who_content = read_input(who_input)
+        local_contents = [read_input(source) for source in local_inputs]
+    digest = hashlib.sha256(f"{BUILD_FORMAT}:{local_source_name}:{geocode}".encode())
+    for content in [who_content, *local_contents]:
+        digest.update(hashlib.sha256(content).digest())
+    writer = artifacts.ArtifactWriter(digest.hexdigest()[:16], output)
+
+    with timed("who: parse", timings):
+        whodata = who_data.WHOData.from_dataframe(
+            parse_who_input(who_content, who_input)
+        )
+    with timed("who: derive", timings):
+        writer.write("who_data", whodata.df)
+        # the dashboard offers the simplified types of stations
+        simplified = who_data.WHOData.from_dataframe(
+            whodata.df.assign(
+                type_of_stations=who_data.simplify_type_of_stations(
+                    whodata.df["type_of_stations"]
+                )
+            )
+        )
+        writer.write("station_country_lookup", simplified.station_country_lookup())
+        writer.write("who_stations", whodata.stations)
+        writer.write("who_country_centers", whodata.country_centers.reset_index())
+        writer.write(
+            "who_summary",
+            whodata.statistics.summary_per_value().rename_axis("Pollutant").reset_index(),
+        )
+
+    with timed("local: parse", timings):
+        snapshots = [
+            parse_local_input(content, source, local_source_name)
+            for source, content in zip(local_inputs, local_contents)
+        ]
+        # snapshots present in several inputs are kept once, the first occurrence wins
+        archive, timestamps = [], set()
+        for snapshot in snapshots:
+            snapshot = snapshot.loc[~snapshot["timestamp"].isin(timestamps)]
+            timestamps.update(snapshot["timestamp"].unique())
+            archive.append(snapshot)
+        local_df = pd.concat(archive)
+    with timed("local: derive", timings):
+        writer.write(f"local_air_quality_data_{local_source_name}", local_df)
+        writer.write(
+            f"local_mean_per_site_{local_source_name}",
+            local_df.groupby(local_df["Type of site"].astype(object))[
+                sources.POLLUTANT_COLUMNS
+            ]
+            .mean()
+            .reset_index(),
+        )
+    if geocode:
+        with timed("local: geocode", timings):
+            locations = sorted(local_df["Location"].dropna().unique())
+            try:
+                geocodes = local_data.geocode_locations(locations, local_source_name)
+                writer.write(f"geocodes_{local_source_name}", geocodes)
+            except Exception as e:
+                # the web process geocodes the sites itself if the artifact is missing
+                print(f"Could not geocode the sites, skipping the geocodes: {e}")
+                geocodes = None
+        if geocodes is not None:
+            with timed("local: match WHO cities", timings):
+                writer.write(
+                    f"site_matches_{local_source_name}",
+                    comparison.match_sites(geocodes, whodata, local_source_name),
+                )
+
+    inputs = {"who": who_input, "local": list(local_inputs)}
+    manifest_path = writer.commit(inputs, timings)
+    print(f"{'total':<32} {sum(timings.values()):8.3f} s")
+    print(f"Build {writer.version} written to {manifest_path}")
+    return writer.manifest
+
+
+def validate(version: str = None, output: str = artifacts.BUILD_DIRECTORY) -> bool:
+    """
+    Verifies the artifacts of a build (by default the current one) and prints the problems.
+
+    Returns:
+    bool: True if the build is valid
+    """
+    problems = artifacts.validate(version, output)
+    for problem in problems:
+        print(problem)
+    if problems:
+        return False
+    manifest = artifacts.load_manifest(version, output)
+    print(
+        f"Build {manifest['version']} is valid ({len(manifest['artifacts'])} artifacts)"
+    )
+    return True
+
+
+def startup_benchmark(
+    baseline: str = None,
+    save_baseline: str = None,
+    tolerance: float = startup.DEFAULT_TOLERANCE,
+) -> bool:
+    """
+    Measures the cold start of the dashboard, prints the report and compares it with a baseline.
+
+    Args:
+    baseline (str): json file of a previous measurement to compare with
+    save_baseline (str): json file to save the measurement to
+    tolerance (float): relative slowdown accepted
+
+    Returns:
+    bool: True if there is no regression
+    """
+    result = startup.measure_startup()
+    print(f"{'startup (import main)':<32} {result['total']:8.3f} s")
+    print(f"{'  imports':<32} {result['imports']:8.3f} s")
+    for name, duration in result["phases"].items():
+        print(f"{'  ' + name:<32} {duration:8.3f} s")
+    print("slowest imports:")
+    for name, duration in result["top_imports"]:
+        print(f"{'  ' + name:<32} {duration:8.3f} s")
+    if save_baseline:
+        with open(save_baseline, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+    if baseline is None:
+        return True
+    with open(baseline, encoding="utf-8") as file:
+        regressions = startup.find_regressions(result, json.load(file), tolerance)
+    for regression in regressions:
+        print(f"Regression of the startup time, {regression}")
+    return not regressions
+
+
+def compare_snapshot_store(
+    archive: str = DEFAULT_LOCAL_INPUT,
+    delta: bool = True,
+    keyframe_interval: int = snapshot_store.DEFAULT_KEYFRAME_INTERVAL,
+) -> dict:
+    """
+    Encodes an archive of local snapshots with the SnapshotStore and prints the compression
+    ratio and decoding throughput compared with the xz pickle file.
+    """
+    df = pd.read_pickle(archive)
+    report = snapshot_store.compare_with_pickle(
+        df, sources.POLLUTANT_COLUMNS, delta=delta, keyframe_interval=keyframe_interval
+    )
+    print(f"{'rows / snapshots':<32} {report['rows']} / {report['snapshots']}")
+    print(f"{'xz pickle file':<32} {report['pickle_bytes']:>12,d} bytes")
+    print(f"{'snapshot store file':<32} {report['store_bytes']:>12,d} bytes")
+    print(f"{'compression ratio':<32} {report['compression_ratio']:12.2f}")
+    print(f"{'dataframe in memory':<32} {report['dataframe_memory_bytes']:>12,d} bytes")
+    print(f"{'snapshot store in memory':<32} {report['store_memory_bytes']:>12,d} bytes")
+    print(f"{'decoding xz pickle':<32} {report['pickle_rows_per_second']:12,.0f} rows/s")
+    print(f"{'decoding snapshot store':<32} {report['store_rows_per_second']:12,.0f} rows/s")
+    return report
+
+
+def report(
+    output: str = reports.REPORT_DIRECTORY,
+    countries: list = None,
+    formats: tuple = ("html",),
+    workers: int = None,
+    local_source_name: str = "Switzerland",
+) -> bool:
+    """
+    Renders the static reports of the current data (see reports.render_reports), an interrupted
+    or partly failed report is resumed by running it again.
+
+    Returns:
+    bool: whether all figures of the report are rendered
+    """
+    if "png" in formats and importlib.util.find_spec("kaleido") is None:
+        print("The png export needs kaleido (pip install kaleido), use --format html")
+        return False
+    whodata = who_data.WHOData()
+    localdata = local_data.LocalData(
+        data_source_name=local_source_name, update_on_load=False
+    )
+    df = localdata.df
+    manifest = reports.render_reports(
+        whodata,
+        df[df["timestamp"] == df["timestamp"].max()],
+        local_data.site_geocodes(localdata),
+        output,
+        countries,
+        formats,
+        workers,
+    )
+    failed = [job_id for job_id, state in manifest["jobs"].items() if state["status"] != "done"]
+    if failed:
+        print(f"{len(failed)} figures failed, run the report again to retry them")
+    print(f"Report written to {os.path.join(output, 'index.html')}")
+    return not failed
+
+
+def main(argv: list = None) -> int:
+    """
+    Entry point of python -m air_quality_dashboard.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m air_quality_dashboard",
+        description="Builds and validates the cache artifacts of the air quality dashboard.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="ingest the data and write the artifacts")
+    build_parser.add_argument(
+        "--who",
+        default=DEFAULT_WHO_INPUT,
+        help="file or URL of the WHO data, excel or pickle (default: %(default)s)",
+    )
+    build_parser.add_argument(
+        "--local",
+        action="append",
+        help="file or URL of the local data, html snapshot or pickle archive, "
+        f"can be given several times (default: {DEFAULT_LOCAL_INPUT})",
+    )
+    build_parser.add_argument(
+        "--local-source",
+        default="Switzerland",
+        choices=sorted(sources.SOURCES),
+        help="name of the local data source (default: %(default)s)",
+    )
+    build_parser.add_argument(
+        "--no-geocode",
+        action="store_true",
+        help="do not geocode the local sites (no network access needed)",
+    )
+
+    validate_parser = subparsers.add_parser(
+        "validate", help="verify the checksums of the artifacts"
+    )
+    validate_parser.add_argument(
+        "--version", help="build version to verify (default: the current build)"
+    )
+    startup_parser = subparsers.add_parser(
+        "startup", help="measure the imports and data loading of main.py"
+    )
+    startup_parser.add_argument(
+        "--baseline", help="json file of a previous measurement, fails on a regression"
+    )
+    startup_parser.add_argument(
+        "--save-baseline", help="json file to save the measurement to"
+    )
+    startup_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=startup.DEFAULT_TOLERANCE,
+        help="relative slowdown accepted (default: %(default)s)",
+    )
+
+    snapshots_parser = subparsers.add_parser(
+        "snapshots", help="compare the snapshot store with the xz pickle of an archive"
+    )
+    snapshots_parser.add_argument(
+        "--archive",
+        default=DEFAULT_LOCAL_INPUT,
+        help="pickle archive of local snapshots (default: %(default)s)",
+    )
+    snapshots_parser.add_argument(
+        "--no-delta", action="store_true", help="store the values without delta encoding"
+    )
+    snapshots_parser.add_argument(
+        "--keyframe-interval",
+        type=int,
+        default=snapshot_store.DEFAULT_KEYFRAME_INTERVAL,
+        help="snapshots between two keyframes (default: %(default)s)",
+    )
+
+    report_parser = subparsers.add_parser(
+        "report", help="render the bar plots, trends and maps into a static report"
+    )
+    report_parser.add_argument(
+        "--output",
+        default=reports.REPORT_DIRECTORY,
+        help="report directory (default: %(default)s)",
+    )
+    report_parser.add_argument(
+        "--country",
+        action="append",
+        help="country of the report, can be given several times (default: all countries)",
+    )
+    report_parser.add_argument(
+        "--format",
+        action="append",
+        choices=reports.FORMATS,
+        help="format of the figures, can be given several times (default: html)",
+    )
+    report_parser.add_argument(
+        "--workers", type=int, help="worker processes (default: number of cores)"
+    )
+    report_parser.add_argument(
+        "--local-source",
+        default="Switzerland",
+        choices=sorted(sources.SOURCES),
+        help="name of the local data source (default: %(default)s)",
+    )
+
+    for subparser in (build_parser, validate_parser):
+        subparser.add_argument(
+            "--output",
+            default=artifacts.BUILD_DIRECTORY,
+            help="build directory (default: %(default)s)",
+        )
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        build(
+            who_input=args.who,
+            local_inputs=args.local or [DEFAULT_LOCAL_INPUT],
+            output=args.output,
+            local_source_name=args.local_source,
+            geocode=not args.no_geocode,
+        )
+        return 0
+    if args.command == "snapshots":
+        compare_snapshot_store(args.archive, not args.no_delta, args.keyframe_interval)
+        return 0
+    if args.command == "report":
+        formats = tuple(dict.fromkeys(args.format or ["html"]))
+        return (
+            0
+            if report(args.output, args.country, formats, args.workers, args.local_source)
+            else 1
+        )
+    if args.command == "startup":
+        return 0 if startup_benchmark(args.baseline, args.save_baseline, args.tolerance) else 1
+    return 0 if validate(args.version, args.output) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
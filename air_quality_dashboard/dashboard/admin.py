@@ -0,0 +1,40 @@
+"""
+Submodul containing the access check of the admin pages (/admin/...) and of the profiling on
+demand. With AIR_QUALITY_ADMIN_TOKEN set, a request needs this token in the header X-Admin-Token.
+Without a token, only requests made directly on the host of the server are allowed, i.e. from a
+loopback address and not forwarded by a proxy.
+"""
+
+import hmac
+import os
+import flask
+
+ADMIN_TOKEN = os.environ.get("AIR_QUALITY_ADMIN_TOKEN")
+TOKEN_HEADER = "X-Admin-Token"
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
+# set by a reverse proxy, the loopback address is then the one of the proxy
+FORWARDED_HEADERS = ("X-Forwarded-For", "X-Real-IP", "Forwarded")
+
+
+def is_admin(request: flask.Request) -> bool:
+    """
+    Returns whether a request may use the admin pages.
+    """
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get(TOKEN_HEADER, ""), ADMIN_TOKEN)
+    return request.remote_addr in LOOPBACK_ADDRESSES and not any(
+        header in request.headers for header in FORWARDED_HEADERS
+    )
+
+
+def protect(blueprint: flask.Blueprint) -> flask.Blueprint:
+    """
+    Rejects the requests of a blueprint which don't pass is_admin (403).
+    """
+
+    @blueprint.before_request
+    def check_admin():
+        if not is_admin(flask.request):
+            flask.abort(403, f"Admin pages need the header {TOKEN_HEADER} or a local request")
+
+    return blueprint
@@ -0,0 +1,128 @@
+"""
+Submodul containing a small JSON API next to the dash app, e.g. for the exceedances
+of the ambient air quality standard of the local data sources.
+"""
+
+import json
+import flask
+import pandas as pd
+
+blueprint = flask.Blueprint("api", __name__, url_prefix="/api")
+
+# registered local data, data source name -> LocalData
+_local_data = {}
+# registered handle of the WHO data (see datasets)
+_who_data = {}
+
+
+def register_local_data(localdata):
+    """
+    Makes a LocalData instance available through the API, under its data source name.
+    """
+    _local_data[localdata.data_source_name] = localdata
+
+
+def register_who_data(handle):
+    """
+    Makes the WHO data available through the API, always its current version.
+
+    Args:
+    handle (DatasetHandle): the handle of the WHO data
+    """
+    _who_data["who"] = handle
+
+
+def _records(df):
+    # pandas takes care of the conversion of numpy types and timestamps
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+@blueprint.route("/exceedances/<data_source_name>")
+def exceedances(data_source_name):
+    """
+    Returns the limits, the current exceedances (alerts) and the number of exceedances
+    within the rolling window per site and pollutant of a local data source.
+    """
+    if data_source_name not in _local_data:
+        flask.abort(404, f"Unknown data source {data_source_name}")
+    evaluator = _local_data[data_source_name].exceedances
+    if evaluator is None:
+        flask.abort(503, f"The limits of {data_source_name} are not known yet")
+    return flask.jsonify(
+        {
+            "timestamp": evaluator.timestamp.isoformat(),
+            "window": evaluator.window,
+            "limits": evaluator.limits.to_dict(),
+            "alerts": _records(evaluator.alerts()),
+            "rolling_counts": _records(
+                evaluator.rolling_counts().rename_axis("Location").reset_index()
+            ),
+        }
+    )
+
+
+@blueprint.route("/snapshots/<data_source_name>")
+def snapshots(data_source_name):
+    """
+    Returns the rows of the snapshots after the timestamp given by ?since= (ISO format),
+    by default the last snapshot, e.g. to fetch only the rows of a new snapshot
+    announced on /events/snapshots.
+    """
+    if data_source_name not in _local_data:
+        flask.abort(404, f"Unknown data source {data_source_name}")
+    df = _local_data[data_source_name].df
+    if df is None:
+        flask.abort(503, f"No data available for {data_source_name}")
+    since = flask.request.args.get("since")
+    if since is None:
+        return flask.jsonify(_records(df[df["timestamp"] == df["timestamp"].max()]))
+    try:
+        since = pd.Timestamp(since).tz_localize(None)  # the timestamps are local time
+    except (ValueError, TypeError):
+        flask.abort(400, f"Invalid timestamp {since}")
+    return flask.jsonify(_records(df[df["timestamp"] > since]))
+
+
+@blueprint.route("/retention/<data_source_name>")
+def retention(data_source_name):
+    """
+    Returns the progress and metrics of the compaction of the history of a local data source,
+    with the storage of each tier and the time range of each tier.
+    """
+    if data_source_name not in _local_data:
+        flask.abort(404, f"Unknown data source {data_source_name}")
+    localdata = _local_data[data_source_name]
+    if localdata.compactor is None:
+        flask.abort(503, f"The history of {data_source_name} is not compacted")
+    ranges = {
+        tier: [None if boundary is None else boundary.isoformat() for boundary in bounds]
+        for tier, bounds in localdata.tier_ranges().items()
+    }
+    return flask.jsonify({**localdata.compactor.metrics, "tier_ranges": ranges})
+
+
+@blueprint.route("/forecast/<data_source_name>")
+def local_forecast(data_source_name):
+    """
+    Returns the forecast of the next 24 hours per site and pollutant of a local data source.
+    """
+    if data_source_name not in _local_data:
+        flask.abort(404, f"Unknown data source {data_source_name}")
+    forecaster = _local_data[data_source_name].forecaster
+    if forecaster is None:
+        flask.abort(503, f"No data available for {data_source_name}")
+    return flask.jsonify(_records(forecaster.forecast().dropna(subset=["Forecast"])))
+
+
+@blueprint.route("/forecast/who/<country>")
+def who_forecast(country):
+    """
+    Returns the forecast of the yearly mean concentrations of a country of the WHO data.
+    """
+    if "who" not in _who_data:
+        flask.abort(503, "The WHO data is not loaded")
+    forecast = _who_data["who"].current().data.forecaster.forecast()
+    forecast = forecast[forecast["country_name"] == country]
+    if len(forecast) == 0:
+        flask.abort(404, f"Unknown country {country}")
+    return flask.jsonify(_records(forecast.dropna(subset=["Forecast"])))
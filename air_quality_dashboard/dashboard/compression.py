@@ -0,0 +1,80 @@
+"""
+Submodul to compress the responses of the dash server (brotli / gzip) and to keep track of the
+payload size of the callback outputs, so that the bandwidth to remote users stays under control.
+"""
+
+import flask
+from flask_compress import Compress
+
+COMPRESS_MIN_SIZE = 500  # responses smaller than this (in bytes) are not worth compressing
+COMPRESS_ALGORITHMS = ["br", "gzip"]  # preferred first, if supported by the webbrowser
+COMPRESS_MIMETYPES = [
+    "application/json",
+    "application/javascript",
+    "text/css",
+    "text/html",
+]
+
+DEFAULT_PAYLOAD_BUDGET = 500_000  # bytes per callback response (before compression)
+# payload budget per callback output ("component_id.property"), the globe contains all
+# animation frames and is hence by far the largest output
+PAYLOAD_BUDGETS = {
+    "globe.figure": 2_500_000,
+    "bar-max.figure": 50_000,
+    "who_data.data": 20_000,
+    "local_data_switzerland.data": 20_000,
+}
+
+
+def enable_compression(
+    server: flask.Flask,
+    min_size: int = COMPRESS_MIN_SIZE,
+    algorithms: list = None,
+) -> None:
+    """
+    Enables the compression of all responses of the flask server behind the dash app.
+
+    Args:
+    server (flask.Flask): the flask server of the dash app (app.server)
+    min_size (int): minimum size of a response in bytes to be compressed
+    algorithms (list): compression algorithms in order of preference
+    """
+    server.config["COMPRESS_ALGORITHM"] = list(algorithms or COMPRESS_ALGORITHMS)
+    server.config["COMPRESS_MIN_SIZE"] = min_size
+    server.config["COMPRESS_MIMETYPES"] = COMPRESS_MIMETYPES
+    Compress(server)
+
+
+def enable_payload_budget(
+    server: flask.Flask,
+    budgets: dict = None,
+    default_budget: int = DEFAULT_PAYLOAD_BUDGET,
+) -> None:
+    """
+    Warns if the response of a callback exceeds its payload budget.
+    Has to be called after enable_compression, as flask runs the after request functions
+    in reverse order, so that the size is measured before the compression.
+
+    Args:
+    server (flask.Flask): the flask server of the dash app (app.server)
+    budgets (dict): payload budget in bytes per callback output ("component_id.property")
+    default_budget (int): payload budget for all outputs not listed in budgets
+    """
+    budgets = PAYLOAD_BUDGETS if budgets is None else budgets
+
+    @server.after_request
+    def check_payload_budget(response):
+        if not flask.request.path.endswith("_dash-update-component"):
+            return response
+        if response.direct_passthrough:  # streamed responses can't be measured
+            return response
+        callback_request = flask.request.get_json(silent=True) or {}
+        output = callback_request.get("output", "")
+        budget = budgets.get(output, default_budget)
+        payload_size = len(response.get_data())
+        if payload_size > budget:
+            print(
+                f"Payload of callback output {output} exceeds its budget: "
+                f"{payload_size} > {budget} bytes"
+            )
+        return response
@@ -0,0 +1,246 @@
+"""
+Submodul containing the versioned dataset handles of the dashboard. The pages don't keep a dataset
+and the values derived from it (dropdown options, lookups, indexes) in module globals, but take
+the current version from its handle once per callback or page load. A new version (e.g. a new
+build) is loaded and derived next to the version in use and then swapped in with one assignment:
+the callbacks in flight finish on the version they took, and the old version is freed as soon as
+the last of them is done. The versions are listed and reloaded on /admin/datasets (admins only).
+"""
+
+import functools
+import threading
+import weakref
+import flask
+from air_quality_dashboard.dashboard import admin, memory
+from air_quality_dashboard.data_parser import artifacts, atomic, who_data
+
+RELOAD_INTERVAL = 60  # seconds between the checks for a new version of the datasets
+BUILD_VERSION_PREFIX = "build "  # versions loaded from a build, see who_data_version
+
+blueprint = admin.protect(
+    flask.Blueprint("datasets", __name__, url_prefix="/admin/datasets")
+)
+
+# registered handles, name -> DatasetHandle
+_handles = {}
+
+
+class DatasetVersion:
+    """
+    One version of a dataset and the values derived from it, which are computed once per version
+    (the derivations are registered on the handle) and freed together with the version.
+    """
+
+    def __init__(self, name: str, data, version: str, derivations: dict) -> None:
+        self.name = name
+        self.data = data
+        self.version = version
+        self._derivations = derivations
+        self._derived = {}
+        # reentrant, a derivation may use another one of the same version
+        self._lock = threading.RLock()
+
+    def __str__(self) -> str:
+        # part of the keys of the coalesced calls and cached results (see single_flight)
+        return f"{self.name}@{self.version}"
+
+    def derived(self, name: str):
+        """
+        Returns a value derived from this version, computed on first use.
+
+        Args:
+        name (str): the name of the derivation, see DatasetHandle.derive
+        """
+        with self._lock:
+            if name not in self._derived:
+                self._derived[name] = self._derivations[name](self)
+            return self._derived[name]
+
+    def artifact(self, name: str):
+        """
+        Returns an artifact of the build this version was loaded from (not of the current build,
+        which may be newer), or None if the version was not loaded from a build or the artifact
+        cannot be used, in which case it has to be derived from the data.
+
+        Args:
+        name (str): the name of the artifact, see artifacts.ArtifactWriter
+        """
+        version = str(self.version)
+        if not version.startswith(BUILD_VERSION_PREFIX):
+            return None
+        try:
+            return artifacts.load_artifact(
+                name, version=version[len(BUILD_VERSION_PREFIX) :]
+            )
+        except (artifacts.ArtifactError, OSError) as e:
+            print(f"Cannot use the build artifact {name}: {e}")
+            return None
+
+
+class DatasetHandle:
+    """
+    Handle of a dataset, whose current version can be swapped at runtime.
+    """
+
+    def __init__(self, name: str, load, version) -> None:
+        """
+        Args:
+        name (str): the name of the dataset, e.g. on /admin/datasets
+        load (callable): loads the dataset
+        version (callable): returns the version of the dataset which load would return,
+        it is checked before loading, hence it should be cheap (e.g. the version of the build)
+        """
+        self.name = name
+        self._load = load
+        self._version = version
+        self._derivations = {}
+        self._listeners = []
+        self._current = None
+        self._retired = weakref.WeakSet()  # swapped out, but still used by a callback
+        self._lock = threading.Lock()  # one load at a time
+        self.swaps = 0
+
+    def current(self) -> DatasetVersion:
+        """
+        Returns the version in use (loaded on the first call). A callback takes it once and
+        keeps using it, also if a new version is swapped in in the meantime.
+        """
+        current = self._current
+        if current is None:
+            current = self.reload()
+        return current
+
+    def derive(self, name: str, function) -> None:
+        """
+        Registers a value derived from the dataset, computed once per version.
+
+        Args:
+        name (str): the name of the derivation
+        function (callable): computes the value from a version (its data and the values
+        derived already)
+        """
+        self._derivations[name] = function
+
+    def add_listener(self, listener) -> None:
+        """
+        Adds a function called with the new version after a swap, e.g. to clear a cache.
+        """
+        self._listeners.append(listener)
+
+    def reload(self) -> DatasetVersion:
+        """
+        Loads the dataset if its version changed, computes the derived values of the new
+        version and then swaps it in.
+
+        Returns:
+        DatasetVersion: the version in use
+        """
+        with self._lock:
+            version = self._version()
+            current = self._current
+            if current is not None and current.version == version:
+                return current
+            new = DatasetVersion(self.name, self._load(), version, self._derivations)
+            # the first callbacks on the new version don't have to wait for its derived values
+            for name in list(self._derivations):
+                new.derived(name)
+            self._current = new
+            if current is None:  # the first version
+                return new
+            self._retired.add(current)
+            self.swaps += 1
+        for listener in self._listeners:
+            listener(new)
+        return new
+
+    def versions(self) -> list:
+        """
+        Returns the version in use and the old versions still used by callbacks in flight.
+        """
+        versions = [] if self._current is None else [self._current]
+        return versions + [version for version in self._retired if version is not self._current]
+
+    def start_reloading(self, interval: float = RELOAD_INTERVAL) -> threading.Event:
+        """
+        Checks periodically in a background thread whether there is a new version (e.g. a new
+        build) and swaps it in, in every worker process on its own.
+
+        Returns:
+        threading.Event: set it to stop the reloading
+        """
+        stop = threading.Event()
+
+        def reload_loop():
+            while not stop.wait(interval):
+                try:
+                    self.reload()
+                # a failed load (e.g. a broken build) must not stop the reloading
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    print(
+                        f"Could not reload the dataset {self.name}, keeping the old one: "
+                        f"{type(e).__name__}: {e}"
+                    )
+
+        threading.Thread(target=reload_loop, name=f"reload {self.name}", daemon=True).start()
+        return stop
+
+
+def register(handle: DatasetHandle) -> DatasetHandle:
+    """
+    Makes a handle available on /admin/datasets.
+    """
+    _handles[handle.name] = handle
+    return handle
+
+
+def who_data_version() -> str:
+    """
+    Returns the version of the WHO data which WHOData loads: the version of the build in use,
+    otherwise the version of the pickle file.
+    """
+    build = artifacts.current_version()
+    if build is not None:
+        return f"{BUILD_VERSION_PREFIX}{build}"
+    file_version = atomic.file_version(who_data.DATA_LOCATION)
+    return f"file {file_version[1] if file_version is not None else None}"
+
+
+@functools.lru_cache(maxsize=None)
+def who_data_handle() -> DatasetHandle:
+    """
+    Returns the handle of the WHO data shared by all pages of the process.
+    """
+    handle = register(DatasetHandle("who", who_data.WHOData, who_data_version))
+    memory.register_dataset(
+        "WHO data",
+        lambda: sum(memory.dataframe_bytes(version.data.df) for version in handle.versions()),
+    )
+    return handle
+
+
+@blueprint.route("/")
+def versions():
+    """
+    Returns the version in use, the number of swaps and the old versions still in use
+    of each dataset.
+    """
+    datasets = {}
+    for name, handle in _handles.items():
+        in_use = [version.version for version in handle.versions()]
+        datasets[name] = {
+            "version": in_use[0] if in_use else None,
+            "swaps": handle.swaps,
+            "in_use": in_use,
+        }
+    return flask.jsonify(datasets)
+
+
+@blueprint.route("/<name>/reload", methods=["POST"])
+def reload(name):
+    """
+    Swaps a dataset to its latest version (the other worker processes follow with their
+    next check, see DatasetHandle.start_reloading).
+    """
+    if name not in _handles:
+        flask.abort(404, f"Unknown dataset {name}")
+    return flask.jsonify({"version": _handles[name].reload().version})
@@ -0,0 +1,112 @@
+"""
+Submodul containing a server-sent events (SSE) channel, which notifies the open dashboards when a
+new snapshot of a local data source is committed. The webbrowsers keep one connection open and
+only receive a small notification per snapshot, instead of polling the server with an interval.
+"""
+
+import collections
+import itertools
+import json
+import threading
+import flask
+
+KEEP_ALIVE = 15  # seconds, a comment is sent to keep idle connections (and proxies) open
+HISTORY_SIZE = 100  # events kept to be replayed to reconnecting webbrowsers (Last-Event-ID)
+
+blueprint = flask.Blueprint("events", __name__, url_prefix="/events")
+
+
+class EventBroker:
+    """
+    In-process publish / subscribe of the events, each event gets an increasing id.
+    """
+
+    def __init__(self, history_size: int = HISTORY_SIZE) -> None:
+        self.history = collections.deque(maxlen=history_size)  # (id, event, data)
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+
+    def publish(self, event: str, data: dict) -> int:
+        """
+        Publishes an event to all subscribers.
+
+        Returns:
+        int: the id of the event
+        """
+        with self._condition:
+            event_id = next(self._ids)
+            self.history.append((event_id, event, data))
+            self._condition.notify_all()
+        return event_id
+
+    def events_after(self, last_id: int, timeout: float = KEEP_ALIVE) -> list:
+        """
+        Returns the events published after last_id, waits up to timeout seconds
+        if there are none yet (an empty list then).
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.history and self.history[-1][0] > last_id, timeout
+            )
+            return [entry for entry in self.history if entry[0] > last_id]
+
+    @property
+    def last_id(self) -> int:
+        """
+        Id of the last published event (0 if there is none).
+        """
+        with self._condition:
+            return self.history[-1][0] if self.history else 0
+
+
+broker = EventBroker()
+
+
+def register_local_data(localdata):
+    """
+    Publishes a "snapshot" event whenever a new snapshot of the LocalData instance is committed.
+    """
+
+    def publish_snapshot(snapshot):
+        broker.publish(
+            "snapshot",
+            {
+                "source": localdata.data_source_name,
+                "timestamp": snapshot["timestamp"].iloc[0].isoformat(),
+                "rows": len(snapshot),
+            },
+        )
+
+    localdata.add_listener(publish_snapshot)
+
+
+def _format_event(event_id: int, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@blueprint.route("/snapshots")
+def snapshots():
+    """
+    Stream of the snapshot events (text/event-stream). Reconnecting webbrowsers send the id of
+    the last event they received, the events they missed in between are replayed.
+    """
+    try:
+        last_id = int(flask.request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        last_id = broker.last_id  # new connection, only the upcoming events
+
+    def stream(last_id):
+        yield "retry: 5000\n\n"  # reconnect after 5 seconds if the connection is lost
+        while True:
+            events = broker.events_after(last_id)
+            if not events:
+                yield ": keep-alive\n\n"
+            for event_id, event, data in events:
+                last_id = event_id
+                yield _format_event(event_id, event, data)
+
+    return flask.Response(
+        stream(last_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,160 @@
+"""
+Submodul containing a flask route to export the filtered and sorted data behind the dash data
+tables as CSV, Parquet or NDJSON. The data is streamed in chunks, so that also large exports
+run in constant memory (besides the row positions of the selection) and do not block the dash
+callbacks: only the rows of the current chunk are copied out of the table.
+"""
+
+import json
+import flask
+from air_quality_dashboard.dashboard import helper_functions
+
+CHUNK_SIZE = 10_000  # rows per streamed chunk
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+blueprint = flask.Blueprint("export", __name__, url_prefix="/export")
+
+# registered tables, table id -> (function returning the dataframe and the text indexes of the
+# columns filtered by "contains", these columns)
+_tables = {}
+
+
+def register_table(table_id, get_table, text_columns):
+    """
+    Registers a data table for the export, with the same filter semantics as its callback.
+
+    Args:
+    table_id (str): the id of the dash data table, used in the URL (/export/<table_id>)
+    get_table (callable): returns the current dataframe of the table and the TextIndex per
+    text column of this dataframe (taken together, so that they belong to the same version)
+    text_columns (list): columns on which the "contains" operator is applied
+    """
+    _tables[table_id] = (get_table, text_columns)
+
+
+def _chunks(df, positions):
+    # the rows of one chunk at a time, in the filtered and sorted order
+    for start in range(0, len(positions), CHUNK_SIZE):
+        yield start, df.iloc[positions[start : start + CHUNK_SIZE]]
+
+
+def _csv_chunks(df, positions):
+    for start, chunk in _chunks(df, positions):
+        yield chunk.to_csv(index=False, header=start == 0)
+
+
+def _ndjson_chunks(df, positions):
+    for _start, chunk in _chunks(df, positions):
+        yield chunk.to_json(orient="records", lines=True, date_format="iso").rstrip(
+            "\n"
+        ) + "\n"
+
+
+class _ParquetSink:
+    """
+    File-like object collecting the bytes written by the parquet writer,
+    so that they can be streamed after each row group.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def pop(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def _as_parquet_frame(chunk):
+    # object columns may mix strings and numbers / NaN, parquet requires one type per column
+    object_columns = chunk.select_dtypes(include="object").columns
+    return chunk.astype({column: "string" for column in object_columns})
+
+
+def _pyarrow():
+    # imported with the first parquet export, not at the startup of the dashboard
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:  # parquet export is optional
+        return None, None
+    return pa, pq
+
+
+def _parquet_chunks(df, positions):
+    pa, pq = _pyarrow()
+    sink = _ParquetSink()
+    schema = pa.Schema.from_pandas(
+        _as_parquet_frame(df.iloc[:0]), preserve_index=False
+    )
+    writer = pq.ParquetWriter(sink, schema)
+    for _start, chunk in _chunks(df, positions):  # one row group per chunk
+        chunk = _as_parquet_frame(chunk)
+        writer.write_table(
+            pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+        )
+        yield sink.pop()
+    writer.close()
+    yield sink.pop()
+
+
+@blueprint.route("/<table_id>")
+def export_table(table_id):
+    """
+    Exports the data of a registered table. Accepts the same filter_query and sort_by
+    (JSON encoded) as the dash data table, as well as the format (csv, parquet, ndjson).
+    """
+    if table_id not in _tables:
+        flask.abort(404, f"Unknown table {table_id}")
+    export_format = flask.request.args.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        flask.abort(400, f"Unknown export format {export_format}")
+    if export_format == "parquet" and _pyarrow()[0] is None:
+        flask.abort(501, "Parquet export requires pyarrow")
+
+    get_table, text_columns = _tables[table_id]
+    df, text_indexes = get_table()
+    try:
+        sort_by = json.loads(flask.request.args.get("sort_by", "[]"))
+        positions = helper_functions.query_positions(
+            df,
+            flask.request.args.get("filter_query", ""),
+            sort_by,
+            text_columns,
+            text_indexes,
+        )
+    except (KeyError, TypeError, ValueError, json.JSONDecodeError) as e:
+        flask.abort(400, f"Invalid filter or sorting: {e}")
+
+    chunks = {
+        "csv": _csv_chunks,
+        "ndjson": _ndjson_chunks,
+        "parquet": _parquet_chunks,
+    }[export_format](df, positions)
+    return flask.Response(
+        flask.stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={
+            "Content-Disposition": f"attachment; filename={table_id}.{export_format}"
+        },
+    )
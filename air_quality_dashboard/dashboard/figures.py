@@ -0,0 +1,182 @@
+"""
+Submodul containing the figures of the dashboard pages, built from the data passed in (not from
+the globals of the pages), so that they are shared by the callbacks of the pages and the batch
+rendering of the static reports (python -m air_quality_dashboard report).
+"""
+
+import functools
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from air_quality_dashboard.dashboard import helper_functions
+
+# annotation shown instead of the bar plot, if no data is available for the selection
+NO_DATA_ANNOTATION = {
+    "text": "No matching data found",
+    "xref": "paper",
+    "yref": "paper",
+    "showarrow": False,
+    "font": {"size": 28},
+}
+POLLUTANT_LABELS = {
+    "pm10_concentration": "PM10",
+    "pm25_concentration": "PM25",
+    "no2_concentration": "NO2",
+}
+
+
+@functools.lru_cache(maxsize=1)
+def bar_skeleton():
+    """
+    Returns the static part of the bar plot (template, axis and legend titles), which is the same
+    for every selection and hence only sent once to the webbrowser.
+    """
+    fig = go.Figure()
+    fig.update_layout(
+        barmode="group",
+        xaxis_title="Country",
+        yaxis_title="Max concentration [ug/m<sup>3</sup>]",
+        legend_title_text="Polluant",
+        legend_tracegroupgap=0,
+        margin={"t": 60},
+    )
+    return fig.to_plotly_json()
+
+
+def bar_max_updates(whodata, countries, year_1, year_2):
+    """
+    Calculates the traces and title of the bar plot which presents the max values in function of the country.
+
+    Args:
+    whodata (WHOData): the WHO data
+    countries (str or list): the selected countries
+    year_1, year_2: first and last year of the timespan (None for an open end)
+
+    Returns:
+    dict: the figure updates (property path -> value) for the selection
+    """
+    country_list = countries
+    if isinstance(
+        countries, str
+    ):  # if only one country is selected, dash returns a string,
+        #  which can't be used for the compairson, hence convert it to a list.
+        country_list = [countries]
+    # the max per country and polluant (and the year of the max) in the timespan
+    # is looked up in the range index of the dataset, instead of filtering the data
+    year_min = None if year_1 is None else pd.Timestamp(year_1).year
+    year_max = None if year_2 is None else pd.Timestamp(year_2).year
+    df_max = whodata.year_range_max.query(country_list, year_min, year_max).rename(
+        columns={"year_int": "year"}
+    )
+
+    # test if for the chosen combination of polluant, and timespan one of the polluant
+    # data is not available, if yes, print no matching data found.
+    if (
+        df_max.empty
+        or df_max.groupby("variable", sort=False)["value"].count().eq(0).any()
+    ):
+        return {
+            ("data",): [],
+            ("layout", "title", "text"): None,
+            ("layout", "xaxis", "visible"): False,
+            ("layout", "yaxis", "visible"): False,
+            ("layout", "annotations"): [NO_DATA_ANNOTATION],
+        }
+
+    df_max = df_max.replace(to_replace=POLLUTANT_LABELS)
+    first_year, last_year = whodata.year_range_max.key_span(
+        country_list, year_min, year_max
+    )
+    year_min_str = str(int(first_year))
+    year_max_str = str(int(last_year))
+    # add a barplot (using histogram element from plotly express, as it enables us to use more
+    # finetuning parameters)
+    import plotly.express as px  # loaded with the first figure, not at startup
+
+    fig = px.histogram(
+        data_frame=df_max,
+        x="country_name",
+        y="value",
+        color="variable",
+        barmode="group",
+        color_discrete_sequence=px.colors.qualitative.D3,
+    )
+    # add hoover traces, for the overlay we need a customdata list with the year + value per polluant
+    for trace in fig.data:
+        df_trace = df_max[df_max["variable"] == trace.name]
+        trace.customdata = np.stack((df_trace["value"], df_trace["year"]), axis=-1)
+    fig.update_traces(
+        hovertemplate="<b>Concentration:</b> %{y} ug/m<sup>3</sup><br> <b>Year of max. data:</b> %{customdata[1]} <extra></extra>",
+    )
+    return {
+        ("data",): fig.to_plotly_json()["data"],
+        ("layout", "title", "text"): f"Air quality data from {year_min_str} to {year_max_str}",
+        ("layout", "xaxis", "visible"): True,
+        ("layout", "yaxis", "visible"): True,
+        ("layout", "annotations"): [],
+    }
+
+
+def bar_max_figure(whodata, countries, year_1=None, year_2=None) -> dict:
+    """
+    Returns the whole bar plot of the max values (see bar_max_updates).
+    """
+    return helper_functions.apply_figure_updates(
+        bar_skeleton(), bar_max_updates(whodata, countries, year_1, year_2)
+    )
+
+
+def trend_figure(df: pd.DataFrame, selected_value: str, title_suffix: str = ""):
+    """
+    Line of the mean concentration over the years.
+
+    Args:
+    df (pd.DataFrame): the WHO data, e.g. of all countries or of one country
+    selected_value (str): the pollutant column
+    title_suffix (str): appended to the title, e.g. " in Switzerland"
+    """
+    title = f"mean {POLLUTANT_LABELS[selected_value]} value over the years{title_suffix}"
+
+    # the mean per year, an empty line if the pollutant has no values (e.g. in a country)
+    df_mean = df.groupby("year")[selected_value].mean().dropna().reset_index()
+
+    import plotly.express as px  # loaded with the first figure, not at startup
+
+    fig = px.line(df_mean, x="year", y=selected_value, title=title)
+    return fig
+
+
+def concentration_map(snapshot: pd.DataFrame, geocoded_df: pd.DataFrame, concentration: str):
+    """
+    Map of the mean concentration per site of a snapshot of the local data.
+
+    Args:
+    snapshot (pd.DataFrame): the snapshot (or the daily / monthly means of the history)
+    geocoded_df (pd.DataFrame): Location, Latitude and Longitude of the sites
+    concentration (str): the pollutant column
+    """
+    dff = snapshot.dropna(subset=[concentration])
+    dff = dff.groupby(["Location"]).mean(numeric_only=True).reset_index()
+    merged_df = pd.merge(dff, geocoded_df, on="Location")
+
+    import plotly.express as px  # loaded with the first figure, not at startup
+
+    fig = px.scatter_map(  # the mapbox traces are deprecated (removed with plotly 7)
+        merged_df,
+        lat="Latitude",
+        lon="Longitude",
+        map_style="open-street-map",
+        size=concentration,
+        color=concentration,
+        center={"lat": 46.8182, "lon": 8.2275},
+        zoom=7,
+        size_max=20,
+    )
+
+    fig.update_layout(
+        width=1000,
+        height=800,
+        title=f"mean {concentration} concentration on a specific date in Switzerland",
+    )
+
+    return fig
@@ -1,7 +1,10 @@
 """
-Submodul containing helper functions for dash (espeically data table filtering). 
+Submodul containing helper functions for dash (espeically data table filtering).
 """
 
+import numpy as np
+from dash import Patch
+
 # Operators translation table from the internal dash frontend syntax to the pandas syntax
 OPERATORS = [
     ["ge ", ">="],
@@ -43,3 +46,145 @@ def split_filter_part(filter_part):
                 return name, operator_type[0].strip(), value
 
     return [None] * 3
+
+
+def filter_mask(df, filter_query, text_columns, text_indexes=None):
+    """
+    Evaluate the filter query of a dash data table (custom filtering in the backend) on a dataframe.
+
+    Args:
+    df (pd.DataFrame): the data of the table
+    filter_query (str): the filter query of the data table, e.g. "{year_int} > 2015 && {city} contains Bern"
+    text_columns (list): columns on which the "contains" operator is applied, as it would
+    raise an error on non-string columns
+    text_indexes (dict): optional TextIndex per text column (built on df), to avoid scanning
+    all rows for the "contains" operator
+
+    Returns:
+    np.ndarray: boolean mask of the rows matching the filter
+    """
+    text_indexes = text_indexes or {}
+    # Split the filter query into individual filtering expressions
+    filtering_expressions = filter_query.split(" && ")
+    # the expressions are combined into one mask over all rows
+    mask = np.ones(len(df), dtype=bool)
+    # Apply each filtering expression to the DataFrame
+    for filter_part in filtering_expressions:
+        col_name, operator, filter_value = split_filter_part(
+            filter_part
+        )  # split the filter part
+        if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+            # Apply comparison operators to filter the DataFrame
+            mask &= getattr(df[col_name], operator)(filter_value).to_numpy()
+        elif operator == "contains" and col_name in text_columns:
+            text_index = text_indexes.get(col_name)
+            if text_index is not None and len(text_index) == len(df):
+                mask &= text_index.mask(filter_value)
+            else:
+                mask &= (
+                    df[col_name]
+                    .astype(str)
+                    .str.contains(str(filter_value), case=False, regex=False)
+                    .to_numpy()
+                )
+    return mask
+
+
+def filter_dataframe(df, filter_query, text_columns, text_indexes=None):
+    """
+    Apply the filter query of a dash data table (custom filtering in the backend) to a dataframe,
+    see filter_mask for the arguments.
+
+    Returns:
+    pd.DataFrame: the filtered data
+    """
+    return df.loc[filter_mask(df, filter_query, text_columns, text_indexes)]
+
+
+def sort_dataframe(df, sort_by):
+    """
+    Sort a dataframe by the sort_by property of a dash data table (custom sorting in the backend).
+
+    Args:
+    df (pd.DataFrame): the data of the table
+    sort_by (list): list of {"column_id": ..., "direction": "asc" / "desc"}
+
+    Returns:
+    pd.DataFrame: the sorted data
+    """
+    if len(sort_by):  # Code to sort the data based on the chosen column
+        df = df.sort_values(
+            [col["column_id"] for col in sort_by],
+            ascending=[col["direction"] == "asc" for col in sort_by],
+            inplace=False,
+        )
+    return df
+
+
+def query_positions(df, filter_query, sort_by, text_columns, text_indexes=None):
+    """
+    Returns the row positions of the filtered and sorted data of a dash data table,
+    so that each page is a slice of the positions (see filter_mask and sort_dataframe).
+
+    Returns:
+    np.ndarray: positions of the rows in df, in the sorted order
+    """
+    positions = np.flatnonzero(
+        filter_mask(df, filter_query, text_columns, text_indexes)
+    )
+    if len(sort_by):
+        # only the sorted columns of the filtered rows are copied
+        columns = list(dict.fromkeys(col["column_id"] for col in sort_by))
+        order = sort_dataframe(
+            df[columns].iloc[positions].reset_index(drop=True), sort_by
+        ).index
+        positions = positions[order.to_numpy()]
+    return positions
+
+
+def patch_figure(updates):
+    """
+    Translate a dictionary of figure updates into a dash Patch, so that only the changed
+    properties of a figure are sent to the webbrowser instead of the whole figure.
+
+    Args:
+    updates (dict): mapping of a property path (tuple of keys / list indices) to the new value,
+    e.g. {("layout", "title", "text"): "My title"}. Updates are applied in insertion order.
+
+    Returns:
+    dash.Patch: the partial property update of the figure
+    """
+    patched_figure = Patch()
+    for path, value in updates.items():
+        target = patched_figure
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = value
+    return patched_figure
+
+
+def apply_figure_updates(figure, updates):
+    """
+    Apply the same updates as patch_figure, but on the server side to a figure dictionary.
+    Used for the initial rendering of a figure, when the webbrowser does not have a figure
+    yet which could be patched. The figure is copied along the updated paths only, so that
+    cached figures are never modified.
+
+    Args:
+    figure (dict): the figure dictionary (e.g. from fig.to_plotly_json())
+    updates (dict): mapping of a property path to the new value, see patch_figure
+
+    Returns:
+    dict: the updated figure
+    """
+    figure = dict(figure)
+    for path, value in updates.items():
+        target = figure
+        for key in path[:-1]:
+            # copy on write, so that nested objects shared with the cached figure stay untouched
+            child = target[key] if isinstance(target, list) else target.get(key, {})
+            child = list(child) if isinstance(child, (list, tuple)) else dict(child)
+            target[key] = child
+            target = child
+        target[path[-1]] = value
+    return figure
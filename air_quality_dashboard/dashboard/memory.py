@@ -0,0 +1,248 @@
+"""
+Submodul containing the memory accounting of the dashboard, so that long-running processes can be
+watched: the bytes of each registered dataset and cache, the memory of the process and, on
+demand, the differences between tracemalloc snapshots (where the memory was allocated since the
+last snapshot). Everything is available as JSON on /admin/memory, for admins only (see admin).
+"""
+
+import collections
+import functools
+import sys
+import threading
+import tracemalloc
+import flask
+import numpy as np
+import pandas as pd
+from air_quality_dashboard.dashboard import admin
+
+try:
+    import resource
+except ImportError:  # not available on windows, the memory of the process is then not reported
+    resource = None
+
+TRACEMALLOC_FRAMES = 10  # frames stored per allocation while tracing
+TRACEMALLOC_TOP = 25  # lines of the largest differences reported
+
+blueprint = admin.protect(flask.Blueprint("memory", __name__, url_prefix="/admin/memory"))
+
+# registered datasets and caches, name -> function returning the bytes
+_datasets = {}
+_caches = {}
+# last tracemalloc snapshot, the next one is compared with it
+_tracemalloc = {"snapshot": None}
+
+
+def dataframe_bytes(df: pd.DataFrame) -> int:
+    """
+    Returns the bytes of a dataframe, including the python objects (e.g. strings) in it.
+    """
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
+
+def deep_sizeof(value) -> int:
+    """
+    Returns the approximated bytes of a value and everything it contains
+    (dicts, lists, tuples, sets, numpy arrays and dataframes).
+    """
+    seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        if isinstance(value, pd.DataFrame):
+            size += dataframe_bytes(value)
+            continue
+        if isinstance(value, np.ndarray):
+            size += value.nbytes
+            if value.dtype == object:
+                stack.extend(value.ravel())
+            continue
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+    return size
+
+
+def register_dataset(name: str, get_bytes) -> None:
+    """
+    Registers a dataset for the memory accounting.
+
+    Args:
+    name (str): the name shown in the accounting
+    get_bytes (callable): returns the current bytes of the dataset
+    """
+    _datasets[name] = get_bytes
+
+
+def register_cache(name: str, get_bytes) -> None:
+    """
+    Registers a cache for the memory accounting.
+
+    Args:
+    name (str): the name shown in the accounting
+    get_bytes (callable): returns the current bytes of the cache
+    """
+    _caches[name] = get_bytes
+
+
+def process_memory() -> dict:
+    """
+    Returns the current (resident) and the peak memory of the process in bytes.
+    """
+    memory = {"rss": None, "peak_rss": None}
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            memory["rss"] = int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, AttributeError):
+        pass  # not linux
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["peak_rss"] = peak if sys.platform == "darwin" else peak * 1024
+    return memory
+
+
+def accounting() -> dict:
+    """
+    Returns the bytes of the process, of each registered dataset and of each registered cache.
+    """
+    return {
+        "process": process_memory(),
+        "datasets": {name: get_bytes() for name, get_bytes in _datasets.items()},
+        "caches": {name: get_bytes() for name, get_bytes in _caches.items()},
+    }
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+
+
+def start_tracemalloc() -> None:
+    """
+    Starts the tracing of the allocations (it slows the process down) and takes the first
+    snapshot, the next tracemalloc_diff is compared with it.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    _tracemalloc["snapshot"] = _take_snapshot()
+
+
+def tracemalloc_diff(limit: int = TRACEMALLOC_TOP) -> list:
+    """
+    Takes a tracemalloc snapshot and compares it with the previous one (see start_tracemalloc).
+
+    Returns:
+    list: the lines of code with the largest growth of the allocated memory since the
+    previous snapshot, as dicts with file, line, size_diff, size, count_diff
+    (None if the allocations are not traced)
+    """
+    previous = _tracemalloc["snapshot"]
+    if not tracemalloc.is_tracing() or previous is None:
+        return None
+    snapshot = _take_snapshot()
+    _tracemalloc["snapshot"] = snapshot
+    return [
+        {
+            "file": stat.traceback[0].filename,
+            "line": stat.traceback[0].lineno,
+            "size_diff": stat.size_diff,
+            "size": stat.size,
+            "count_diff": stat.count_diff,
+        }
+        for stat in snapshot.compare_to(previous, "lineno")[:limit]
+    ]
+
+
+def stop_tracemalloc() -> None:
+    """
+    Stops the tracing of the allocations and drops the snapshot.
+    """
+    tracemalloc.stop()
+    _tracemalloc["snapshot"] = None
+
+
+def sized_cache(name: str, max_entries: int = 16, max_bytes: int = None, key=None):
+    """
+    Decorator caching the results of a function like functools.lru_cache, but bounded by the
+    bytes of the results as well, the least recently used results are evicted first.
+    The cache is registered for the memory accounting.
+
+    Args:
+    name (str): the name of the cache in the accounting
+    max_entries (int): maximum number of cached results
+    max_bytes (int): maximum bytes of the cached results (None for no limit)
+    key (callable): returns the key of the arguments (by default the arguments), e.g. to
+    keep the version of a dataset instead of the dataset itself
+    """
+
+    def decorator(function):
+        entries = collections.OrderedDict()  # arguments -> (result, bytes)
+        lock = threading.Lock()
+        size = {"bytes": 0}
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            cache_key = args if key is None else key(*args)
+            with lock:
+                if cache_key in entries:
+                    entries.move_to_end(cache_key)
+                    return entries[cache_key][0]
+            result = function(*args)
+            result_bytes = deep_sizeof(result)
+            with lock:
+                if cache_key not in entries:
+                    entries[cache_key] = (result, result_bytes)
+                    size["bytes"] += result_bytes
+                while len(entries) > max_entries or (
+                    max_bytes is not None and size["bytes"] > max_bytes and len(entries) > 1
+                ):
+                    _evicted, (_result, evicted_bytes) = entries.popitem(last=False)
+                    size["bytes"] -= evicted_bytes
+            return result
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+                size["bytes"] = 0
+
+        wrapper.cache_bytes = lambda: size["bytes"]
+        wrapper.cache_len = lambda: len(entries)
+        wrapper.cache_clear = cache_clear
+        register_cache(name, wrapper.cache_bytes)
+        return wrapper
+
+    return decorator
+
+
+@blueprint.route("/")
+def memory():
+    """
+    Returns the memory accounting of the process, the datasets and the caches.
+    """
+    return flask.jsonify(accounting())
+
+
+@blueprint.route("/tracemalloc", methods=["GET", "POST"])
+def tracemalloc_snapshot():
+    """
+    Returns the growth of the allocated memory since the previous call while the allocations
+    are traced. The tracing is started with a POST (and stopped with a POST with ?stop=1),
+    a GET never starts it.
+    """
+    if flask.request.method == "POST":
+        if flask.request.args.get("stop") == "1":
+            stop_tracemalloc()
+            return flask.jsonify({"tracing": False})
+        start_tracemalloc()
+        return flask.jsonify({"tracing": True, "top": []})
+    top = tracemalloc_diff()
+    return flask.jsonify({"tracing": top is not None, "top": top or []})
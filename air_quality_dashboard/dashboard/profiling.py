@@ -0,0 +1,319 @@
+"""
+Submodul containing an opt-in profiling of single requests of the dash server, e.g. to find out
+why a callback is slow in production. A request is profiled (cProfile) if it has the header
+"X-Profile: 1", if the page was opened with ?profile=1 (a cookie then profiles all callbacks of
+the webbrowser until ?profile=0), or by sampling a share of all requests. The header and the flag
+are only honoured for admins (see admin) and with AIR_QUALITY_PROFILE_REQUESTS=1 or an admin
+token, so that no visitor can slow the server down. The profiles are stored with a flame graph in
+a local directory and listed on /admin/profiles, the slowest first.
+"""
+
+import collections
+import cProfile
+import html
+import json
+import os
+import pstats
+import random
+import time
+import uuid
+import zlib
+import flask
+from air_quality_dashboard.dashboard import admin
+
+DEFAULT_DIRECTORY = os.environ.get("AIR_QUALITY_PROFILE_DIRECTORY", "profiles")
+# share of the requests profiled without being asked for, e.g. 0.01 for 1%
+DEFAULT_SAMPLE_RATE = float(os.environ.get("AIR_QUALITY_PROFILE_SAMPLE", 0))
+# profiling on demand (header, query flag, cookie), also enabled by an admin token
+PROFILE_REQUESTS = os.environ.get("AIR_QUALITY_PROFILE_REQUESTS") == "1"
+MAX_PROFILES = 200  # the older profiles are removed
+PROFILE_HEADER = "X-Profile"
+PROFILE_FLAG = "profile"  # query flag and cookie
+
+FLAME_GRAPH_WIDTH = 1200  # pixels
+FLAME_GRAPH_ROW = 16  # pixels per level of the call stack
+FLAME_GRAPH_MAX_DEPTH = 80
+FLAME_GRAPH_MIN_WIDTH = 0.001  # calls below this share of the total time are left out
+
+blueprint = admin.protect(
+    flask.Blueprint("profiling", __name__, url_prefix="/admin/profiles")
+)
+
+
+def profile_requested(
+    request: flask.Request, sample_rate: float = 0, allow_requests: bool = True
+) -> bool:
+    """
+    Returns whether a request has to be profiled (header, query flag, cookie or sampling).
+
+    Args:
+    request (flask.Request): the request
+    sample_rate (float): share of the requests profiled without being asked for
+    allow_requests (bool): whether the header, query flag and cookie are honoured
+    """
+    if allow_requests:
+        if request.headers.get(PROFILE_HEADER) == "1":
+            return True
+        flag = request.args.get(PROFILE_FLAG, request.cookies.get(PROFILE_FLAG))
+        if flag is not None:
+            return flag == "1"
+    return random.random() < sample_rate
+
+
+def request_name(request: flask.Request, callback_map: dict = None) -> str:
+    """
+    Returns a readable name of the request, the callback function and its output for the
+    callbacks of dash (e.g. "globe_representation (globe.figure)"), otherwise the path.
+    """
+    if not request.path.endswith("_dash-update-component"):
+        return request.path
+    output = (request.get_json(silent=True) or {}).get("output", "")
+    callback = (callback_map or {}).get(output, {}).get("callback")
+    if callback is None:
+        return output
+    return f"{callback.__name__} ({output})"
+
+
+def _label(function) -> str:
+    filename, line, name = function
+    if filename == "~":  # built-in function
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def flame_graph(stats: pstats.Stats) -> list:
+    """
+    Lays out the call tree of the profile as flame graph. cProfile only records the time per
+    caller and callee, hence the time of a function is split on its callees in proportion to
+    their time over all calls (recursive calls are left out).
+
+    Returns:
+    list: rectangles (start, depth, width, label), start and width in seconds
+    """
+    children = collections.defaultdict(dict)
+    totals = {}
+    roots = []
+    for function, (_cc, _nc, _tt, ct, callers) in stats.stats.items():
+        totals[function] = ct
+        for caller, (_edge_nc, _edge_cc, _edge_tt, edge_ct) in callers.items():
+            children[caller][function] = edge_ct
+        if not callers:
+            roots.append(function)
+    min_width = FLAME_GRAPH_MIN_WIDTH * sum(totals[root] for root in roots)
+
+    rectangles = []
+    # depth first, (function, start, width, depth, functions on the path)
+    stack = []
+    start = 0.0
+    for root in sorted(roots, key=lambda root: -totals[root]):
+        stack.append((root, start, totals[root], 0, frozenset([root])))
+        start += totals[root]
+    while stack:
+        function, start, width, depth, path = stack.pop()
+        rectangles.append((start, depth, width, _label(function)))
+        if depth + 1 >= FLAME_GRAPH_MAX_DEPTH or totals[function] <= 0:
+            continue
+        scale = width / totals[function]
+        end = start + width
+        for child, child_time in sorted(
+            children[function].items(), key=lambda item: -item[1]
+        ):
+            child_width = min(child_time * scale, end - start)
+            if child in path or child_width < min_width:
+                continue
+            stack.append((child, start, child_width, depth + 1, path | {child}))
+            start += child_width
+    return rectangles
+
+
+def render_flame_graph(stats: pstats.Stats, title: str = "") -> str:
+    """
+    Renders the flame graph of a profile as SVG (the width of a function is its time,
+    its callees are stacked on top of it, the title of each box shows the details).
+    """
+    rectangles = flame_graph(stats)
+    total = sum(width for _start, depth, width, _label in rectangles if depth == 0)
+    depth_max = max((depth for _start, depth, _width, _label in rectangles), default=0)
+    height = (depth_max + 3) * FLAME_GRAPH_ROW
+    scale = FLAME_GRAPH_WIDTH / total if total > 0 else 0
+    elements = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_GRAPH_WIDTH}" '
+        f'height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="4" y="12">{html.escape(title)} ({total * 1000:.1f} ms)</text>',
+    ]
+    for start, depth, width, label in rectangles:
+        x, box_width = start * scale, width * scale
+        y = height - (depth + 1) * FLAME_GRAPH_ROW
+        # warm colors, stable per function
+        hue = zlib.crc32(label.encode()) % 50
+        text = label[: int(box_width / 7)]
+        elements.append(
+            f'<g><title>{html.escape(label)}: {width * 1000:.1f} ms '
+            f"({width / total:.1%})</title>"
+            f'<rect x="{x:.2f}" y="{y}" width="{box_width:.2f}" '
+            f'height="{FLAME_GRAPH_ROW - 1}" fill="hsl({hue}, 80%, 60%)"/>'
+            f'<text x="{x + 2:.2f}" y="{y + FLAME_GRAPH_ROW - 4}">{html.escape(text)}</text></g>'
+        )
+    elements.append("</svg>")
+    return "\n".join(elements)
+
+
+def save_profile(
+    profile: cProfile.Profile,
+    name: str,
+    duration: float,
+    directory: str = DEFAULT_DIRECTORY,
+    max_profiles: int = MAX_PROFILES,
+) -> str:
+    """
+    Stores the profile of a request (.prof, readable with pstats or snakeviz), its flame graph
+    (.svg) and a summary (.json), the oldest profiles above max_profiles are removed.
+
+    Returns:
+    str: the id of the profile
+    """
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+    profile_id = (
+        f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}"
+        f"-{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:6]}"
+    )
+    path = os.path.join(directory, profile_id)
+    profile.dump_stats(path + ".prof")
+    stats = pstats.Stats(path + ".prof")
+    with open(path + ".svg", "w", encoding="utf-8") as file:
+        file.write(render_flame_graph(stats, name))
+    with open(path + ".json", "w", encoding="utf-8") as file:
+        json.dump(
+            {"id": profile_id, "name": name, "duration": duration, "time": now},
+            file,
+        )
+    # the ids start with the time, i.e. sorted from the oldest to the newest
+    summaries = sorted(entry for entry in os.listdir(directory) if entry.endswith(".json"))
+    for summary in summaries[: max(len(summaries) - max_profiles, 0)]:
+        for extension in (".json", ".prof", ".svg"):
+            try:
+                os.remove(os.path.join(directory, summary[: -len(".json")] + extension))
+            except FileNotFoundError:
+                pass  # removed by another process
+    return profile_id
+
+
+def list_profiles(directory: str = DEFAULT_DIRECTORY) -> list:
+    """
+    Returns the summaries of the stored profiles, the slowest requests first.
+    """
+    profiles = []
+    if not os.path.isdir(directory):
+        return profiles
+    for entry in os.listdir(directory):
+        if not entry.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, entry), encoding="utf-8") as file:
+                profiles.append(json.load(file))
+        except (OSError, ValueError):
+            continue  # removed or being written
+    return sorted(profiles, key=lambda profile: -profile["duration"])
+
+
+def enable_profiling(
+    server: flask.Flask,
+    callback_map: dict = None,
+    directory: str = DEFAULT_DIRECTORY,
+    sample_rate: float = DEFAULT_SAMPLE_RATE,
+    max_profiles: int = MAX_PROFILES,
+    allow_requests: bool = PROFILE_REQUESTS,
+) -> None:
+    """
+    Profiles the requested (or sampled) requests of the flask server behind the dash app and
+    registers the admin page /admin/profiles.
+
+    Args:
+    server (flask.Flask): the flask server of the dash app (app.server)
+    callback_map (dict): the callbacks of the dash app (app.callback_map), for the names
+    directory (str): the directory of the profiles
+    sample_rate (float): share of the requests profiled without being asked for
+    max_profiles (int): number of profiles kept
+    allow_requests (bool): honour the header, query flag and cookie of the admins
+    (always with an admin token)
+    """
+    server.config["PROFILE_DIRECTORY"] = directory
+    server.register_blueprint(blueprint)
+
+    @server.before_request
+    def start_profile():
+        if flask.request.path.startswith(blueprint.url_prefix):
+            return
+        allowed = allow_requests or bool(admin.ADMIN_TOKEN)
+        flask.g.profile_allowed = allowed and admin.is_admin(flask.request)
+        if not profile_requested(flask.request, sample_rate, flask.g.profile_allowed):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active
+            return
+        flask.g.profile = profile
+        flask.g.profile_start = time.perf_counter()
+
+    @server.after_request
+    def stop_profile(response):
+        profile = flask.g.pop("profile", None)
+        if profile is not None:
+            profile.disable()
+            duration = time.perf_counter() - flask.g.pop("profile_start")
+            save_profile(
+                profile,
+                request_name(flask.request, callback_map),
+                duration,
+                directory,
+                max_profiles,
+            )
+        # ?profile=1 profiles the following callbacks of the webbrowser as well
+        flag = flask.request.args.get(PROFILE_FLAG)
+        if flask.g.pop("profile_allowed", False) and flag is not None:
+            if flag == "1":
+                response.set_cookie(PROFILE_FLAG, "1", httponly=True, samesite="Strict")
+            else:
+                response.delete_cookie(PROFILE_FLAG)
+        return response
+
+
+@blueprint.route("/")
+def profiles():
+    """
+    Lists the profiled requests, the slowest first, with links to their flame graph and profile.
+    """
+    rows = [
+        "<tr><td>{time}</td><td>{duration:.1f} ms</td><td>{name}</td>"
+        '<td><a href="{id}.svg">flame graph</a> <a href="{id}.prof">profile</a></td></tr>'.format(
+            time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(profile["time"])),
+            duration=profile["duration"] * 1000,
+            name=html.escape(profile["name"]),
+            id=profile["id"],
+        )
+        for profile in list_profiles(flask.current_app.config["PROFILE_DIRECTORY"])
+    ]
+    return (
+        "<html><head><title>Profiles</title></head><body><h1>Profiled requests</h1>"
+        "<p>Profile a request with the header X-Profile: 1, or open a page with ?profile=1 "
+        "to profile its callbacks (?profile=0 to stop).</p>"
+        "<table><tr><th>Time</th><th>Duration</th><th>Request</th><th></th></tr>"
+        + "".join(rows)
+        + "</table></body></html>"
+    )
+
+
+@blueprint.route("/<profile_id>.<extension>")
+def profile_file(profile_id, extension):
+    """
+    Returns the flame graph (.svg) or the profile (.prof) of a request.
+    """
+    if extension not in ("svg", "prof"):
+        flask.abort(404)
+    return flask.send_from_directory(
+        os.path.abspath(flask.current_app.config["PROFILE_DIRECTORY"]),
+        f"{profile_id}.{extension}",
+        as_attachment=extension == "prof",
+    )
@@ -0,0 +1,126 @@
+"""
+Submodul containing a server-side store for the results of the data table queries. The row
+positions of a filtered and sorted table are kept per session and query in a SQLite file, so that
+paging through the result does not filter and sort the whole data again. The file is shared by
+all worker processes of the server, entries expire after a TTL and the least recently used
+entries are evicted when the store exceeds its size.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+from air_quality_dashboard.data_parser import atomic
+
+# None for the file results.sqlite in the runtime directory of the user (see atomic)
+DEFAULT_PATH = os.environ.get("AIR_QUALITY_RESULT_STORE")
+DEFAULT_TTL = 30 * 60  # seconds
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def query_key(session_id, table_id, data_version, filter_query, sort_by) -> str:
+    """
+    Returns the key of a table query of a session, on a version of the data.
+    """
+    query = json.dumps(
+        [session_id, table_id, str(data_version), filter_query or "", sort_by or []],
+        sort_keys=True,
+    )
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class ResultStore:
+    """
+    Row positions of the query results, stored in a SQLite file with TTL and size bound.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        """
+        Args:
+        path (str): the SQLite file, shared by the processes using the same path, in a directory
+        private to the user (see atomic.private_directory)
+        ttl (float): seconds after the last access when an entry expires
+        max_bytes (int): size of the stored positions above which entries are evicted
+        """
+        if path is None:
+            path = os.path.join(atomic.private_directory(), "results.sqlite")
+        else:  # only the user of the server may write the stored positions
+            path = os.path.join(
+                atomic.private_directory(os.path.dirname(os.path.abspath(path))),
+                os.path.basename(path),
+            )
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, accessed REAL, size INTEGER, positions BLOB)"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one connection per operation, sqlite connections can't be shared between threads
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            with connection:  # commits the transaction, or rolls it back on an error
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, key: str):
+        """
+        Returns the row positions of a query, or None if they are not stored (or expired).
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT positions FROM results WHERE key = ? AND accessed >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return np.frombuffer(row[0], dtype=np.int32)
+
+    def put(self, key: str, positions) -> None:
+        """
+        Stores the row positions of a query and evicts expired and least recently used entries.
+        """
+        blob = np.asarray(positions, dtype=np.int32).tobytes()
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, now, len(blob), blob),
+            )
+            connection.execute(
+                "DELETE FROM results WHERE accessed < ?", (now - self.ttl,)
+            )
+            total = 0
+            evicted = []
+            for entry_key, size in connection.execute(
+                "SELECT key, size FROM results ORDER BY accessed DESC"
+            ):
+                total += size
+                if total > self.max_bytes and entry_key != key:
+                    evicted.append((entry_key,))
+            connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def clear(self) -> None:
+        """
+        Removes all entries.
+        """
+        with self._connect() as connection:
+            connection.execute("DELETE FROM results")
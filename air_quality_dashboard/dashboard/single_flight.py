@@ -0,0 +1,221 @@
+"""
+Submodul containing a single-flight layer for expensive callback computations. Concurrent calls
+with the same inputs (and version of the dataset) wait for one computation in flight and share
+its result, instead of computing it again, e.g. when many users open a page at the same time.
+Within a process the calls wait on the computing thread. Between the worker processes, the first
+call claims the key with a file and the others poll for its result, which is handed over through
+a short-lived pickle file. No lock is held while computing, and results larger than
+max_shared_bytes are not handed over (each process computes them itself).
+"""
+
+import collections
+import functools
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from air_quality_dashboard.data_parser import atomic
+
+# None for the directory "flights" in the runtime directory of the user (see atomic)
+DEFAULT_DIRECTORY = os.environ.get("AIR_QUALITY_SINGLE_FLIGHT")
+DEFAULT_TTL = 10  # seconds a result is handed over to the calls of other worker processes
+# larger results are not handed over, pickling and reading them costs more than computing them
+DEFAULT_MAX_SHARED_BYTES = 1_000_000
+CLAIM_TIMEOUT = 60  # seconds after which a claim is ignored (e.g. of a process which died)
+POLL_INTERVAL = 0.05  # seconds between the checks for the result of another process
+
+_MISSING = object()
+
+
+def flight_key(name: str, version, args) -> str:
+    """
+    Returns the key of a call of the function name with the arguments, on a version of the data.
+    """
+    call = json.dumps([name, str(version), args], sort_keys=True, default=str)
+    return hashlib.sha256(call.encode()).hexdigest()
+
+
+class _Call:
+    """
+    A computation in flight, the waiting threads get its result or its error.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces the concurrent calls with the same key into one computation.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_DIRECTORY,
+        ttl: float = DEFAULT_TTL,
+        shared: bool = True,
+        max_shared_bytes: int = DEFAULT_MAX_SHARED_BYTES,
+    ) -> None:
+        """
+        Args:
+        directory (str): the directory of the claim and result files, shared by the processes
+        using the same directory, it has to be private to the user (the results are unpickled)
+        ttl (float): seconds a result file is used by the calls of other processes
+        shared (bool): coalesce the calls between the processes, otherwise only between
+        the threads of this process
+        max_shared_bytes (int): larger results (pickled) are not handed over to other processes
+        """
+        if shared:
+            if directory is None:
+                directory = os.path.join(atomic.private_directory(), "flights")
+            directory = atomic.private_directory(directory)
+        self.directory = directory
+        self.ttl = ttl
+        self.shared = shared
+        self.max_shared_bytes = max_shared_bytes
+        self.stats = collections.Counter()  # computed, coalesced (threads), shared (processes)
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _count(self, event: str) -> None:
+        with self._lock:
+            self.stats[event] += 1
+
+    def do(self, key: str, function, *args, **kwargs):
+        """
+        Returns function(*args, **kwargs), computed once for all concurrent calls with the key.
+        If the computation fails, all waiting calls raise its error.
+        """
+        return self._do(key, function, args, kwargs, self.shared)
+
+    def _do(self, key: str, function, args, kwargs, shared: bool):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            self._count("coalesced")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if shared:
+                call.result = self._compute_shared(key, function, args, kwargs)
+            else:
+                self._count("computed")
+                call.result = function(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _compute_shared(self, key, function, args, kwargs):
+        path = os.path.join(self.directory, key)
+        while True:
+            handed_over = self._load(path)
+            if handed_over is not _MISSING:
+                is_shared, result = handed_over
+                if not is_shared:  # too large, computed by each process
+                    break
+                self._count("shared")
+                return result
+            if self._claim(path + ".claim"):
+                try:
+                    self._count("computed")
+                    result = function(*args, **kwargs)
+                    self._store(path, result)
+                finally:
+                    os.remove(path + ".claim")
+                return result
+            time.sleep(POLL_INTERVAL)  # another process is computing it
+        self._count("computed")
+        return function(*args, **kwargs)
+
+    def _claim(self, path) -> bool:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(path) > CLAIM_TIMEOUT:
+                os.remove(path)  # the next poll claims it
+        except FileNotFoundError:
+            pass  # released in the meantime
+        return False
+
+    def _load(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return _MISSING
+            with open(path, "rb") as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+
+    def _store(self, path, result) -> None:
+        now = time.time()
+        # results of other calls which are not handed over anymore and claims of processes
+        # which died (the temporary .pickle files are being written by other processes)
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                continue
+            timeout = CLAIM_TIMEOUT if entry.name.endswith(".claim") else self.ttl
+            try:
+                if now - entry.stat().st_mtime > timeout:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # removed by another process
+        try:
+            data = pickle.dumps((True, result), protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            print(f"The result can't be shared with the other processes: {e}")
+            data = None
+        if data is None or len(data) > self.max_shared_bytes:
+            # the waiting processes compute it themselves, instead of claiming it one by one
+            data = pickle.dumps((False, None))
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=self.directory, suffix=".pickle", delete=False
+        ) as file:
+            file.write(data)
+        os.replace(file.name, path)  # the other processes never read a partial file
+
+    def coalesced(self, version=lambda: None, shared: bool = True):
+        """
+        Decorator coalescing the concurrent calls of a function with the same arguments.
+
+        Args:
+        version (callable): returns the version of the data the function depends on,
+        calls on different versions are not coalesced
+        shared (bool): coalesce the calls between the processes as well (if the SingleFlight
+        is shared), e.g. not for results which are always too large to be handed over
+        """
+
+        def decorator(function):
+            name = f"{function.__module__}.{function.__qualname__}"
+
+            @functools.wraps(function)
+            def wrapper(*args):
+                return self._do(
+                    flight_key(name, version(), args),
+                    function,
+                    args,
+                    {},
+                    shared and self.shared,
+                )
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,80 @@
+"""
+Submodul containing a trigram index over the distinct values of a string column, used for the
+"contains" filter of the data tables. Only the distinct values are searched, the matching values
+are then mapped to the rows through the categorical codes of the column.
+"""
+
+import numpy as np
+import pandas as pd
+
+NGRAM_SIZE = 3
+
+
+def _ngrams(text):
+    return {text[i : i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class TextIndex:
+    """
+    Case insensitive substring index over one column of a dataframe.
+    """
+
+    def __init__(self, values: pd.Series) -> None:
+        """
+        Args:
+        values (pd.Series): the column to index, the row order is kept for the masks
+        """
+        categorical = values.astype("category")
+        self.codes = categorical.cat.codes.to_numpy()  # -1 for missing values
+        self.values = [str(value).casefold() for value in categorical.cat.categories]
+        postings = {}
+        for code, value in enumerate(self.values):
+            for ngram in _ngrams(value):
+                postings.setdefault(ngram, []).append(code)
+        self.postings = {
+            ngram: np.array(codes, dtype=np.int32) for ngram, codes in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def matching_codes(self, substring: str) -> np.ndarray:
+        """
+        Returns the codes of the distinct values containing the substring (case insensitive).
+        """
+        substring = str(substring).casefold()
+        ngrams = _ngrams(substring)
+        if ngrams:
+            # candidates contain all ngrams of the substring, the shortest posting list first
+            posting_lists = sorted(
+                (self.postings.get(ngram, np.empty(0, dtype=np.int32)) for ngram in ngrams),
+                key=len,
+            )
+            candidates = posting_lists[0]
+            for posting_list in posting_lists[1:]:
+                candidates = np.intersect1d(candidates, posting_list, assume_unique=True)
+        else:  # too short for ngrams, scan the distinct values
+            candidates = range(len(self.values))
+        return np.array(
+            [code for code in candidates if substring in self.values[code]],
+            dtype=np.int32,
+        )
+
+    def mask(self, substring: str) -> np.ndarray:
+        """
+        Returns a boolean mask of the rows containing the substring.
+        """
+        # the last entry stays False and is hit by the code -1 of missing values
+        hits = np.zeros(len(self.values) + 1, dtype=bool)
+        hits[self.matching_codes(substring)] = True
+        return hits[self.codes]
+
+
+def build_text_indexes(df: pd.DataFrame, columns: list) -> dict:
+    """
+    Builds a TextIndex for each of the columns of a dataframe.
+
+    Returns:
+    dict: column -> TextIndex
+    """
+    return {column: TextIndex(df[column]) for column in columns}
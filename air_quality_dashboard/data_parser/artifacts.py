@@ -0,0 +1,174 @@
+"""
+Module containing the cache artifacts of the offline build (python -m air_quality_dashboard build).
+The derived data (dtype-converted dataframes, dropdown options, geocodes, aggregates) is written
+into a versioned directory together with a manifest holding the checksum of each artifact, so that
+the web process only has to load and verify the files instead of deriving everything at import.
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+
+BUILD_DIRECTORY = os.environ.get("AIR_QUALITY_BUILD_DIRECTORY", "build")
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"  # contains the version of the build in use
+
+
+class ArtifactError(Exception):
+    """
+    Raised if an artifact is missing or does not match the checksum of the manifest.
+    """
+
+
+def sha256_file(path: str) -> str:
+    """
+    Returns the sha256 checksum of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # written to a temporary file first, the rename is atomic
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temporary_path, path)
+
+
+class ArtifactWriter:
+    """
+    Writes the artifacts of one build version and its manifest.
+    """
+
+    def __init__(self, version: str, directory: str = BUILD_DIRECTORY) -> None:
+        """
+        Args:
+        version (str): version of the build, e.g. a hash of the inputs
+        directory (str): the directory containing all build versions
+        """
+        self.version = version
+        self.directory = directory
+        self.version_directory = os.path.join(directory, version)
+        os.makedirs(self.version_directory, exist_ok=True)
+        self.manifest = {"version": version, "artifacts": {}, "timings": {}}
+
+    def write(self, name: str, value) -> None:
+        """
+        Writes an artifact, dataframes as compressed pickle, everything else as json.
+        """
+        if isinstance(value, pd.DataFrame):
+            file_name = f"{name}.xz"
+            value.to_pickle(
+                os.path.join(self.version_directory, file_name), compression="xz"
+            )
+            rows = len(value)
+        else:
+            file_name = f"{name}.json"
+            with open(
+                os.path.join(self.version_directory, file_name), "w", encoding="utf-8"
+            ) as file:
+                json.dump(value, file)
+            rows = None
+        self.manifest["artifacts"][name] = {
+            "file": file_name,
+            "sha256": sha256_file(os.path.join(self.version_directory, file_name)),
+            "rows": rows,
+        }
+
+    def commit(self, inputs: dict, timings: dict) -> str:
+        """
+        Writes the manifest and makes this version the current build.
+
+        Args:
+        inputs (dict): description of the inputs of the build
+        timings (dict): duration in seconds of each build step
+
+        Returns:
+        str: the path of the manifest
+        """
+        self.manifest["inputs"] = inputs
+        self.manifest["timings"] = timings
+        self.manifest["created"] = pd.Timestamp.now(tz="UTC").isoformat()
+        manifest_path = os.path.join(self.version_directory, MANIFEST_NAME)
+        _write_atomic(manifest_path, json.dumps(self.manifest, indent=2))
+        _write_atomic(os.path.join(self.directory, CURRENT_NAME), self.version)
+        return manifest_path
+
+
+def current_version(directory: str = BUILD_DIRECTORY) -> str:
+    """
+    Returns the version of the current build, or None if nothing was built.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_NAME), encoding="utf-8") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def load_manifest(version: str = None, directory: str = BUILD_DIRECTORY) -> dict:
+    """
+    Returns the manifest of a build version (by default the current one).
+    """
+    version = version or current_version(directory)
+    if version is None:
+        raise ArtifactError(f"There is no build in {directory}")
+    with open(os.path.join(directory, version, MANIFEST_NAME), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load_artifact(name: str, version: str = None, directory: str = BUILD_DIRECTORY):
+    """
+    Loads an artifact of a build version (by default the current one) after verifying its checksum.
+    """
+    manifest = load_manifest(version, directory)
+    if name not in manifest["artifacts"]:
+        raise ArtifactError(f"The build {manifest['version']} has no artifact {name}")
+    entry = manifest["artifacts"][name]
+    path = os.path.join(directory, manifest["version"], entry["file"])
+    if sha256_file(path) != entry["sha256"]:
+        raise ArtifactError(f"The artifact {name} does not match its checksum")
+    if entry["file"].endswith(".xz"):
+        return pd.read_pickle(path)
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load_current(name: str, directory: str = BUILD_DIRECTORY):
+    """
+    Loads an artifact of the current build, returns None if there is no (valid) artifact,
+    in which case the data has to be derived at runtime.
+    """
+    if current_version(directory) is None:
+        return None
+    try:
+        return load_artifact(name, directory=directory)
+    except (ArtifactError, OSError) as e:
+        print(f"Cannot use the build artifact {name}: {e}")
+        return None
+
+
+def validate(version: str = None, directory: str = BUILD_DIRECTORY) -> list:
+    """
+    Verifies that all artifacts of a build exist and match the checksums of the manifest.
+
+    Returns:
+    list: the problems found, empty if the build is valid
+    """
+    try:
+        manifest = load_manifest(version, directory)
+    except (ArtifactError, OSError, ValueError) as e:
+        return [str(e)]
+    problems = []
+    for name, entry in manifest["artifacts"].items():
+        path = os.path.join(directory, manifest["version"], entry["file"])
+        if not os.path.exists(path):
+            problems.append(f"{name}: {entry['file']} is missing")
+        elif sha256_file(path) != entry["sha256"]:
+            problems.append(f"{name}: {entry['file']} does not match its checksum")
+    return problems
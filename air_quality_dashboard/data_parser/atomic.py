@@ -0,0 +1,184 @@
+"""
+Module containing the atomic commits of the data files shared by the worker processes. A file is
+written into a temporary file in the same directory and renamed over the old version, so that the
+readers never see a partial file and never have to wait for a writer. A writer lock elects the
+single process which ingests a data source, the other processes read the committed versions.
+The files exchanged between the processes at runtime (e.g. the coalesced results) are kept in a
+directory which only the user of the server can access.
+"""
+
+import contextlib
+import json
+import os
+import stat
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not available on windows, every process is a writer then
+    fcntl = None
+
+# read once, os.umask can only be read by setting it (for all threads of the process)
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+# per user, the files in it are unpickled, hence no other user may be able to write into it
+RUNTIME_DIRECTORY = os.environ.get(
+    "AIR_QUALITY_RUNTIME_DIRECTORY",
+    os.path.join(
+        tempfile.gettempdir(),
+        f"air_quality_dashboard-{os.getuid() if hasattr(os, 'getuid') else 'user'}",
+    ),
+)
+
+
+def _file_mode(path: str) -> int:
+    # the mode of the existing file, otherwise the default mode of a new file
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+@contextlib.contextmanager
+def commit(path: str):
+    """
+    Context manager yielding a temporary path to write to, which is renamed to path if the
+    block succeeds and removed otherwise. The temporary path is unique, hence concurrent
+    writers of the same file never write into the same temporary file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    os.close(handle)
+    try:
+        yield temporary_path
+        # mkstemp creates the file for its owner only, the commit keeps the mode of the file
+        os.chmod(temporary_path, _file_mode(path))
+        os.replace(temporary_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary_path)
+        raise
+
+
+def _is_private(path: str) -> bool:
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode):  # e.g. a symbolic link
+        return False
+    if not hasattr(os, "getuid"):  # windows, the temporary directory is per user
+        return True
+    return status.st_uid == os.getuid() and not status.st_mode & 0o022
+
+
+def private_directory(path: str = RUNTIME_DIRECTORY) -> str:
+    """
+    Creates a directory only accessible by the current user (mode 0700). An existing directory
+    is only used if it belongs to the current user and is not writable by group or others,
+    otherwise (e.g. created by another user in the shared temporary directory) a new temporary
+    directory of this process is used, i.e. the files are not shared with the other processes.
+
+    Returns:
+    str: the path of the private directory
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if _is_private(path):
+            return path
+    except OSError:
+        pass
+    print(f"The directory {path} is not private to this user, using a temporary one instead")
+    return tempfile.mkdtemp(prefix="air_quality_dashboard-")
+
+
+def write_pickle(df, path: str, compression="xz") -> None:
+    """
+    Writes a dataframe into a pickle file atomically (see commit).
+    """
+    with commit(path) as temporary_path:
+        df.to_pickle(temporary_path, compression=compression)
+
+
+def write_json(value, path: str) -> None:
+    """
+    Writes a value into a json file atomically (see commit).
+    """
+    with commit(path) as temporary_path:
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(value, file)
+
+
+def file_version(path: str):
+    """
+    Returns the version of a file (inode, modification time and size), which changes with
+    every commit, or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class WriterLock:
+    """
+    Inter-process lock electing the writer of a data file: the process holding the lock ingests
+    the data, the other processes only read the committed versions. The lock is kept until it is
+    released or the process exits, another process then takes over with its next acquire.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+        path (str): the data file, the lock file is path + ".lock"
+        """
+        self.path = path + ".lock"
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def held(self) -> bool:
+        """
+        Whether this process is the writer.
+        """
+        return self._file is not None or fcntl is None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        """
+        Tries to become the writer, waits for the current writer if blocking.
+
+        Returns:
+        bool: whether this process is the writer
+        """
+        with self._lock:
+            if self.held:
+                return True
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            file = open(self.path, "a", encoding="utf-8")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                return False
+            self._file = file
+            return True
+
+    def release(self) -> None:
+        """
+        Stops being the writer, so that another process can take over.
+        """
+        with self._lock:
+            if self._file is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "WriterLock":
+        self.acquire(blocking=True)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
@@ -0,0 +1,178 @@
+"""
+Module containing the comparison of the local data (e.g. NABEL) with the WHO data. The local sites
+are matched once per dataset version with the nearest WHO city within a radius (spatial index of
+the WHO stations), and the local snapshots are aggregated into yearly means per site, which are
+updated with every new snapshot. The comparison is then rendered from these small tables, without
+joining the archives.
+"""
+
+import functools
+import pandas as pd
+from air_quality_dashboard.data_parser import retention
+
+MATCH_RADIUS_KM = 10
+# WHO column -> local column, both in µg/m³ (the local sources don't publish PM2.5)
+POLLUTANTS = {"pm10_concentration": "PM10", "no2_concentration": "NO2"}
+MATCH_COLUMNS = ["Location", "city", "distance_km"]
+
+
+def match_sites(sites: pd.DataFrame, whodata, country: str, radius_km: float = MATCH_RADIUS_KM):
+    """
+    Matches each local site with the nearest WHO city of the same country within a radius.
+
+    Args:
+    sites (pd.DataFrame): Location, Latitude and Longitude of the local sites
+    whodata (WHOData): the WHO data, its spatial index of the stations is used
+    country (str): the country of the local sites (country_name of the WHO data)
+    radius_km (float): sites without a WHO city within the radius are left out
+
+    Returns:
+    pd.DataFrame: Location, city and distance_km of each matched site
+    """
+    stations = whodata.stations
+    matches = []
+    for site in sites.itertuples(index=False):
+        indices, distances = whodata.spatial_index.radius(
+            site.Latitude, site.Longitude, radius_km
+        )
+        for index, distance in zip(indices, distances):  # sorted by distance
+            if stations["country_name"].iat[index] == country:
+                matches.append((site.Location, stations["city"].iat[index], distance))
+                break
+    return pd.DataFrame(matches, columns=MATCH_COLUMNS)
+
+
+class YearlyMeans:
+    """
+    Yearly means of the pollutants per local site, weighted by the hours a row stands for
+    (1 for the snapshots, 24 for the daily means, the days of the month for the monthly means
+    of the downsampled history), which can be updated with new snapshots.
+    """
+
+    def __init__(self, value_columns: list) -> None:
+        self.value_columns = value_columns
+        self.sums = None  # (Location, year) -> weighted sum per pollutant
+        self.hours = None  # (Location, year) -> hours with a value per pollutant
+        self.last_timestamp = None
+
+    def update(self, df: pd.DataFrame, hours=1) -> None:
+        """
+        Adds rows to the yearly means.
+
+        Args:
+        df (pd.DataFrame): rows with timestamp, Location and the pollutants
+        hours (float or pd.Series): hours each row stands for
+        """
+        if df.empty:
+            return
+        values = df[self.value_columns]
+        weights = values.notna().mul(hours, axis=0)
+        keys = [df["Location"].astype(str), df["timestamp"].dt.year.rename("year")]
+        sums = values.mul(hours, axis=0).groupby(keys).sum()
+        weights = weights.groupby(keys).sum()
+        if self.sums is None:
+            self.sums, self.hours = sums, weights
+        else:
+            self.sums = self.sums.add(sums, fill_value=0)
+            self.hours = self.hours.add(weights, fill_value=0)
+        last_timestamp = df["timestamp"].max()
+        if self.last_timestamp is None or last_timestamp > self.last_timestamp:
+            self.last_timestamp = last_timestamp
+
+    def add_snapshot(self, df: pd.DataFrame) -> None:
+        """
+        Adds a new snapshot, unless it is included already (listener of LocalData).
+        """
+        if self.last_timestamp is None or df["timestamp"].iloc[0] > self.last_timestamp:
+            self.update(df)
+
+    def means(self) -> pd.DataFrame:
+        """
+        Returns the yearly means with the columns Location, year and the pollutants.
+        """
+        if self.sums is None:
+            return pd.DataFrame(columns=["Location", "year", *self.value_columns])
+        return (self.sums / self.hours.where(self.hours > 0)).reset_index()
+
+
+@functools.lru_cache(maxsize=None)
+def local_yearly_means(localdata) -> YearlyMeans:
+    """
+    Returns the yearly means of the local data. The whole archive is read once, then the means
+    are updated with every new snapshot. They don't depend on the WHO data, hence they are shared
+    by the comparisons with all versions of the WHO data.
+    """
+    yearly = YearlyMeans(list(POLLUTANTS.values()))
+    with localdata.write_lock:
+        for tier in ("monthly", "daily", "raw"):
+            for chunk in localdata.history_chunks(tiers=(tier,)):
+                yearly.update(chunk, retention.row_hours(chunk, tier))
+        if localdata.df is not None:
+            yearly.update(localdata.df)
+        localdata.add_listener(yearly.add_snapshot)
+    return yearly
+
+
+class Comparison:
+    """
+    Comparison of the local data with the WHO data of the matched cities.
+    """
+
+    def __init__(
+        self,
+        whodata,
+        localdata,
+        sites: pd.DataFrame,
+        matches: pd.DataFrame = None,
+        radius_km: float = MATCH_RADIUS_KM,
+    ) -> None:
+        """
+        Args:
+        whodata (WHOData): the WHO data
+        localdata (LocalData): the local data, the yearly means follow its new snapshots
+        sites (pd.DataFrame): the geocodes of the local sites
+        matches (pd.DataFrame): the precomputed matches (e.g. from the build artifacts),
+        otherwise the sites are matched here
+        radius_km (float): radius of the matching
+        """
+        country = localdata.data_source_name
+        if matches is None:
+            matches = match_sites(sites, whodata, country, radius_km)
+        self.matches = matches.sort_values(by="distance_km", kind="stable")
+        # yearly values of the matched cities (a city has a row per year and type of station)
+        who = whodata.df.loc[
+            (whodata.df["country_name"] == country)
+            & whodata.df["city"].isin(self.matches["city"]),
+            ["city", "year_int", *POLLUTANTS],
+        ]
+        self.who = (
+            who.groupby(["city", who["year_int"].astype(int).rename("year")])[list(POLLUTANTS)]
+            .mean()
+            .reset_index()
+        )
+        self.yearly = local_yearly_means(localdata)
+
+    def table(self, who_column: str) -> pd.DataFrame:
+        """
+        Returns the yearly values of a pollutant of the matched cities and sites.
+
+        Args:
+        who_column (str): the WHO column of the pollutant, see POLLUTANTS
+
+        Returns:
+        pd.DataFrame: city, Location, distance_km, year, WHO and local (NaN for the years
+        covered by only one of the datasets)
+        """
+        local_column = POLLUTANTS[who_column]
+        local = self.yearly.means()[["Location", "year", local_column]]
+        local = local.merge(self.matches, on="Location").rename(
+            columns={local_column: "local"}
+        )
+        who = self.who[["city", "year", who_column]].rename(columns={who_column: "WHO"})
+        who = who.merge(self.matches, on="city")
+        return (
+            pd.merge(who, local, on=MATCH_COLUMNS + ["year"], how="outer")
+            .dropna(subset=["WHO", "local"], how="all")
+            .sort_values(by=["distance_km", "year"], kind="stable")
+            .reset_index(drop=True)[MATCH_COLUMNS + ["year", "WHO", "local"]]
+        )
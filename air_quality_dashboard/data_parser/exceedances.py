@@ -0,0 +1,110 @@
+"""
+Module containing the ExceedanceEvaluator class, which compares each new snapshot of a local
+data source with the ambient air quality standard (limits) and keeps the number of exceedances
+per site and pollutant over a rolling window of snapshots. Each snapshot is evaluated once with
+vectorized numpy operations, the history is kept in a ring buffer and never rescanned.
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_WINDOW = 24  # snapshots, i.e. one day of hourly NABEL snapshots
+
+
+class ExceedanceEvaluator:
+    """
+    Streaming evaluation of the exceedances of the limits per site and pollutant.
+    """
+
+    def __init__(
+        self, limits: pd.Series, window: int = DEFAULT_WINDOW, site_column: str = "Location"
+    ) -> None:
+        """
+        Args:
+        limits (pd.Series): limit per pollutant column, pollutants without limit (NAN) are ignored
+        window (int): number of snapshots of the rolling window
+        site_column (str): column identifying the site
+        """
+        self.limits = limits.dropna().astype(float)
+        self.pollutants = list(self.limits.index)
+        self.window = window
+        self.site_column = site_column
+        self.sites = pd.Index([], dtype=object)
+        n_pollutants = len(self.pollutants)
+        # ring buffer of the exceedances of the last snapshots, and their sum per site
+        self.history = np.zeros((window, 0, n_pollutants), dtype=bool)
+        self.counts = np.zeros((0, n_pollutants), dtype=np.int32)
+        self.position = 0
+        self.n_snapshots = 0
+        self.timestamp = None
+        self.values = np.zeros((0, n_pollutants))
+        self.exceeded = np.zeros((0, n_pollutants), dtype=bool)
+
+    def _add_sites(self, sites: pd.Index) -> None:
+        new_sites = sites.difference(self.sites)
+        if len(new_sites) == 0:
+            return
+        self.sites = self.sites.append(new_sites)
+        padding = len(new_sites)
+        self.history = np.pad(self.history, ((0, 0), (0, padding), (0, 0)))
+        self.counts = np.pad(self.counts, ((0, padding), (0, 0)))
+
+    def update(self, snapshot: pd.DataFrame) -> None:
+        """
+        Evaluates a new snapshot and moves the rolling window by one snapshot.
+        """
+        snapshot = snapshot.drop_duplicates(subset=self.site_column).set_index(
+            self.site_column
+        )
+        self._add_sites(snapshot.index)
+        self.values = (
+            snapshot.reindex(self.sites)[self.pollutants].to_numpy(dtype=float)
+        )
+        # NAN values (no measurement) are no exceedance
+        self.exceeded = self.values > self.limits.to_numpy()
+        self.counts -= self.history[self.position]
+        self.history[self.position] = self.exceeded
+        self.counts += self.exceeded
+        self.position = (self.position + 1) % self.window
+        self.n_snapshots += 1
+        self.timestamp = snapshot["timestamp"].iloc[0]
+
+    def replay(self, df: pd.DataFrame) -> None:
+        """
+        Evaluates the last snapshots (one rolling window) of an archive.
+        """
+        timestamps = np.sort(df["timestamp"].unique())[-self.window :]
+        recent = df[df["timestamp"] >= timestamps[0]] if len(timestamps) else df
+        for _, snapshot in recent.groupby("timestamp"):
+            self.update(snapshot)
+
+    def current(self) -> pd.DataFrame:
+        """
+        Returns the exceedances of the last snapshot (site x pollutant)
+        """
+        return pd.DataFrame(self.exceeded, index=self.sites, columns=self.pollutants)
+
+    def rolling_counts(self) -> pd.DataFrame:
+        """
+        Returns the number of exceedances within the rolling window (site x pollutant)
+        """
+        return pd.DataFrame(self.counts, index=self.sites, columns=self.pollutants)
+
+    def alerts(self) -> pd.DataFrame:
+        """
+        Returns one row per site and pollutant exceeding its limit in the last snapshot,
+        with the value, the limit and the number of exceedances within the rolling window.
+        """
+        sites, pollutants = np.nonzero(self.exceeded)
+        return pd.DataFrame(
+            {
+                self.site_column: self.sites[sites],
+                "Pollutant": np.array(self.pollutants, dtype=object)[pollutants],
+                "Value": self.values[sites, pollutants],
+                "Limit": self.limits.to_numpy()[pollutants],
+                f"Exceedances (last {self.window} snapshots)": self.counts[
+                    sites, pollutants
+                ],
+                "timestamp": self.timestamp,
+            }
+        )
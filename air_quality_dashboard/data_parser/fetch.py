@@ -0,0 +1,227 @@
+"""
+Module containing the shared fetch layer of all outbound requests (WHO excel file, NABEL snapshots,
+geocoding). The requests go through one pooled keep-alive session with the same timeouts, retries
+and backoff. The responses are kept in a content-addressed mirror on disk, so that repeated
+fetches are a local read (or a conditional request), and the mirror can be replayed without
+network, e.g. for the unit tests or offline runs (AIR_QUALITY_FETCH_MODE=replay).
+"""
+
+import collections
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from air_quality_dashboard.data_parser import atomic
+
+MIRROR_DIRECTORY = os.environ.get("AIR_QUALITY_MIRROR", os.path.join("data", "mirror"))
+# live: the responses are fetched and mirrored, replay: the responses are only read from the mirror
+FETCH_MODE = os.environ.get("AIR_QUALITY_FETCH_MODE", "live")
+FETCH_MODES = ("live", "replay")
+DEFAULT_TIMEOUT = 15  # seconds to connect and between the bytes of a response
+RETRIES = 3
+BACKOFF = 0.5  # seconds, doubled with every retry
+RETRY_STATUS = (429, 500, 502, 503, 504)
+POOL_SIZE = 8  # connections kept alive per host, e.g. for the concurrent snapshots
+USER_AGENT = "air_quality_dashboard"
+
+
+class MirrorMissError(requests.exceptions.ConnectionError):
+    """
+    Raised in replay mode if a request is not in the mirror (handled like a network error).
+    """
+
+
+def request_key(url: str, params: dict = None) -> str:
+    """
+    Returns the key of a request in the mirror.
+    """
+    request = json.dumps([url, params or {}], sort_keys=True)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+class Fetcher:
+    """
+    Pooled http client with a read-through mirror of the responses on disk.
+    """
+
+    def __init__(
+        self,
+        directory: str = MIRROR_DIRECTORY,
+        mode: str = FETCH_MODE,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        pool_size: int = POOL_SIZE,
+    ) -> None:
+        """
+        Args:
+        directory (str): the directory of the mirror (None for no mirror)
+        mode (str): "live" to fetch and mirror the responses, "replay" to read them
+        from the mirror only
+        retries (int): retries of failed connections and of the status codes RETRY_STATUS
+        backoff (float): seconds before the first retry, doubled with every retry
+        pool_size (int): connections kept alive per host
+        """
+        if mode not in FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode {mode}, use one of {FETCH_MODES}")
+        self.directory = directory
+        self.mode = mode
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        # fetched, revalidated (not modified), mirrored (no request), replayed, missed
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The keep-alive session, created on the first request.
+        """
+        with self._lock:
+            if self._session is None:
+                retry = Retry(
+                    total=self.retries,
+                    backoff_factor=self.backoff,
+                    status_forcelist=RETRY_STATUS,
+                    allowed_methods=frozenset(["GET"]),
+                    raise_on_status=False,  # the last response is checked by raise_for_status
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["User-Agent"] = USER_AGENT
+                self._session = session
+            return self._session
+
+    def _count(self, event: str) -> None:
+        with self._lock:
+            self.stats[event] += 1
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.directory, "index", f"{key}.json")
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest)
+
+    def _lookup(self, key: str):
+        # the mirrored response of a request and its content, None if it is not mirrored
+        if self.directory is None:
+            return None, None
+        try:
+            with open(self._index_path(key), encoding="utf-8") as file:
+                entry = json.load(file)
+            with open(self._object_path(entry["sha256"]), "rb") as file:
+                return entry, file.read()
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def _store(self, key: str, url: str, params, content: bytes, response, previous) -> None:
+        if self.directory is None:
+            return
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):  # the same content is stored once
+            with atomic.commit(object_path) as temporary_path:
+                with open(temporary_path, "wb") as file:
+                    file.write(content)
+        # a "not modified" response may leave out the validators of the mirrored response
+        validators = previous if previous is not None and response.status_code == 304 else {}
+        atomic.write_json(
+            {
+                "url": url,
+                "params": params,
+                "sha256": digest,
+                "fetched": time.time(),
+                "etag": response.headers.get("ETag", validators.get("etag")),
+                "last_modified": response.headers.get(
+                    "Last-Modified", validators.get("last_modified")
+                ),
+            },
+            self._index_path(key),
+        )
+        if previous is not None and previous["sha256"] != digest:
+            self._remove_unreferenced(previous["sha256"])
+
+    def _remove_unreferenced(self, digest: str) -> None:
+        # the previous content of a request is removed, unless another request has it as well
+        index_directory = os.path.join(self.directory, "index")
+        for name in os.listdir(index_directory):
+            try:
+                with open(os.path.join(index_directory, name), encoding="utf-8") as file:
+                    if json.load(file).get("sha256") == digest:
+                        return
+            except (OSError, ValueError):
+                continue  # being written by another process
+        try:
+            os.remove(self._object_path(digest))
+        except FileNotFoundError:
+            pass  # removed by another process
+
+    def get(
+        self,
+        url: str,
+        params: dict = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_age: float = 0,
+    ) -> bytes:
+        """
+        Returns the content of a GET request, from the mirror if it is recent enough.
+
+        Args:
+        url (str): the URL
+        params (dict): the query parameters
+        timeout (float): seconds to connect and between the bytes of the response
+        max_age (float): seconds a mirrored response is used without a request, 0 to ask the
+        server whether it changed (conditional request), None to use it forever
+
+        Returns:
+        bytes: the content of the response
+        """
+        key = request_key(url, params)
+        entry, content = self._lookup(key)
+        if self.mode == "replay":
+            if entry is None:
+                self._count("missed")
+                raise MirrorMissError(f"{url} is not in the mirror {self.directory}")
+            self._count("replayed")
+            return content
+        if entry is not None and (
+            max_age is None or time.time() - entry["fetched"] < max_age
+        ):
+            self._count("mirrored")
+            return content
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.session.get(url, params=params, timeout=timeout, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self._count("revalidated")
+        else:
+            response.raise_for_status()
+            self._count("fetched")
+            content = response.content
+        self._store(key, url, params, content, response, entry)
+        return content
+
+
+@functools.lru_cache(maxsize=None)
+def shared_fetcher() -> Fetcher:
+    """
+    Returns the fetcher shared by all outbound requests of the process
+    (configured with AIR_QUALITY_MIRROR and AIR_QUALITY_FETCH_MODE).
+    """
+    return Fetcher()
@@ -0,0 +1,320 @@
+"""
+Module containing lightweight forecasting models for the air quality data. All series (e.g. every
+site and pollutant) are fitted at once in batched numpy form, the models only keep sufficient
+statistics, so that they can be refitted incrementally when new data arrives and the fit can be
+split over several processes. The predictions are cached per dataset version.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# observations (series x points) from which the fit is split over processes, below the start of
+# the processes (about 1.5 s with forkserver, 3 s with spawn: each one imports numpy and pandas)
+# is larger than the gain: with 4 processes, the hourly model breaks even at about 20 million
+# observations (a year of the 110 NABEL series: 1 million)
+PARALLEL_MIN_OBSERVATIONS = int(
+    os.environ.get("AIR_QUALITY_PARALLEL_MIN_OBSERVATIONS", 20_000_000)
+)
+# the processes are not forked: forking a process with threads (the server, the reloading of the
+# data) can copy locks held by another thread and deadlock in the child
+START_METHOD = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+class LinearTrendModel:
+    """
+    Linear trend per series, fitted by least squares on the sums of x, y, x², xy.
+    Suited for the yearly WHO series.
+    """
+
+    def __init__(self, n_series: int) -> None:
+        self.n = np.zeros(n_series)
+        self.sum_x = np.zeros(n_series)
+        self.sum_y = np.zeros(n_series)
+        self.sum_xx = np.zeros(n_series)
+        self.sum_xy = np.zeros(n_series)
+
+    def partial_fit(self, x, y) -> None:
+        """
+        Adds observations to the model.
+
+        Args:
+        x (np.ndarray): x values of the observations, shape (n_points,)
+        y (np.ndarray): observations, shape (n_series, n_points), NAN for missing values
+        """
+        valid = ~np.isnan(y)
+        x = np.broadcast_to(np.asarray(x, dtype=float), y.shape) * valid
+        y = np.where(valid, y, 0)
+        self.n += valid.sum(axis=1)
+        self.sum_x += x.sum(axis=1)
+        self.sum_y += y.sum(axis=1)
+        self.sum_xx += (x * x).sum(axis=1)
+        self.sum_xy += (x * y).sum(axis=1)
+
+    def coefficients(self):
+        """
+        Returns intercept and slope of each series (NAN without observations,
+        a constant if all observations have the same x).
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            denominator = self.n * self.sum_xx - self.sum_x**2
+            slope = np.where(
+                np.abs(denominator) > 1e-9,
+                (self.n * self.sum_xy - self.sum_x * self.sum_y) / denominator,
+                0.0,
+            )
+            intercept = np.where(
+                self.n > 0, (self.sum_y - slope * self.sum_x) / self.n, np.nan
+            )
+        return intercept, slope
+
+    def predict(self, x) -> np.ndarray:
+        """
+        Returns the predictions for x, shape (n_series, len(x))
+        """
+        intercept, slope = self.coefficients()
+        return intercept[:, None] + slope[:, None] * np.asarray(x, dtype=float)[None, :]
+
+
+class HourlyProfileModel:
+    """
+    Mean daily profile (per hour of the day) per series, plus a level which follows the
+    deviation of the recent observations from the profile (exponential smoothing) and
+    fades out over the forecast horizon. Suited for the hourly NABEL series.
+    """
+
+    def __init__(self, n_series: int, alpha: float = 0.3, damping: float = 0.8) -> None:
+        self.alpha = alpha
+        self.damping = damping
+        self.sums = np.zeros((n_series, 24))
+        self.counts = np.zeros((n_series, 24))
+        self.level = np.zeros(n_series)
+
+    def partial_fit(self, hours, y) -> None:
+        """
+        Adds observations to the model, in chronological order.
+
+        Args:
+        hours (np.ndarray): hour of the day of the observations, shape (n_points,)
+        y (np.ndarray): observations, shape (n_series, n_points), NAN for missing values
+        """
+        for point, hour in enumerate(hours):  # loop over time, vectorized over the series
+            observation = y[:, point]
+            valid = ~np.isnan(observation)
+            profile = self._profile(hour)
+            residual = np.where(
+                valid & ~np.isnan(profile), observation - profile, 0.0
+            )
+            self.level = np.where(
+                valid, self.alpha * residual + (1 - self.alpha) * self.level, self.level
+            )
+            self.sums[valid, hour] += observation[valid]
+            self.counts[valid, hour] += 1
+
+    def _profile(self, hour) -> np.ndarray:
+        # hours of the day without observations fall back to the mean over all hours
+        with np.errstate(divide="ignore", invalid="ignore"):
+            profile = self.sums[:, hour] / self.counts[:, hour]
+            mean = self.sums.sum(axis=1) / self.counts.sum(axis=1)
+        return np.where(self.counts[:, hour] > 0, profile, mean)
+
+    def predict(self, hours) -> np.ndarray:
+        """
+        Returns the predictions for the next hours (hour of the day), shape (n_series, len(hours))
+        """
+        return np.stack(
+            [
+                self._profile(hour) + self.level * self.damping ** (step + 1)
+                for step, hour in enumerate(hours)
+            ],
+            axis=1,
+        )
+
+
+def _fit_chunk(arguments):
+    model_class, model_arguments, x, y = arguments
+    model = model_class(len(y), **model_arguments)
+    model.partial_fit(x, y)
+    return model
+
+
+def fit_model(model_class, x, y, n_jobs: int = 1, **model_arguments):
+    """
+    Fits a model on all series at once. With n_jobs, large numbers of observations (see
+    PARALLEL_MIN_OBSERVATIONS) are split by series into chunks, which are fitted in parallel
+    processes and concatenated afterwards. The processes import the main module of the program
+    again, hence the dashboard (main.py) fits in its own process, with the default n_jobs=1.
+
+    Args:
+    model_class: LinearTrendModel or HourlyProfileModel
+    x (np.ndarray): x values / hours of the observations, shape (n_points,)
+    y (np.ndarray): observations, shape (n_series, n_points)
+    n_jobs (int): number of processes, None for the number of cores
+
+    Returns:
+    the fitted model
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(y) < 2 or y.size < PARALLEL_MIN_OBSERVATIONS:
+        return _fit_chunk((model_class, model_arguments, x, y))
+    chunks = np.array_split(y, n_jobs)
+    with ProcessPoolExecutor(
+        max_workers=n_jobs, mp_context=multiprocessing.get_context(START_METHOD)
+    ) as executor:
+        models = list(
+            executor.map(
+                _fit_chunk,
+                [(model_class, model_arguments, x, chunk) for chunk in chunks],
+            )
+        )
+    # the state of the models is per series, hence the chunks can simply be concatenated
+    model = models[0]
+    for attribute, value in vars(model).items():
+        if isinstance(value, np.ndarray):
+            setattr(
+                model,
+                attribute,
+                np.concatenate([getattr(chunk, attribute) for chunk in models]),
+            )
+    return model
+
+
+class LocalForecaster:
+    """
+    Forecast of the next hours per site and pollutant of the local data (NABEL),
+    refitted with every new snapshot.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        pollutants: list,
+        site_column: str = "Location",
+        history=(),
+    ):
+        """
+        Args:
+        df (pd.DataFrame): the archive of snapshots
+        pollutants (list): the pollutant columns to forecast
+        site_column (str): column identifying the site
+        history (iterable): older hourly snapshots, e.g. the chunks of the history on disk,
+        each chunk is pivoted on its own, so that they are never in memory at once
+        """
+        self.pollutants = list(pollutants)
+        self.site_column = site_column
+        # one row per (site, pollutant) and one column per snapshot
+        wide = pd.concat(
+            [self._pivot(chunk) for chunk in history] + [self._pivot(df)]
+        )
+        wide = wide.groupby(level=0).mean().sort_index()
+        self.series = wide.columns  # (pollutant, site)
+        self.last_timestamp = wide.index.max()
+        self.n_snapshots = len(wide)
+        self.model = fit_model(
+            HourlyProfileModel,
+            wide.index.hour.to_numpy(),
+            wide.to_numpy(dtype=float).T,
+        )
+        self._cache = {}
+
+    def _pivot(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df.pivot_table(
+            index="timestamp",
+            columns=self.site_column,
+            values=self.pollutants,
+            aggfunc="mean",
+        )
+
+    @property
+    def version(self):
+        """
+        Version of the data the model is fitted on (number and last timestamp of the snapshots)
+        """
+        return (self.n_snapshots, self.last_timestamp)
+
+    def update(self, snapshot: pd.DataFrame) -> None:
+        """
+        Refits the model incrementally with a new snapshot.
+        """
+        values = snapshot.groupby(self.site_column)[self.pollutants].mean()
+        # new sites are not part of the model until the next full fit
+        y = np.array(
+            [
+                values[pollutant].get(site, np.nan) if pollutant in values else np.nan
+                for pollutant, site in self.series
+            ]
+        )
+        timestamp = snapshot["timestamp"].iloc[0]
+        self.model.partial_fit([timestamp.hour], y[:, None])
+        self.last_timestamp = timestamp
+        self.n_snapshots += 1
+
+    def forecast(self, horizon: int = 24) -> pd.DataFrame:
+        """
+        Returns the forecast of the next hours, cached per data version.
+
+        Returns:
+        pd.DataFrame: timestamp, site, pollutant and forecast value
+        """
+        key = (self.version, horizon)
+        if key not in self._cache:
+            timestamps = pd.date_range(
+                self.last_timestamp + pd.Timedelta(hours=1), periods=horizon, freq="h"
+            )
+            predictions = self.model.predict(timestamps.hour)
+            forecast = pd.DataFrame(
+                predictions.T,
+                index=timestamps.rename("timestamp"),
+                columns=self.series,
+            )
+            self._cache = {
+                key: forecast.melt(
+                    ignore_index=False,
+                    var_name=["Pollutant", self.site_column],
+                    value_name="Forecast",
+                ).reset_index()
+            }
+        return self._cache[key]
+
+
+class WHOForecaster:
+    """
+    Forecast of the yearly mean concentration per country and pollutant of the WHO data,
+    using a linear trend.
+    """
+
+    def __init__(self, df: pd.DataFrame, pollutants: list) -> None:
+        yearly = df.pivot_table(
+            index="year_int", columns="country_name", values=list(pollutants), aggfunc="mean"
+        ).sort_index()
+        self.series = yearly.columns  # (pollutant, country)
+        self.last_year = int(yearly.index.max())
+        self.model = fit_model(
+            LinearTrendModel, yearly.index.to_numpy(dtype=float), yearly.to_numpy().T
+        )
+        self._cache = {}
+
+    def forecast(self, years: int = 5) -> pd.DataFrame:
+        """
+        Returns the forecast of the next years, cached.
+
+        Returns:
+        pd.DataFrame: year, country, pollutant and forecast value
+        """
+        if years not in self._cache:
+            future_years = np.arange(self.last_year + 1, self.last_year + 1 + years)
+            forecast = pd.DataFrame(
+                self.model.predict(future_years).T,
+                index=pd.Index(future_years, name="year_int"),
+                columns=self.series,
+            )
+            self._cache[years] = forecast.melt(
+                ignore_index=False,
+                var_name=["Pollutant", "country_name"],
+                value_name="Forecast",
+            ).reset_index()
+        return self._cache[years]
@@ -3,14 +3,33 @@ Module containing the LocalData class to load and update the
 local air quality data from the Swiss NABEL database.
 """
 
-import io
+import functools
+import json
 import os
+import threading
+import time
 import requests
+import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
+from air_quality_dashboard.data_parser import artifacts, atomic, fetch, retention, sources
+from air_quality_dashboard.data_parser.exceedances import ExceedanceEvaluator
+from air_quality_dashboard.data_parser.forecast import LocalForecaster
+from air_quality_dashboard.data_parser.statistics import RunningStatistics
+from air_quality_dashboard.data_parser.sources import LOCAL_DEFAULT_DATA_URL
 
-
-LOCAL_DEFAULT_DATA_URL = r"https://www.bafu.admin.ch/bafu/en/home/topics/air/state/data/air-pollution--real-time-data/table-of-the-current-situation-nabel.html"
+UPDATE_INTERVAL = 10 * 60  # seconds, the NABEL database publishes a new snapshot every hour
+# seconds after which the processes which are not the writer pick up the committed snapshots
+REFRESH_INTERVAL = 30
+# bytes of the snapshots kept in memory, the oldest snapshots above are evicted to the history
+# on disk (down to HOT_SHARE of the ceiling, so that it does not happen with every snapshot)
+MEMORY_CEILING = int(os.environ.get("AIR_QUALITY_LOCAL_MEMORY_CEILING", 64 * 1024**2))
+HOT_SHARE = 0.75
+MIN_HOT_SNAPSHOTS = 7 * 24  # the last week always stays in memory (forecast, exceedances)
+HISTORY_TIMEFORMAT = "%Y%m%dT%H%M"
+# tiers of the history, the older data is downsampled into the coarser tiers (see retention)
+HISTORY_TIERS = ("monthly", "daily", "raw")
+BOUNDARIES_NAME = "boundaries.json"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"  # geocoding of OpenStreetMap
 
 
 class LocalData:
@@ -22,6 +41,10 @@ class LocalData:
         self,
         air_quality_data_url: str = LOCAL_DEFAULT_DATA_URL,
         data_source_name: str = "Switzerland",
+        source: sources.LocalSource = None,
+        update_on_load: bool = True,
+        data_directory: str = "data",
+        memory_ceiling: int = MEMORY_CEILING,
     ) -> None:
         """
         Initializes the LocalData class with the air quality data URL and the data source name.
@@ -29,14 +52,86 @@ class LocalData:
         Args:
         air_quality_data_url (str): the URL of the air quality data
         data_source_name (str): the name of the data source
+        source (LocalSource): the source to fetch the snapshots from, by default the NABEL
+        database with the given URL and name
+        update_on_load (bool): fetch the current snapshot after loading the stored data
+        data_directory (str): the directory of the pickle file
+        memory_ceiling (int): bytes of the snapshots kept in memory, the older snapshots are
+        moved to the history on disk (None to keep all snapshots in memory)
         """
-        self.air_quality_data_url = air_quality_data_url
-        self.data_source_name = data_source_name
-        self.df = None
+        if source is None:
+            source = sources.NabelSource(air_quality_data_url, data_source_name)
+        self.source = source
+        self.air_quality_data_url = source.url
+        self.data_source_name = source.name
+        self.update_on_load = update_on_load
+        self.statistics = None
+        self.exceedances = None  # evaluation of the limits, as soon as they are known
+        self._forecaster = None  # fitted on the first use
+        self.listeners = []  # called with every new snapshot, see add_listener
+        # held while the archive is written (new snapshots, eviction, compaction)
+        self.write_lock = threading.Lock()
+        self.compactor = None  # background compaction of the history, see start_compaction
+        self.memory_ceiling = memory_ceiling
         self.data_location = os.path.join(
-            "data", f"local_air_quality_data_{data_source_name}.xz"
+            data_directory, f"local_air_quality_data_{source.name}.xz"
         )
-        self.load_local_air_quality_data()
+        # only one process (the writer) fetches the snapshots and writes the archive,
+        # the other processes pick up the committed versions of the pickle file (see refresh)
+        self.writer = atomic.WriterLock(self.data_location)
+        self._file_version = None  # version of the pickle file in memory
+        # the evicted snapshots, one pickle file per eviction named by its first and last timestamp
+        self.history_directory = os.path.join(
+            data_directory, f"local_air_quality_data_{source.name}_history"
+        )
+        self.df = None
+        try:
+            self.load_local_air_quality_data()
+        except SystemExit:
+            self.writer.release()  # the instance is not used, another one can be the writer
+            raise
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """
+        The snapshots in memory (all snapshots, unless the oldest were evicted to the history,
+        see history)
+        """
+        return self._df
+
+    @df.setter
+    def df(self, df: pd.DataFrame):
+        # the whole dataset is replaced, hence the statistics are recalculated once
+        self._df = df
+        self.statistics = RunningStatistics(
+            group_column="Type of site",
+            value_columns=sources.POLLUTANT_COLUMNS,
+            distinct_columns=["timestamp", "Location"],
+        )
+        if df is not None:
+            self.statistics.update(df)
+        # the statistics cover the whole archive, the history is read one chunk at a time,
+        # the daily and monthly means count as the hourly snapshots they replace
+        for tier in HISTORY_TIERS:
+            for chunk in self.history_chunks(tiers=(tier,)):
+                self.statistics.update(chunk, retention.row_hours(chunk, tier))
+        self.exceedances = None  # replayed from the new data with the next snapshot
+        self._forecaster = None
+
+    @property
+    def forecaster(self) -> LocalForecaster:
+        """
+        Forecast of the next hours per site and pollutant, fitted on the first use and refitted
+        incrementally with every new snapshot. It is fitted on the hourly snapshots, in memory
+        and evicted to the raw tier of the history, but not on the daily and monthly means.
+        """
+        if self._forecaster is None and self.df is not None:
+            self._forecaster = LocalForecaster(
+                self.df,
+                sources.POLLUTANT_COLUMNS,
+                history=self.history_chunks(tiers=("raw",)),
+            )
+        return self._forecaster
 
     def load_local_air_quality_data(self):
         """
@@ -44,10 +139,22 @@ class LocalData:
         """
 
         try:
-            self.df = pd.read_pickle(self.data_location)
+            self._file_version = atomic.file_version(self.data_location)
+            df = pd.read_pickle(self.data_location)
+            last_evicted = self.last_evicted()
+            if last_evicted is not None:
+                # in case the process stopped between the eviction and saving the pickle file
+                df = df[df["timestamp"] > last_evicted]
+            self._adopt_limits(df)
+            self.df = retention.in_range(df, self.tier_boundaries()["raw"], None)
+            self._evaluate_exceedances()
         except FileNotFoundError:
-            print("The data file does not exist, create a new data file.")
-            self.df = None
+            # a new deployment starts from the archive of the build artifacts, if any
+            self.df = artifacts.load_current(
+                f"local_air_quality_data_{self.data_source_name}"
+            )
+            if self.df is None:
+                print("The data file does not exist, create a new data file.")
         except pd.errors.EmptyDataError:
             print("The data file is empty, start from scratch.")
             self.df = None
@@ -56,7 +163,8 @@ class LocalData:
             self.df = None
         finally:
             try:
-                self.update_local_air_quality_data()
+                if self.update_on_load:
+                    self.update_local_air_quality_data()
             except requests.exceptions.Timeout as e:
                 print("Request timed out, maybe you're blocked from the site")
                 raise SystemExit(e) from e  # stop the execution of the program
@@ -79,76 +187,497 @@ class LocalData:
         (NABEL database with Swiss air quality data in real-time),
         the data is updated hourly on the website, but there is no archive,
         so we create our own here by saving the data in a pickle file.
+        Only the writer process fetches the snapshots, the other processes pick up the
+        snapshots committed by it.
         """
-        # get the local website
-        local_website = requests.get(self.air_quality_data_url, timeout=5)
+        is_writer = self.writer.acquire()
+        # e.g. the snapshots of the previous writer, if this process just took over
+        self.refresh()
+        if is_writer:
+            self.append_snapshot(self.source.get_snapshot())
 
-        # makes everything readable
-        url_soup = BeautifulSoup(local_website.content, "html.parser")
+    def refresh(self) -> int:
+        """
+        Picks up the snapshots committed by another process, if the pickle file changed since
+        it was loaded or saved by this process. The file is replaced atomically, hence it is read
+        without waiting for the writer. The new snapshots are applied incrementally and the
+        listeners are called with each of them.
 
-        # finds table for dataframe
-        url_table = url_soup.find("table")
+        Returns:
+        int: the number of new snapshots
+        """
+        version = atomic.file_version(self.data_location)
+        if version is None or version == self._file_version:
+            return 0
+        try:
+            df = pd.read_pickle(self.data_location)
+        except FileNotFoundError:
+            return 0  # replaced in between, picked up with the next refresh
+        with self.write_lock:
+            self._file_version = version
+            self._adopt_limits(df)
+            df = retention.in_range(df, self.tier_boundaries()["raw"], None)
+            if self.df is None:
+                self.df = df
+                snapshots = [snapshot for _date, snapshot in df.groupby("timestamp")]
+            else:
+                new = df[~df["timestamp"].isin(self.statistics.distinct["timestamp"])]
+                snapshots = [snapshot for _date, snapshot in new.groupby("timestamp")]
+                for snapshot in snapshots:
+                    self._add_snapshot(snapshot)
+                # the writer evicts and compacts, its snapshots in memory are taken over
+                self._df = df
+            self._evaluate_exceedances()
+        for snapshot in snapshots:
+            for listener in self.listeners:
+                listener(snapshot)
+        return len(snapshots)
 
-        # creates dataframe with string values
-        df = pd.read_html(io.StringIO(url_table.prettify()))[0]
+    def add_listener(self, listener):
+        """
+        Registers a function which is called with every new snapshot, after it is committed
+        (appended and saved), e.g. to notify the webbrowsers.
 
-        # rename columns to not have
-        df = df.rename(
-            columns={
-                "O₃": "O3",
-                "O₃max": "O3max",
-                "NO₂": "NO2",
-                "NOₓ": "NOX",
-                "SO₂": "SO2",
-            }
-        )
+        Args:
+        listener (callable): called with the new snapshot (pd.DataFrame)
+        """
+        self.listeners.append(listener)
+
+    def append_snapshot(self, df: pd.DataFrame):
+        """
+        Appends a snapshot of the data source to the stored data and saves it in the pickle file.
+
+        Args:
+        df (pd.DataFrame): the snapshot, with the same timestamp for all rows
+        """
+        date = df["timestamp"].iloc[0]
+
+        with self.write_lock:
+            # if no previous data exist, save the new data directly in the class,
+            # otherwise append the new data to the existing data, but first check if the
+            # data is not already in the dataframe by checking if the timestamp already
+            # exists in the dataframe
+            new_snapshot = True
+            if self.df is None:
+                self.df = df
+            elif date not in self.statistics.distinct["timestamp"]:
+                self._df = pd.concat([self.df, df])
+                self._add_snapshot(df)
+                self.evict_history()
+            else:
+                new_snapshot = False
+            self._evaluate_exceedances()
+
+            self.save()
 
-        # convert the entries to float / NAN
-        df["O3"] = df["O3"].apply(pd.to_numeric, errors="coerce")
-        df["O3max"] = df["O3max"].apply(pd.to_numeric, errors="coerce")
-        df["NO2"] = df["NO2"].apply(pd.to_numeric, errors="coerce")
-        df["NOX"] = df["NOX"].apply(pd.to_numeric, errors="coerce")
-        df["SO2"] = df["SO2"].apply(pd.to_numeric, errors="coerce")
+        if new_snapshot:
+            for listener in self.listeners:
+                listener(df)
 
-        # convert type of site to category
-        df["Type of site"] = df["Type of site"].astype("category")
+    def _add_snapshot(self, df: pd.DataFrame):
+        # only the new snapshot is aggregated
+        self.statistics.update(df)
+        if self.exceedances is not None:
+            self.exceedances.update(df)
+        if self._forecaster is not None:
+            self._forecaster.update(df)  # incremental refit
 
-        date = url_table.find("caption").get_text(strip=True)
-        date = pd.to_datetime(date.lstrip("Date from: "), dayfirst=True)
-        df["timestamp"] = date
+    def _adopt_limits(self, df: pd.DataFrame):
+        # the limits are stored with the snapshots, for the processes which don't fetch them
+        limits = df.attrs.get("limits")
+        if self.source.limits is None and limits is not None:
+            self.source.limits = pd.Series(limits, dtype=float)
 
-        df = df.loc[
-            df["Type of site"] != "Ambient air quality standard [µg/m³]"
-        ]  # remove the critical values
+    def _evaluate_exceedances(self):
+        # the limits are published together with the snapshots, the first time they are
+        # known, the last snapshots of the archive are evaluated
+        if self.exceedances is None and self.source.limits is not None and self.df is not None:
+            self.exceedances = ExceedanceEvaluator(self.source.limits)
+            self.exceedances.replay(self.df)
 
-        # if no previous data exist, save the new data directly in the class,
-        # otherwise append the new data to the existing data, but first check if the
-        # data is not already in the dataframe by checking if the timestamp already
-        # exists in the dataframe
+    def save(self):
+        """
+        Saves the snapshots in memory in the pickle file (atomically, see atomic.commit).
+        """
+        if self.source.limits is not None:
+            self.df.attrs["limits"] = self.source.limits.to_dict()
+        atomic.write_pickle(self.df, self.data_location)
+        self._file_version = atomic.file_version(self.data_location)
+
+    def memory_usage(self) -> int:
+        """
+        Returns the bytes of the snapshots in memory.
+        """
         if self.df is None:
-            self.df = df
+            return 0
+        return int(self.df.memory_usage(deep=True).sum())
+
+    def evict_history(self) -> int:
+        """
+        Moves the oldest snapshots to the history on disk, if the snapshots in memory exceed the
+        memory ceiling. The statistics, exceedances and forecast are incremental, hence they
+        still include the evicted snapshots.
+
+        Returns:
+        int: the number of evicted snapshots
+        """
+        usage = self.memory_usage()
+        if not self.memory_ceiling or usage <= self.memory_ceiling:
+            return 0
+        timestamps = np.sort(self.df["timestamp"].unique())
+        bytes_per_snapshot = usage / len(timestamps)
+        n_hot = max(
+            int(self.memory_ceiling * HOT_SHARE / bytes_per_snapshot), MIN_HOT_SNAPSHOTS
+        )
+        if len(timestamps) - n_hot < len(timestamps) * (1 - HOT_SHARE):
+            return 0  # the last week exceeds the ceiling, evicted in larger chunks then
+        first_hot = timestamps[-n_hot]
+        evicted = self.df[self.df["timestamp"] < first_hot]
+        self.write_history_chunk(evicted)
+        self._df = self.df[self.df["timestamp"] >= first_hot]
+        return len(timestamps) - n_hot
+
+    def tier_directory(self, tier: str) -> str:
+        """
+        Returns the directory of a tier of the history (the raw snapshots are in the
+        history directory itself).
+        """
+        if tier == "raw":
+            return self.history_directory
+        return os.path.join(self.history_directory, tier)
+
+    def history_files(self, tier: str = "raw") -> list:
+        """
+        Returns the chunks of a tier of the history, the oldest first.
+
+        Returns:
+        list: (first timestamp, last timestamp, path) of each chunk
+        """
+        directory = self.tier_directory(tier)
+        if not os.path.isdir(directory):
+            return []
+        files = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".xz"):
+                continue
+            first, last = name[: -len(".xz")].split("_")
+            files.append(
+                (pd.Timestamp(first), pd.Timestamp(last), os.path.join(directory, name))
+            )
+        return files
+
+    def write_history_chunk(
+        self, df: pd.DataFrame, tier: str = "raw", compression="xz"
+    ) -> str:
+        """
+        Writes a chunk into a tier of the history, named by its first and last timestamp.
+
+        Returns:
+        str: the path of the chunk
+        """
+        directory = self.tier_directory(tier)
+        os.makedirs(directory, exist_ok=True)
+        name = (
+            f"{df['timestamp'].min().strftime(HISTORY_TIMEFORMAT)}_"
+            f"{df['timestamp'].max().strftime(HISTORY_TIMEFORMAT)}.xz"
+        )
+        path = os.path.join(directory, name)
+        atomic.write_pickle(df, path, compression)
+        return path
+
+    def tier_boundaries(self) -> dict:
+        """
+        Returns the first timestamp of the daily and of the raw tier (None if the tier starts
+        with the archive). Rows of a tier outside of its range are ignored, e.g. the raw rows
+        which were already downsampled when the compaction was interrupted.
+        """
+        try:
+            with open(
+                os.path.join(self.history_directory, BOUNDARIES_NAME), encoding="utf-8"
+            ) as file:
+                boundaries = json.load(file)
+        except FileNotFoundError:
+            return {"daily": None, "raw": None}
+        return {
+            tier: None if boundary is None else pd.Timestamp(boundary)
+            for tier, boundary in boundaries.items()
+        }
+
+    def set_tier_boundaries(self, daily, raw) -> None:
+        """
+        Moves the start of the daily and of the raw tier, the raw snapshots before are dropped
+        from memory (they have to be downsampled into the history before).
+        Has to be called with the write_lock.
+        """
+        atomic.write_json(
+            {
+                "daily": None if daily is None else daily.isoformat(),
+                "raw": None if raw is None else raw.isoformat(),
+            },
+            os.path.join(self.history_directory, BOUNDARIES_NAME),
+        )
+        if self.df is not None and raw is not None and (self.df["timestamp"] < raw).any():
+            # the statistics, exceedances and forecast are incremental, they are kept
+            self._df = retention.in_range(self.df, raw, None)
+            self.save()
+
+    def tier_ranges(self) -> dict:
+        """
+        Returns the time range (start inclusive, end exclusive, None for an open end)
+        of each tier of the history.
+        """
+        boundaries = self.tier_boundaries()
+        daily, raw = boundaries["daily"], boundaries["raw"]
+        return {
+            "monthly": (None, raw if daily is None else daily),
+            "daily": (daily, raw),
+            "raw": (raw, None),
+        }
+
+    def last_evicted(self):
+        """
+        Returns the timestamp of the last snapshot evicted to the history (None if there is none).
+        """
+        files = self.history_files()
+        return files[-1][1] if files else None
+
+    def history_chunks(self, start=None, end=None, tiers=HISTORY_TIERS):
+        """
+        Yields the chunks of the history (the oldest first: monthly, daily, then raw),
+        which overlap the time range start to end (None for an open end).
+
+        Args:
+        tiers (tuple): the tiers of the history to read, e.g. ("raw",)
+        """
+        ranges = self.tier_ranges()
+        for tier in HISTORY_TIERS:
+            if tier not in tiers:
+                continue
+            tier_start, tier_end = ranges[tier]
+            for first, last, path in self.history_files(tier):
+                if (start is not None and last < start) or (end is not None and first > end):
+                    continue
+                if (tier_start is not None and last < tier_start) or (
+                    tier_end is not None and first >= tier_end
+                ):
+                    continue  # already downsampled into a coarser tier
+                yield retention.in_range(pd.read_pickle(path), tier_start, tier_end)
+
+    def history(self, start=None, end=None) -> pd.DataFrame:
+        """
+        Returns the snapshots between start and end (inclusive, None for an open end),
+        from the history on disk and from memory. The snapshots older than the retention of the
+        raw data are daily or monthly means (timestamp at the start of the day / month).
+
+        Args:
+        start (pd.Timestamp): the first timestamp
+        end (pd.Timestamp): the last timestamp
+
+        Returns:
+        pd.DataFrame: the snapshots in the time range
+        """
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        chunks = list(self.history_chunks(start, end))
+        if self.df is not None:
+            chunks.append(self.df)
+        if not chunks:
+            return pd.DataFrame()
+        df = pd.concat(chunks)
+        if start is not None:
+            df = df[df["timestamp"] >= start]
+        if end is not None:
+            df = df[df["timestamp"] <= end]
+        return df
+
+    def snapshot_on(self, date) -> pd.DataFrame:
+        """
+        Returns the first snapshot of a date. For the downsampled history, the daily
+        or monthly means containing the date are returned.
+        """
+        day = pd.Timestamp(date).floor("D")
+        df = self.history(
+            day.to_period("M").start_time, day + pd.Timedelta(days=1) - pd.Timedelta(1)
+        )
+        if df.empty:
+            return df
+        same_day = df["timestamp"] >= day
+        if same_day.any():
+            timestamp = df.loc[same_day, "timestamp"].min()
         else:
-            if date not in self.df["timestamp"].unique():
-                self.df = pd.concat([self.df, df])
+            timestamp = df["timestamp"].max()  # monthly mean
+        return df[df["timestamp"] == timestamp]
+
+    def start_updates(
+        self, interval: float = UPDATE_INTERVAL, refresh_interval: float = REFRESH_INTERVAL
+    ) -> threading.Event:
+        """
+        Fetches the current snapshot periodically in a background thread, failed fetches are
+        printed and retried with the next interval. In between, the snapshots committed by
+        another process are picked up (only one process is the writer, see refresh).
+
+        Args:
+        interval (float): seconds between the fetches
+        refresh_interval (float): seconds between the checks for committed snapshots
+
+        Returns:
+        threading.Event: set it to stop the updates
+        """
+        stop = threading.Event()
 
-        self.df.to_pickle(self.data_location, compression="xz")
+        def update_loop():
+            next_update = time.monotonic() + interval
+            while not stop.wait(min(interval, refresh_interval)):
+                try:
+                    if time.monotonic() >= next_update:
+                        next_update += interval
+                        self.update_local_air_quality_data()
+                    else:
+                        self.refresh()
+                except (
+                    requests.exceptions.RequestException,
+                    pd.errors.ParserError,
+                    KeyError,
+                    OSError,
+                ) as e:
+                    print(f"Could not update the data source {self.data_source_name}: {e}")
+
+        threading.Thread(
+            target=update_loop, name=f"update {self.data_source_name}", daemon=True
+        ).start()
+        return stop
+
+    def start_compaction(self, interval: float = None) -> threading.Event:
+        """
+        Downsamples the aged history periodically in a background thread, see retention.
+
+        Returns:
+        threading.Event: set it to stop the compaction
+        """
+        self.compactor = retention.Compactor(self)
+        return self.compactor.start(interval)
 
     def min_date(self, timeformat="%Y-%m-%d %H:%M") -> str:
         """
         Returns the first timestamp of the stored data (from the pickle file)
         """
-        return self.df["timestamp"].min().strftime(timeformat)
+        return self.statistics.min_time.strftime(timeformat)
 
     def max_date(self, timeformat="%Y-%m-%d %H:%M") -> str:
         """
         Returns the last timestamp of the stored data (from the pickle file)
         """
-        return self.df["timestamp"].max().strftime(timeformat)
+        return self.statistics.max_time.strftime(timeformat)
 
     def caclulate_mean_per_site(self) -> pd.DataFrame:
         """
         Calculates the mean values of the air quality data per site
         """
-        return self.df.groupby("Type of site").mean(
-            ["O3", "O3max", "NO2", "NOX", "SO2", "PM10", "SO2"]
+        return self.statistics.mean_per_group()
+
+
+@functools.lru_cache(maxsize=None)
+def shared_local_data(data_source_name: str = "Switzerland") -> LocalData:
+    """
+    Returns the LocalData of a data source shared by all pages of the process, which is
+    updated in the background (the data source is fetched once per interval, not per page).
+    """
+    localdata = LocalData(data_source_name=data_source_name)
+    localdata.start_updates()
+    localdata.start_compaction()
+    return localdata
+
+
+def ingest_local_data(
+    local_sources: list,
+    max_workers: int = 8,
+    timeout: float = 30,
+    data_directory: str = "data",
+) -> dict:
+    """
+    Fetches the current snapshots of many local sources concurrently and appends
+    them to the archive of each source. Sources which fail or time out are skipped,
+    as well as the sources written by another process (e.g. the dashboard).
+
+    Args:
+    local_sources (list): the LocalSource instances to ingest
+    max_workers (int): number of concurrent fetches
+    timeout (float): time in seconds after which the remaining sources are given up
+    data_directory (str): the directory of the pickle files
+
+    Returns:
+    dict: source name -> LocalData of all successfully ingested sources
+    """
+    snapshots = sources.fetch_snapshots(local_sources, max_workers, timeout)
+    local_data = {}
+    for source in local_sources:
+        snapshot = snapshots[source.name]
+        if isinstance(snapshot, Exception):
+            print(f"Could not ingest the data source {source.name}: {snapshot}")
+            continue
+        localdata = LocalData(
+            source=source, update_on_load=False, data_directory=data_directory
+        )
+        if not localdata.writer.acquire():
+            print(f"The data source {source.name} is ingested by another process.")
+            continue
+        localdata.append_snapshot(snapshot)
+        local_data[source.name] = localdata
+    return local_data
+
+
+@functools.lru_cache(maxsize=None)
+def site_geocodes(localdata: LocalData) -> pd.DataFrame:
+    """
+    Returns the geocodes of the sites of the local data, shared by all pages of the process.
+    The geocodes are taken from the build artifacts (python -m air_quality_dashboard build),
+    only sites missing there are geocoded at runtime.
+
+    Returns:
+    pd.DataFrame: Location, Latitude and Longitude of each site found
+    """
+    locations = localdata.df["Location"].drop_duplicates().sort_values()
+    geocoded_df = artifacts.load_current(f"geocodes_{localdata.data_source_name}")
+    if geocoded_df is None:
+        return geocode_locations(locations, localdata.data_source_name)
+    missing_locations = locations[~locations.isin(geocoded_df["Location"])]
+    if len(missing_locations):
+        geocoded_df = pd.concat(
+            [geocoded_df, geocode_locations(missing_locations, localdata.data_source_name)],
+            ignore_index=True,
+        )
+    return geocoded_df
+
+
+def geocode_locations(locations, country: str = "Switzerland") -> pd.DataFrame:
+    """
+    Geocodes the names of the measurement sites with Nominatim (OpenStreetMap),
+    through the shared fetcher. Sites which cannot be found are left out.
+
+    Args:
+    locations (iterable): the names of the sites
+    country (str): the country of the sites, appended to the queries
+
+    Returns:
+    pd.DataFrame: Location, Latitude and Longitude of each site found
+    """
+    fetcher = fetch.shared_fetcher()
+    geocoded_data = []
+    for location in locations:
+        # the places do not move, the mirrored answers are used forever
+        results = json.loads(
+            fetcher.get(
+                NOMINATIM_URL,
+                params={"q": location + ", " + country, "format": "json", "limit": 1},
+                max_age=None,
+            )
         )
+        if results:
+            geocoded_data.append(
+                {
+                    "Location": location,
+                    "Latitude": float(results[0]["lat"]),
+                    "Longitude": float(results[0]["lon"]),
+                }
+            )
+    return pd.DataFrame(geocoded_data)
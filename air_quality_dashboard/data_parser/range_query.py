@@ -0,0 +1,168 @@
+"""
+Module containing sparse tables to answer range queries over an ordered key (e.g. the years) in
+constant time. The tables are built once per dataset, afterwards the max (and where it occurred)
+of every group and value column over any range of keys is a lookup of two precomputed blocks.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class RangeMaxIndex:
+    """
+    Sparse table over the rows of a 2d array, answering the max and its position
+    over any range of columns in O(1).
+    """
+
+    def __init__(self, values) -> None:
+        """
+        Args:
+        values (np.ndarray): shape (n_series, n_positions), NAN for missing values
+        """
+        values = np.asarray(values, dtype=float)
+        n_series, n_positions = values.shape
+        # level k holds the max of the blocks of 2**k positions starting at each position
+        self.maxima = [np.where(np.isnan(values), -np.inf, values)]
+        self.positions = [np.broadcast_to(np.arange(n_positions), values.shape)]
+        width = 1
+        while 2 * width <= n_positions:
+            maxima, positions = self.maxima[-1], self.positions[-1]
+            left, right = maxima[:, :-width], maxima[:, width:]
+            take_right = right > left  # on ties the first position is kept
+            self.maxima.append(np.where(take_right, right, left))
+            self.positions.append(
+                np.where(take_right, positions[:, width:], positions[:, :-width])
+            )
+            width *= 2
+        self.n_series = n_series
+
+    def query(self, series, first: int, last: int):
+        """
+        Returns the max of the series between the positions first and last (inclusive)
+        and the position of the max (the first one on ties).
+
+        Args:
+        series (np.ndarray): indices of the series to query
+        first (int): first position of the range
+        last (int): last position of the range
+
+        Returns:
+        tuple: maxima (NAN if the series has no value in the range) and positions (-1 then)
+        """
+        level = int(np.log2(last - first + 1))
+        start_right = last - 2**level + 1
+        left = self.maxima[level][series, first]
+        right = self.maxima[level][series, start_right]
+        take_right = right > left
+        maxima = np.where(take_right, right, left)
+        positions = np.where(
+            take_right,
+            self.positions[level][series, start_right],
+            self.positions[level][series, first],
+        )
+        missing = np.isneginf(maxima)
+        return np.where(missing, np.nan, maxima), np.where(missing, -1, positions)
+
+
+class GroupRangeMax:
+    """
+    Max of several value columns per group (e.g. country) over any range of an ordered key
+    (e.g. year), and the key at which the max occurred.
+    """
+
+    def __init__(
+        self, df: pd.DataFrame, group_column: str, key_column: str, value_columns: list
+    ) -> None:
+        """
+        Args:
+        df (pd.DataFrame): the data, several rows per group and key are allowed
+        group_column (str): column of the groups
+        key_column (str): numeric column of the ordered key
+        value_columns (list): columns of which the max is queried
+        """
+        self.group_column = group_column
+        self.key_column = key_column
+        self.value_columns = list(value_columns)
+        df = df.dropna(subset=[group_column, key_column])
+        grouped = df.groupby([group_column, key_column], observed=True)[
+            self.value_columns
+        ].max()
+        self.groups = pd.Index(
+            grouped.index.get_level_values(0).unique().sort_values()
+        )
+        self.keys = np.sort(grouped.index.get_level_values(1).unique().to_numpy())
+        full_index = pd.MultiIndex.from_product([self.groups, self.keys])
+        n_groups, n_keys = len(self.groups), len(self.keys)
+        # (group, value column) series over the keys
+        values = grouped.reindex(full_index).to_numpy(dtype=float)
+        values = values.reshape(n_groups, n_keys, len(self.value_columns))
+        self.index = RangeMaxIndex(
+            values.transpose(0, 2, 1).reshape(-1, n_keys)
+        )
+        # next / previous key with rows of the group, for the span of the keys of a selection
+        present = (
+            pd.Series(True, index=grouped.index)
+            .reindex(full_index, fill_value=False)
+            .to_numpy()
+            .reshape(n_groups, n_keys)
+        )
+        positions = np.where(present, np.arange(n_keys), n_keys)
+        self.next_present = np.minimum.accumulate(positions[:, ::-1], axis=1)[:, ::-1]
+        positions = np.where(present, np.arange(n_keys), -1)
+        self.previous_present = np.maximum.accumulate(positions, axis=1)
+
+    def _range(self, key_min, key_max):
+        first = 0 if key_min is None else np.searchsorted(self.keys, key_min, "left")
+        last = (
+            len(self.keys) - 1
+            if key_max is None
+            else np.searchsorted(self.keys, key_max, "right") - 1
+        )
+        return int(first), int(last)
+
+    def query(self, groups, key_min=None, key_max=None) -> pd.DataFrame:
+        """
+        Returns the max of each value column per group between key_min and key_max (inclusive,
+        None for an open end), for the groups with rows in this range.
+
+        Returns:
+        pd.DataFrame: long format with the group, "variable" (value column), "value" (the max)
+        and the key of the max (NAN if the group has no value in the range),
+        ordered by value column and group
+        """
+        columns = [self.group_column, "variable", "value", self.key_column]
+        first, last = self._range(key_min, key_max)
+        codes = self.groups.get_indexer(pd.Index(groups).unique())
+        codes = np.sort(codes[codes >= 0])
+        if first > last or len(codes) == 0:
+            return pd.DataFrame(columns=columns)
+        codes = codes[self.next_present[codes, first] <= last]
+        n_values = len(self.value_columns)
+        series = (codes[None, :] * n_values + np.arange(n_values)[:, None]).ravel()
+        maxima, positions = self.index.query(series, first, last)
+        keys = np.where(positions >= 0, self.keys[np.maximum(positions, 0)], np.nan)
+        return pd.DataFrame(
+            {
+                self.group_column: np.tile(self.groups[codes], n_values),
+                "variable": np.repeat(self.value_columns, len(codes)),
+                "value": maxima,
+                self.key_column: keys,
+            },
+            columns=columns,
+        )
+
+    def key_span(self, groups, key_min=None, key_max=None):
+        """
+        Returns the first and last key with rows of the groups between key_min and key_max,
+        (None, None) if there are no rows.
+        """
+        first, last = self._range(key_min, key_max)
+        codes = self.groups.get_indexer(pd.Index(groups).unique())
+        codes = codes[codes >= 0]
+        if first > last or len(codes) == 0:
+            return None, None
+        first_present = self.next_present[codes, first].min()
+        last_present = self.previous_present[codes, last].max()
+        if first_present > last:
+            return None, None
+        return self.keys[first_present], self.keys[last_present]
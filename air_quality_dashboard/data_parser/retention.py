@@ -0,0 +1,269 @@
+"""
+Module containing the retention of the history of the local data. The hourly snapshots are kept
+for a configurable window, older snapshots are downsampled into daily means and the daily means
+older than a second window into monthly means. The means are stored in colder, more compressed
+files, so that the storage and the load time stay bounded, while the older ranges can still be
+queried (LocalData.history). The compaction runs as background job with progress metrics.
+"""
+
+import os
+import threading
+import time
+import pandas as pd
+from air_quality_dashboard.data_parser import sources
+
+RAW_RETENTION = pd.Timedelta(
+    days=int(os.environ.get("AIR_QUALITY_RAW_RETENTION_DAYS", 90))
+)
+DAILY_RETENTION = pd.Timedelta(
+    days=int(os.environ.get("AIR_QUALITY_DAILY_RETENTION_DAYS", 2 * 365))
+)
+COMPACTION_INTERVAL = 24 * 60 * 60  # seconds
+COLD_COMPRESSION = {"method": "xz", "preset": 9}  # smaller files, but slower to write
+SITE_COLUMNS = ["Type of site", "Location"]
+# the aggregates of a tier are stored in one file per period (daily: month, monthly: year)
+TIER_FILE_PERIOD = {"daily": "M", "monthly": "Y"}
+
+
+def downsample(df: pd.DataFrame, frequency: str) -> pd.DataFrame:
+    """
+    Returns the mean of the pollutants per site and period.
+
+    Args:
+    df (pd.DataFrame): the snapshots (or the means of a finer period)
+    frequency (str): the period, "D" for days and "M" for months
+
+    Returns:
+    pd.DataFrame: same columns, the timestamp is the start of the period
+    """
+    value_columns = [column for column in sources.POLLUTANT_COLUMNS if column in df]
+    periods = df["timestamp"].dt.to_period(frequency).dt.start_time
+    means = (
+        df.groupby([periods, *SITE_COLUMNS], dropna=False, sort=True)[value_columns]
+        .mean()
+        .reset_index()
+    )
+    return means[[column for column in df.columns if column in means]]
+
+
+def row_hours(df: pd.DataFrame, tier: str) -> pd.Series:
+    """
+    Returns the hours each row of a tier stands for (1 for the snapshots, 24 for the daily means,
+    the hours of the month for the monthly means), to weight the means of the downsampled history
+    like the snapshots they replace.
+    """
+    if tier == "monthly":
+        return df["timestamp"].dt.days_in_month * 24
+    return pd.Series(24 if tier == "daily" else 1, index=df.index)
+
+
+def in_range(df: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+    """
+    Returns the rows with a timestamp from start (inclusive) to end (exclusive),
+    None for an open end.
+    """
+    if df is None:
+        return df
+    if start is not None:
+        df = df[df["timestamp"] >= start]
+    if end is not None:
+        df = df[df["timestamp"] < end]
+    return df
+
+
+class Compactor:
+    """
+    Downsamples the aged history of a LocalData instance into the daily and monthly tiers.
+    """
+
+    def __init__(
+        self,
+        localdata,
+        raw_retention: pd.Timedelta = RAW_RETENTION,
+        daily_retention: pd.Timedelta = DAILY_RETENTION,
+    ) -> None:
+        """
+        Args:
+        localdata (LocalData): the local data to compact
+        raw_retention (pd.Timedelta): the hourly snapshots are kept for this window
+        daily_retention (pd.Timedelta): the daily means are kept for this window,
+        the older ones are downsampled into monthly means
+        """
+        self.localdata = localdata
+        self.raw_retention = raw_retention
+        self.daily_retention = daily_retention
+        self.metrics = {
+            "runs": 0,
+            "running": False,
+            "step": None,
+            "progress": None,
+            "last_run": None,
+            "duration": None,
+            "rows_downsampled": 0,
+            "files_written": 0,
+            "files_removed": 0,
+            "storage": self.storage(),
+        }
+
+    def _step(self, step: str, progress: float) -> None:
+        self.metrics["step"] = step
+        self.metrics["progress"] = progress
+
+    def storage(self) -> dict:
+        """
+        Returns the bytes of the files of each tier of the history and of the pickle file.
+        """
+        storage = {
+            tier: sum(
+                os.path.getsize(path)
+                for _first, _last, path in self.localdata.history_files(tier)
+            )
+            for tier in ("raw", "daily", "monthly")
+        }
+        if os.path.exists(self.localdata.data_location):
+            storage["current"] = os.path.getsize(self.localdata.data_location)
+        return storage
+
+    def _merge_into_tier(self, df: pd.DataFrame, tier: str) -> None:
+        # one file per period, the new rows are merged with the file of the period, if any
+        if df.empty:
+            return
+        tier_start, tier_end = self.localdata.tier_ranges()[tier]
+        file_periods = df["timestamp"].dt.to_period(TIER_FILE_PERIOD[tier])
+        for period, rows in df.groupby(file_periods, sort=True):
+            existing = [
+                path
+                for first, last, path in self.localdata.history_files(tier)
+                if first <= period.end_time and last >= period.start_time
+            ]
+            chunks = [
+                in_range(pd.read_pickle(path), tier_start, tier_end) for path in existing
+            ]
+            merged = pd.concat([*chunks, rows]).sort_values(
+                by=["timestamp", *SITE_COLUMNS], kind="stable"
+            )
+            path = self.localdata.write_history_chunk(merged, tier, COLD_COMPRESSION)
+            self.metrics["files_written"] += 1
+            self._remove([old for old in existing if old != path])
+
+    def _remove(self, paths) -> None:
+        for path in paths:
+            os.remove(path)
+            self.metrics["files_removed"] += 1
+
+    def run(self) -> dict:
+        """
+        Downsamples the raw snapshots older than the raw retention into daily means, and the
+        daily means older than the daily retention into monthly means.
+
+        Returns:
+        dict: the metrics of the compaction
+        """
+        localdata = self.localdata
+        started = time.perf_counter()
+        self.metrics["running"] = True
+        self._step("planning", 0.0)
+        try:
+            with localdata.write_lock:
+                max_time = localdata.statistics.max_time
+                if max_time is None:
+                    return self.metrics
+                boundaries = localdata.tier_boundaries()
+                ranges = localdata.tier_ranges()
+                # the boundaries only move forward, at the start of a day / month
+                raw_from = (max_time - self.raw_retention).floor("D")
+                if boundaries["raw"] is not None:
+                    raw_from = max(raw_from, boundaries["raw"])
+                daily_from = (max_time - self.daily_retention).to_period("M").start_time
+                if boundaries["daily"] is not None:
+                    daily_from = max(daily_from, boundaries["daily"])
+                daily_from = min(daily_from, raw_from)
+
+                self._step("raw to daily", 0.1)
+                raw_files = [
+                    (first, last, path)
+                    for first, last, path in localdata.history_files("raw")
+                    if first < raw_from
+                ]
+                raw = [
+                    in_range(pd.read_pickle(path), ranges["raw"][0], raw_from)
+                    for _first, _last, path in raw_files
+                ]
+                if localdata.df is not None:
+                    raw.append(in_range(localdata.df, ranges["raw"][0], raw_from))
+                raw = pd.concat(raw) if raw else pd.DataFrame()
+                daily = downsample(raw, "D") if len(raw) else raw
+                self.metrics["rows_downsampled"] += len(raw)
+
+                self._step("daily to monthly", 0.4)
+                daily_files = [
+                    (first, last, path)
+                    for first, last, path in localdata.history_files("daily")
+                    if first < daily_from
+                ]
+                aged = [
+                    in_range(pd.read_pickle(path), ranges["daily"][0], daily_from)
+                    for _first, _last, path in daily_files
+                ]
+                if len(daily):
+                    aged.append(in_range(daily, None, daily_from))
+                    daily = in_range(daily, daily_from, None)
+                aged = pd.concat(aged) if aged else pd.DataFrame()
+                monthly = downsample(aged, "M") if len(aged) else aged
+                self.metrics["rows_downsampled"] += len(aged)
+
+                self._step("writing", 0.6)
+                self._merge_into_tier(monthly, "monthly")
+                self._merge_into_tier(daily, "daily")
+                # from here on the downsampled rows of the finer tiers are ignored
+                localdata.set_tier_boundaries(daily_from, raw_from)
+
+                self._step("cleanup", 0.8)
+                for first, last, path in raw_files:
+                    if last >= raw_from:  # partly downsampled, the rest is kept
+                        localdata.write_history_chunk(
+                            in_range(pd.read_pickle(path), raw_from, None)
+                        )
+                        self.metrics["files_written"] += 1
+                self._remove(path for _first, _last, path in raw_files)
+                self._remove(
+                    path for _first, last, path in daily_files if last < daily_from
+                )
+        finally:
+            self.metrics["running"] = False
+            self.metrics["runs"] += 1
+            self.metrics["last_run"] = pd.Timestamp.now().isoformat()
+            self.metrics["duration"] = time.perf_counter() - started
+            self.metrics["storage"] = self.storage()
+            self._step(None, 1.0)
+        return self.metrics
+
+    def start(self, interval: float = None) -> threading.Event:
+        """
+        Runs the compaction now and then periodically in a background thread, if this process
+        is the writer of the local data, errors are printed and the compaction is retried with
+        the next interval.
+
+        Returns:
+        threading.Event: set it to stop the compaction
+        """
+        interval = COMPACTION_INTERVAL if interval is None else interval
+        stop = threading.Event()
+
+        def compaction_loop():
+            while not stop.is_set():
+                try:
+                    if self.localdata.writer.acquire():
+                        self.run()
+                except (OSError, ValueError, KeyError) as e:
+                    print(
+                        f"The compaction of {self.localdata.data_source_name} failed: {e}"
+                    )
+                stop.wait(interval)
+
+        threading.Thread(
+            target=compaction_loop,
+            name=f"compaction {self.localdata.data_source_name}",
+            daemon=True,
+        ).start()
+        return stop
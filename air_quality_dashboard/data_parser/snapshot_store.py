@@ -0,0 +1,348 @@
+"""
+Module containing the SnapshotStore class, a compact storage for the hourly snapshots of a local
+data source. The sites (e.g. Location and Type of site) are dictionary encoded once, each snapshot
+only keeps the site codes and the pollutant values as integer arrays. The values can be delta
+encoded against the previous value of the same site, with a keyframe every keyframe_interval
+snapshots, so that a snapshot is decoded from the last keyframe instead of the first snapshot.
+"""
+
+import lzma
+import os
+import pickle
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+DEFAULT_KEYFRAME_INTERVAL = 24  # snapshots, i.e. one keyframe per day of hourly snapshots
+
+
+def _smallest_int_dtype(values: np.ndarray):
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if values.size == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+    return np.int64
+
+
+class SnapshotStore:
+    """
+    Dictionary and delta encoded snapshots, with the same rows as the original snapshots
+    (values as floats).
+    """
+
+    def __init__(
+        self,
+        value_columns: list,
+        site_columns: list = ("Type of site", "Location"),
+        scale: int = 1,
+        delta: bool = True,
+        keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+    ) -> None:
+        """
+        Args:
+        value_columns (list): the numeric columns (e.g. the pollutants)
+        site_columns (list): the columns identifying a site, dictionary encoded
+        scale (int): the values are stored as integers of value * scale, e.g. 10 for one decimal
+        delta (bool): store the difference to the previous value of the site
+        keyframe_interval (int): number of snapshots between two snapshots stored without delta
+        """
+        self.value_columns = list(value_columns)
+        self.site_columns = list(site_columns)
+        self.scale = scale
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval if delta else 1
+        self.sites = []  # site code -> tuple of the site columns
+        self._site_codes = {}
+        self.timestamps = []
+        self._codes = []  # per snapshot, the site codes of the rows
+        self._values = []  # per snapshot, the (delta) encoded values of the rows
+        self._missing = []  # per snapshot, the mask of the missing values
+        self._last = np.zeros((0, len(self.value_columns)), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, value_columns: list, **arguments):
+        """
+        Encodes an archive of snapshots (e.g. the pickle file of LocalData), in chronological order.
+        """
+        store = cls(value_columns, **arguments)
+        for _, snapshot in df.groupby("timestamp", sort=True):
+            store.append(snapshot)
+        return store
+
+    def _encode_sites(self, snapshot: pd.DataFrame) -> np.ndarray:
+        keys = list(
+            snapshot[self.site_columns].astype(object).itertuples(index=False, name=None)
+        )
+        for key in keys:
+            if key not in self._site_codes:
+                self._site_codes[key] = len(self.sites)
+                self.sites.append(key)
+        if len(self._last) < len(self.sites):
+            new_sites = len(self.sites) - len(self._last)
+            self._last = np.pad(self._last, ((0, new_sites), (0, 0)))
+        return np.array([self._site_codes[key] for key in keys], dtype=np.int64)
+
+    def append(self, snapshot: pd.DataFrame) -> None:
+        """
+        Encodes a snapshot (all rows with the same timestamp), it has to be newer than the
+        last stored snapshot and has to contain each site once (the values are delta encoded
+        per site).
+        """
+        timestamp = pd.Timestamp(snapshot["timestamp"].iloc[0])
+        if self.timestamps and timestamp <= self.timestamps[-1]:
+            raise ValueError(
+                f"The snapshot {timestamp} is not newer than the last snapshot"
+            )
+        duplicated = snapshot.duplicated(self.site_columns)
+        if duplicated.any():
+            sites = snapshot.loc[duplicated, self.site_columns[-1]].unique()
+            raise ValueError(
+                f"The snapshot {timestamp} contains the sites {', '.join(map(str, sites))} "
+                "more than once"
+            )
+        values = snapshot[self.value_columns].to_numpy(dtype=float) * self.scale
+        missing = np.isnan(values)
+        integers = np.round(np.where(missing, 0, values))
+        if not np.array_equal(integers, np.where(missing, 0, values)):
+            raise ValueError(
+                f"The values of {timestamp} are not integers at the scale {self.scale}"
+            )
+        integers = integers.astype(np.int64)
+        codes = self._encode_sites(snapshot)
+        if len(self) % self.keyframe_interval == 0:
+            self._last[:] = 0  # keyframe, decoded without the previous snapshots
+        last = self._last[codes]
+        self._codes.append(codes)
+        self._values.append(np.where(missing, 0, integers - last))
+        self._missing.append(missing)
+        self._last[codes] = np.where(missing, last, integers)
+        self.timestamps.append(timestamp)
+
+    def _decode(self, first: int, last: int):
+        # decodes the snapshots first..last (inclusive), starting at the keyframe before first
+        start = first - first % self.keyframe_interval
+        lengths = [len(codes) for codes in self._codes[start : last + 1]]
+        positions = np.repeat(np.arange(start, last + 1), lengths)
+        codes = np.concatenate(self._codes[start : last + 1])
+        missing = np.concatenate(self._missing[start : last + 1])
+        # a value is the sum of the deltas of its site since the keyframe,
+        # missing values are stored as 0 and do not change the sum
+        values = (
+            pd.DataFrame(np.concatenate(self._values[start : last + 1]))
+            .groupby([positions // self.keyframe_interval, codes])
+            .cumsum()
+            .to_numpy()
+        )
+        decoded = positions >= first
+        return (
+            positions[decoded],
+            codes[decoded],
+            np.where(missing, np.nan, values)[decoded],
+        )
+
+    def _to_dataframe(self, positions, codes, values) -> pd.DataFrame:
+        columns = self.site_columns + self.value_columns + ["timestamp"]
+        if len(positions) == 0:
+            return pd.DataFrame(columns=columns)
+        sites = np.empty((len(self.sites), len(self.site_columns)), dtype=object)
+        sites[:] = self.sites
+        values = values / self.scale
+        data = {column: sites[codes, i] for i, column in enumerate(self.site_columns)}
+        data.update({column: values[:, j] for j, column in enumerate(self.value_columns)})
+        data["timestamp"] = np.array(self.timestamps, dtype="datetime64[ns]")[positions]
+        # the rows are numbered per snapshot, as in the archive of LocalData
+        first_rows = np.flatnonzero(np.diff(positions, prepend=-1))
+        index = np.arange(len(positions)) - np.repeat(
+            first_rows, np.diff(np.append(first_rows, len(positions)))
+        )
+        return pd.DataFrame(data, index=index, columns=columns)
+
+    def snapshot(self, timestamp) -> pd.DataFrame:
+        """
+        Returns the snapshot of a timestamp.
+        """
+        position = np.searchsorted(self.timestamps, pd.Timestamp(timestamp))
+        if position == len(self) or self.timestamps[position] != pd.Timestamp(timestamp):
+            raise KeyError(f"There is no snapshot {timestamp}")
+        return self._to_dataframe(*self._decode(position, position))
+
+    def time_range(self, start=None, end=None) -> pd.DataFrame:
+        """
+        Returns the snapshots between start and end (inclusive, None for an open end).
+        """
+        first = 0 if start is None else np.searchsorted(self.timestamps, pd.Timestamp(start))
+        last = (
+            len(self) - 1
+            if end is None
+            else np.searchsorted(self.timestamps, pd.Timestamp(end), side="right") - 1
+        )
+        if first > last:
+            return self._to_dataframe([], [], [])
+        return self._to_dataframe(*self._decode(int(first), int(last)))
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns all snapshots.
+        """
+        return self.time_range()
+
+    def _is_keyframe(self, position: int) -> bool:
+        return position % self.keyframe_interval == 0
+
+    def to_arrays(self) -> dict:
+        """
+        Returns the encoded store as typed arrays of the smallest integer types. The values
+        of the keyframes and the deltas are separate arrays, as the deltas need fewer bits.
+        """
+        n_columns = len(self.value_columns)
+
+        def concatenate(arrays, shape, dtype):
+            return np.concatenate(arrays) if arrays else np.zeros(shape, dtype=dtype)
+
+        offsets = np.cumsum([0] + [len(codes) for codes in self._codes])
+        codes = concatenate(self._codes, 0, np.int64)
+        keyframes = concatenate(
+            [
+                values
+                for position, values in enumerate(self._values)
+                if self._is_keyframe(position)
+            ],
+            (0, n_columns),
+            np.int64,
+        )
+        deltas = concatenate(
+            [
+                values
+                for position, values in enumerate(self._values)
+                if not self._is_keyframe(position)
+            ],
+            (0, n_columns),
+            np.int64,
+        )
+        missing = concatenate(self._missing, (0, n_columns), bool)
+        return {
+            "timestamps": np.array(self.timestamps, dtype="datetime64[ns]"),
+            "offsets": offsets.astype(_smallest_int_dtype(offsets)),
+            "codes": codes.astype(_smallest_int_dtype(codes)),
+            "keyframes": keyframes.astype(_smallest_int_dtype(keyframes)),
+            "deltas": deltas.astype(_smallest_int_dtype(deltas)),
+            "missing": np.packbits(missing.ravel()),
+        }
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Size of the encoded arrays in bytes (without the site dictionary).
+        """
+        return sum(array.nbytes for array in self.to_arrays().values())
+
+    def save(self, path: str) -> None:
+        """
+        Saves the store as xz compressed pickle of the typed arrays.
+        """
+        state = {
+            "value_columns": self.value_columns,
+            "site_columns": self.site_columns,
+            "scale": self.scale,
+            "delta": self.delta,
+            "keyframe_interval": self.keyframe_interval,
+            "sites": self.sites,
+            "arrays": self.to_arrays(),
+        }
+        with lzma.open(path, "wb") as file:
+            pickle.dump(state, file)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads a store saved with save().
+        """
+        with lzma.open(path, "rb") as file:
+            state = pickle.load(file)
+        store = cls(
+            state["value_columns"],
+            state["site_columns"],
+            state["scale"],
+            state["delta"],
+            state["keyframe_interval"],
+        )
+        store.sites = [tuple(site) for site in state["sites"]]
+        store._site_codes = {site: code for code, site in enumerate(store.sites)}
+        arrays = state["arrays"]
+        offsets = arrays["offsets"].astype(np.int64)
+        n_columns = len(store.value_columns)
+        missing = np.unpackbits(arrays["missing"], count=offsets[-1] * n_columns)
+        missing = missing.astype(bool).reshape(-1, n_columns)
+        codes = arrays["codes"].astype(np.int64)
+        starts = {True: 0, False: 0}  # next row of the keyframes / deltas
+        for position, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+            keyframe = store._is_keyframe(position)
+            kind_start = starts[keyframe]
+            starts[keyframe] += end - start
+            source = arrays["keyframes"] if keyframe else arrays["deltas"]
+            store._codes.append(codes[start:end])
+            store._values.append(source[kind_start : starts[keyframe]].astype(np.int64))
+            store._missing.append(missing[start:end])
+        store.timestamps = list(pd.to_datetime(arrays["timestamps"]))
+        # state of the last values, to continue appending snapshots
+        store._last = np.zeros((len(store.sites), n_columns), dtype=np.int64)
+        if len(store):
+            last_keyframe = len(store) - 1 - (len(store) - 1) % store.keyframe_interval
+            for position in range(last_keyframe, len(store)):
+                site_codes = store._codes[position]
+                store._last[site_codes] += store._values[position]
+        return store
+
+
+def _best_time(function, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def compare_with_pickle(
+    df: pd.DataFrame, value_columns: list, repeat: int = 3, **arguments
+) -> dict:
+    """
+    Compares the store with the xz pickle file of the archive (as written by LocalData):
+    size of the files and in memory, and decoding throughput of the whole archive.
+
+    Args:
+    df (pd.DataFrame): the archive of snapshots
+    value_columns (list): the numeric columns of the store
+    repeat (int): the decoding is timed repeat times, the fastest is reported
+    arguments: further arguments of SnapshotStore (e.g. delta, keyframe_interval)
+
+    Returns:
+    dict: sizes in bytes, compression ratio (pickle / store) and rows decoded per second
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, "archive.xz")
+        store_path = os.path.join(directory, "store.xz")
+        df.to_pickle(pickle_path, compression="xz")
+        store = SnapshotStore.from_dataframe(df, value_columns, **arguments)
+        store.save(store_path)
+        pickle_seconds = _best_time(lambda: pd.read_pickle(pickle_path), repeat)
+        store_seconds = _best_time(
+            lambda: SnapshotStore.load(store_path).to_dataframe(), repeat
+        )
+        pickle_bytes = os.path.getsize(pickle_path)
+        store_bytes = os.path.getsize(store_path)
+    return {
+        "rows": len(df),
+        "snapshots": len(store),
+        "pickle_bytes": pickle_bytes,
+        "store_bytes": store_bytes,
+        "compression_ratio": pickle_bytes / store_bytes,
+        "dataframe_memory_bytes": int(df.memory_usage(deep=True).sum()),
+        "store_memory_bytes": store.nbytes,
+        "pickle_rows_per_second": len(df) / pickle_seconds,
+        "store_rows_per_second": len(df) / store_seconds,
+    }
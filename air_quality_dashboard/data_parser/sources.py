@@ -0,0 +1,160 @@
+"""
+Module containing the local data sources (national / regional air quality networks).
+Each source consists of a fetcher (download of the raw page), a parser (raw page -> dataframe)
+and a schema mapping (network specific columns -> common columns), so that new networks can
+be added by subclassing LocalSource. Many sources can be fetched concurrently with fetch_snapshots.
+"""
+
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import pandas as pd
+from air_quality_dashboard.data_parser import fetch
+
+
+LOCAL_DEFAULT_DATA_URL = r"https://www.bafu.admin.ch/bafu/en/home/topics/air/state/data/air-pollution--real-time-data/table-of-the-current-situation-nabel.html"
+
+# common columns of all local sources
+POLLUTANT_COLUMNS = ["O3", "O3max", "NO2", "NOX", "PM10", "SO2"]
+
+
+class LocalSource:
+    """
+    Base class of a local air quality data source, which returns one snapshot
+    (the current values of all sites) per call of get_snapshot.
+    """
+
+    # mapping of the source specific column names to the common column names
+    column_mapping = {}
+    # rows which are not measurements, identified by their "Type of site"
+    excluded_sites = []
+    # row containing the limits (ambient air quality standard), if published by the source
+    limits_site = None
+
+    def __init__(self, url: str, name: str, timeout: float = 5) -> None:
+        """
+        Args:
+        url (str): the URL of the air quality data
+        name (str): the name of the data source, used for the name of the archive
+        timeout (float): timeout of the requests in seconds
+        """
+        self.url = url
+        self.name = name
+        self.timeout = timeout
+        self.limits = None  # limit per pollutant, updated with every snapshot
+
+    def fetch(self) -> bytes:
+        """
+        Downloads the raw content of the data source (through the shared fetcher, see fetch).
+        """
+        return fetch.shared_fetcher().get(self.url, timeout=self.timeout)
+
+    def parse(self, content: bytes) -> pd.DataFrame:
+        """
+        Parses the raw content into a dataframe with a "timestamp" column.
+        """
+        raise NotImplementedError
+
+    def map_schema(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Maps the parsed dataframe onto the common columns: renames the columns,
+        converts the pollutant values to float / NAN and removes the excluded rows.
+        The row with the limits is kept in the limits attribute.
+        """
+        df = df.rename(columns=self.column_mapping)
+        for column in POLLUTANT_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].apply(pd.to_numeric, errors="coerce")
+        if self.limits_site is not None:
+            limits = df.loc[df["Type of site"] == self.limits_site]
+            if len(limits):
+                self.limits = limits.iloc[0].reindex(POLLUTANT_COLUMNS).astype(float)
+        # convert type of site to category
+        df["Type of site"] = df["Type of site"].astype("category")
+        return df.loc[~df["Type of site"].isin(self.excluded_sites)]
+
+    def get_snapshot(self) -> pd.DataFrame:
+        """
+        Fetches, parses and maps the current snapshot of the data source.
+        """
+        return self.map_schema(self.parse(self.fetch()))
+
+
+class NabelSource(LocalSource):
+    """
+    Swiss NABEL network (BAFU), the current values of all sites are published hourly as html table.
+    """
+
+    column_mapping = {
+        "O₃": "O3",
+        "O₃max": "O3max",
+        "NO₂": "NO2",
+        "NOₓ": "NOX",
+        "SO₂": "SO2",
+    }
+    limits_site = "Ambient air quality standard [µg/m³]"  # the critical values
+    excluded_sites = [limits_site]
+
+    def __init__(
+        self,
+        url: str = LOCAL_DEFAULT_DATA_URL,
+        name: str = "Switzerland",
+        timeout: float = 5,
+    ) -> None:
+        super().__init__(url, name, timeout)
+
+    def parse(self, content: bytes) -> pd.DataFrame:
+        # only needed to ingest new snapshots, hence not imported at the startup of the dashboard
+        from bs4 import BeautifulSoup
+
+        # makes everything readable
+        url_soup = BeautifulSoup(content, "html.parser")
+
+        # finds table for dataframe
+        url_table = url_soup.find("table")
+
+        # creates dataframe with string values
+        df = pd.read_html(io.StringIO(url_table.prettify()))[0]
+
+        date = url_table.find("caption").get_text(strip=True)
+        df["timestamp"] = pd.to_datetime(date.lstrip("Date from: "), dayfirst=True)
+        return df
+
+
+# available local sources, name -> class
+SOURCES = {
+    "Switzerland": NabelSource,
+}
+
+
+def fetch_snapshots(
+    sources: list, max_workers: int = 8, timeout: float = 30
+) -> dict:
+    """
+    Fetches the snapshots of many sources concurrently in a thread pool, so that
+    the latency of the sources does not add up.
+
+    Args:
+    sources (list): the LocalSource instances to fetch
+    max_workers (int): number of concurrent fetches
+    timeout (float): time in seconds after which the remaining sources are given up
+
+    Returns:
+    dict: source name -> snapshot dataframe, or the exception raised by the source
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {source.name: executor.submit(source.get_snapshot) for source in sources}
+    deadline = time.monotonic() + timeout
+    snapshots = {}
+    for name, future in futures.items():
+        try:
+            snapshots[name] = future.result(
+                timeout=max(0, deadline - time.monotonic())
+            )
+        except FutureTimeoutError:
+            snapshots[name] = TimeoutError(f"{name} did not answer within {timeout}s")
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            snapshots[name] = e  # one failing source must not stop the others
+    executor.shutdown(wait=False, cancel_futures=True)
+    return snapshots
@@ -0,0 +1,139 @@
+"""
+Module containing a spatial index over coordinates (latitude / longitude), to answer bounding box,
+radius and k-nearest queries without scanning all points. The points are bucketed into a regular
+grid of cells and sorted by their cell, so that each row of cells is a contiguous slice.
+"""
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat_1, lon_1, lat_2, lon_2):
+    """
+    Great circle distance in km between coordinates (in degrees), vectorized with numpy.
+    """
+    lat_1, lon_1, lat_2, lon_2 = map(np.radians, (lat_1, lon_1, lat_2, lon_2))
+    a = (
+        np.sin((lat_2 - lat_1) / 2) ** 2
+        + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class SpatialIndex:
+    """
+    Grid bucket index over coordinates, the returned indices refer to the order of the
+    coordinates passed to the constructor.
+    """
+
+    def __init__(self, latitude, longitude, cell_size: float = 1.0) -> None:
+        """
+        Args:
+        latitude (array-like): latitude of the points in degrees
+        longitude (array-like): longitude of the points in degrees
+        cell_size (float): size of the grid cells in degrees
+        """
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.longitude = (np.asarray(longitude, dtype=float) + 180) % 360 - 180
+        self.cell_size = cell_size
+        self.n_lat_cells = int(np.ceil(180 / cell_size))
+        self.n_lon_cells = int(np.ceil(360 / cell_size))
+        cells = (
+            self._lat_cell(self.latitude) * self.n_lon_cells
+            + self._lon_cell(self.longitude)
+        )
+        self.order = np.argsort(cells, kind="stable")
+        self.sorted_cells = cells[self.order]
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def _lat_cell(self, latitude):
+        return np.clip(
+            np.floor((np.asarray(latitude) + 90) / self.cell_size).astype(int),
+            0,
+            self.n_lat_cells - 1,
+        )
+
+    def _lon_cell(self, longitude):
+        return np.clip(
+            np.floor((np.asarray(longitude) + 180) / self.cell_size).astype(int),
+            0,
+            self.n_lon_cells - 1,
+        )
+
+    def _candidates(self, lat_min, lat_max, lon_ranges):
+        # for every row of cells, the cells between two longitudes are a contiguous slice
+        rows = np.arange(self._lat_cell(lat_min), self._lat_cell(lat_max) + 1)
+        slices = []
+        for lon_min, lon_max in lon_ranges:
+            first = rows * self.n_lon_cells + self._lon_cell(lon_min)
+            last = rows * self.n_lon_cells + self._lon_cell(lon_max)
+            starts = np.searchsorted(self.sorted_cells, first, side="left")
+            ends = np.searchsorted(self.sorted_cells, last, side="right")
+            slices.extend(
+                self.order[start:end] for start, end in zip(starts, ends) if end > start
+            )
+        if not slices:
+            return np.empty(0, dtype=int)
+        return np.concatenate(slices)
+
+    def bbox(self, lat_min, lat_max, lon_min, lon_max) -> np.ndarray:
+        """
+        Returns the indices of the points within a bounding box. If lon_min > lon_max,
+        the box crosses the antimeridian.
+        """
+        lon_min = (lon_min + 180) % 360 - 180
+        lon_max = (lon_max + 180) % 360 - 180
+        if lon_min <= lon_max:
+            lon_ranges = [(lon_min, lon_max)]
+        else:
+            lon_ranges = [(lon_min, 180), (-180, lon_max)]
+        candidates = self._candidates(lat_min, lat_max, lon_ranges)
+        latitude = self.latitude[candidates]
+        longitude = self.longitude[candidates]
+        in_lon = np.zeros(len(candidates), dtype=bool)
+        for range_min, range_max in lon_ranges:
+            in_lon |= (longitude >= range_min) & (longitude <= range_max)
+        return candidates[(latitude >= lat_min) & (latitude <= lat_max) & in_lon]
+
+    def radius(self, lat, lon, radius_km):
+        """
+        Returns the indices of the points within radius_km of a coordinate, and their distances,
+        sorted by distance.
+        """
+        delta_lat = np.degrees(radius_km / EARTH_RADIUS_KM)
+        lat_min, lat_max = lat - delta_lat, lat + delta_lat
+        cos_lat = np.cos(np.radians(max(abs(lat_min), abs(lat_max))))
+        if lat_min <= -90 or lat_max >= 90 or delta_lat / max(cos_lat, 1e-12) >= 180:
+            lon_ranges = [(-180, 180)]  # the circle contains a pole / spans all longitudes
+        else:
+            delta_lon = delta_lat / cos_lat
+            lon_min = (lon - delta_lon + 180) % 360 - 180
+            lon_max = (lon + delta_lon + 180) % 360 - 180
+            if lon_min <= lon_max:
+                lon_ranges = [(lon_min, lon_max)]
+            else:
+                lon_ranges = [(lon_min, 180), (-180, lon_max)]
+        candidates = self._candidates(max(lat_min, -90), min(lat_max, 90), lon_ranges)
+        distances = haversine_km(
+            lat, lon, self.latitude[candidates], self.longitude[candidates]
+        )
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind="stable")
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lon, k: int = 5):
+        """
+        Returns the indices of the k nearest points of a coordinate, and their distances.
+        The search radius is doubled until k points are found within it.
+        """
+        k = min(k, len(self))
+        radius_km = EARTH_RADIUS_KM * np.radians(self.cell_size)
+        while True:
+            indices, distances = self.radius(lat, lon, radius_km)
+            if len(indices) >= k or radius_km >= np.pi * EARTH_RADIUS_KM:
+                return indices[:k], distances[:k]
+            radius_km *= 2
@@ -0,0 +1,101 @@
+"""
+Module containing the RunningStatistics class, which keeps aggregates of a growing dataset
+(min / max timestamp, distinct values, sums, counts and maxima per group) up to date by
+only processing the newly appended rows, so that the summary values cost O(1) to read.
+"""
+
+import pandas as pd
+
+
+class RunningStatistics:
+    """
+    Running aggregates of a dataset, updated with every appended chunk of rows.
+    """
+
+    def __init__(
+        self,
+        group_column: str,
+        value_columns: list,
+        time_column: str = "timestamp",
+        distinct_columns: list = (),
+    ) -> None:
+        """
+        Args:
+        group_column (str): column to group the sums, counts and maxima by (e.g. the site)
+        value_columns (list): numeric columns to aggregate (e.g. the pollutants)
+        time_column (str): column of which the min / max is tracked
+        distinct_columns (list): columns of which the distinct values are tracked
+        """
+        self.group_column = group_column
+        self.value_columns = list(value_columns)
+        self.time_column = time_column
+        self.n_rows = 0
+        self.min_time = None
+        self.max_time = None
+        self.distinct = {column: set() for column in distinct_columns}
+        self.sums = pd.DataFrame(columns=self.value_columns, dtype=float)
+        self.counts = pd.DataFrame(columns=self.value_columns, dtype=float)
+        self.maxima = pd.DataFrame(columns=self.value_columns, dtype=float)
+
+    def update(self, df: pd.DataFrame, weights: pd.Series = None) -> None:
+        """
+        Adds the rows of df (only the new rows, not the whole dataset) to the aggregates.
+
+        Args:
+        df (pd.DataFrame): the new rows
+        weights (pd.Series): number of rows each row stands for (e.g. 24 for the daily mean of
+        hourly rows), in the row count, sums and counts (not in the maxima), 1 by default
+        """
+        if len(df) == 0:
+            return
+        self.n_rows += len(df) if weights is None else int(weights.sum())
+        chunk_min, chunk_max = df[self.time_column].min(), df[self.time_column].max()
+        if self.min_time is None or chunk_min < self.min_time:
+            self.min_time = chunk_min
+        if self.max_time is None or chunk_max > self.max_time:
+            self.max_time = chunk_max
+        for column, values in self.distinct.items():
+            values.update(df[column].dropna().drop_duplicates().tolist())
+
+        # aggregate the chunk per group, then combine with the previous aggregates
+        values = df[self.value_columns]
+        present = values.notna()
+        if weights is not None:
+            values = values.mul(weights, axis=0)
+            present = present.mul(weights, axis=0)
+        groups = df[self.group_column].astype(object)
+        grouped = df[self.value_columns].groupby(groups, dropna=True)
+        self.sums = values.groupby(groups, dropna=True).sum().add(self.sums, fill_value=0)
+        self.counts = present.groupby(groups, dropna=True).sum().add(self.counts, fill_value=0)
+        if self.maxima.empty:
+            self.maxima = grouped.max()
+        else:
+            self.maxima = (
+                pd.concat([self.maxima, grouped.max()]).groupby(level=0).max()
+            )
+
+    def n_distinct(self, column: str) -> int:
+        """
+        Returns the number of distinct values of a column.
+        """
+        return len(self.distinct[column])
+
+    def mean_per_group(self) -> pd.DataFrame:
+        """
+        Returns the mean of the value columns per group.
+        """
+        return self.sums / self.counts.where(self.counts > 0)
+
+    def summary_per_value(self) -> pd.DataFrame:
+        """
+        Returns sum, count, mean and max of each value column over all groups.
+        """
+        summary = pd.DataFrame(
+            {
+                "sum": self.sums.sum(),
+                "count": self.counts.sum(),
+                "max": self.maxima.max(),
+            }
+        )
+        summary["mean"] = summary["sum"] / summary["count"].where(summary["count"] > 0)
+        return summary
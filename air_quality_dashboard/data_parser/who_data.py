@@ -2,13 +2,71 @@
 Module containing WHOData class to load and update the WHO air quality data.
 """
 
+import functools
 import io
 import os
 import pandas as pd
-import requests
+from air_quality_dashboard.data_parser import artifacts, atomic, fetch
+from air_quality_dashboard.data_parser.forecast import WHOForecaster
+from air_quality_dashboard.data_parser.range_query import GroupRangeMax
+from air_quality_dashboard.data_parser.spatial_index import SpatialIndex
+from air_quality_dashboard.data_parser.statistics import RunningStatistics
 
 
+POLLUTANT_COLUMNS = ["pm10_concentration", "pm25_concentration", "no2_concentration"]
+WHO_SHEET_NAME = "Update 2024 (V6.1)"
 DEFAULT_DATA_URL = r"https://cdn.who.int/media/docs/default-source/air-pollution-documents/air-quality-and-health/who_ambient_air_quality_database_version_2024_(v6.1).xlsx"
+DATA_LOCATION = os.path.join("data", "air_quality_data.xz")
+DOWNLOAD_TIMEOUT = 15  # seconds
+
+
+def prepare_who_air_quality_data(pd_air_quality_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sets the correct datatypes of the raw WHO air quality data (sheet of the excel file).
+
+    Args:
+    pd_air_quality_data (pd.DataFrame): the raw WHO air quality data
+
+    Returns:
+    pd.DataFrame: the WHO air quality data with the correct datatypes
+    """
+    # set the correct datatypes
+    pd_air_quality_data["who_ms"] = pd_air_quality_data["who_ms"].astype(bool)
+    pd_air_quality_data["who_region"] = pd_air_quality_data["who_region"].astype(
+        pd.CategoricalDtype()
+    )
+    pd_air_quality_data["iso3"] = pd_air_quality_data["iso3"].astype(str)
+    pd_air_quality_data["city"] = pd_air_quality_data["city"].astype(str)
+    pd_air_quality_data["country_name"] = pd_air_quality_data["country_name"].astype(str)
+    pd_air_quality_data["version"] = pd_air_quality_data["version"].astype(str)
+    pd_air_quality_data = pd_air_quality_data.dropna(
+        subset=["year"]
+    )  # cleanup rows with missing year, i.e. pointless data
+    pd_air_quality_data["year"] = pd.to_datetime(
+        pd_air_quality_data["year"], format="%Y"
+    )
+    pd_air_quality_data["year_int"] = pd_air_quality_data["year"].dt.strftime(
+        "%Y"
+    )  # have a year as integer for the data table
+    pd_air_quality_data["year_int"] = pd_air_quality_data["year_int"].astype(float)
+    return pd_air_quality_data
+
+
+def read_who_air_quality_excel(content: bytes) -> pd.DataFrame:
+    """
+    Reads the WHO air quality data from the content of the excel file and sets the datatypes.
+    """
+    return prepare_who_air_quality_data(
+        pd.read_excel(io.BytesIO(content), WHO_SHEET_NAME)
+    )
+
+
+def simplify_type_of_stations(type_of_stations: pd.Series) -> pd.Series:
+    """
+    Keeps the first type of station of each entry (e.g. "Urban, Traffic" -> "Urban"),
+    for an easier selection in the dashboard.
+    """
+    return type_of_stations.str.replace(",", " ").str.split().str[0]
 
 
 class WHOData:
@@ -21,6 +79,19 @@ class WHOData:
         self.df = self.get_who_air_quality_data()
         self.calculate_statistics()
 
+    @classmethod
+    def from_dataframe(
+        cls, df: pd.DataFrame, air_quality_data_url: str = DEFAULT_DATA_URL
+    ) -> "WHOData":
+        """
+        Creates a WHOData instance from already loaded data, without reading the pickle file.
+        """
+        whodata = cls.__new__(cls)
+        whodata.air_quality_data_url = air_quality_data_url
+        whodata.df = df
+        whodata.calculate_statistics()
+        return whodata
+
     def download_who_air_quality_data(self):
         """
         Downloads the WHO air quality data from the WHO website and saves it as a pickle file.
@@ -28,96 +99,170 @@ class WHOData:
         Returns:
         pd.DataFrame: the WHO air quality data
         """
-        for _attempt in range(3):
-            if _attempt == 2:
-                print("We tried to download the data 3 times, but failed.")
-                raise SystemError("We tried to download the data 3 times, but failed.")
-            try:
-                air_quality_data = requests.get(self.air_quality_data_url, timeout=15)
-                if air_quality_data.status_code == 200:
-                    pd_air_quality_data = pd.read_excel(
-                        io.BytesIO(air_quality_data.content), "Update 2024 (V6.1)"
-                    )
-            except requests.exceptions.Timeout:
-                print("The request timed out, try again.")
-                continue
-            except requests.exceptions.TooManyRedirects:
-                print("Too many redirects, try again.")
-                continue
-            except pd.errors.ParserError:
-                print("The data file is corrupted, retry.")
-                continue
-            except Exception as e:
-                print(
-                    f"An error occured and we can't continue, as we don't have the WHO data: {e}"
-                )
-                ## stop the execution of the programm
-                raise SystemError(e) from e
-            else:
-                break
-
-        # set the correct datatypes
-        pd_air_quality_data["who_ms"] = pd_air_quality_data["who_ms"].astype(bool)
-        pd_air_quality_data["who_region"] = pd_air_quality_data["who_region"].astype(
-            pd.CategoricalDtype()
-        )
-        pd_air_quality_data["iso3"] = pd_air_quality_data["iso3"].astype(str)
-        pd_air_quality_data["city"] = pd_air_quality_data["city"].astype(str)
-        pd_air_quality_data["country_name"] = pd_air_quality_data[
-            "country_name"
-        ].astype(str)
-        pd_air_quality_data["version"] = pd_air_quality_data["version"].astype(str)
-        pd_air_quality_data = pd_air_quality_data.dropna(
-            subset=["year"]
-        )  # cleanup rows with missing year, i.e. pointless data
-        pd_air_quality_data["year"] = pd.to_datetime(
-            pd_air_quality_data["year"], format="%Y"
-        )
-        pd_air_quality_data["year_int"] = pd_air_quality_data["year"].dt.strftime(
-            "%Y"
-        )  # have a year as integer for the data table
-        pd_air_quality_data["year_int"] = pd_air_quality_data["year_int"].astype(float)
-        # save the data
-        pd_air_quality_data.to_pickle(
-            os.path.join("data", "air_quality_data.xz"), compression="xz"
-        )
+        # the timeouts and retries are the ones of the shared fetcher, the excel file
+        # is mirrored, hence it is downloaded only once
+        try:
+            content = fetch.shared_fetcher().get(
+                self.air_quality_data_url, timeout=DOWNLOAD_TIMEOUT, max_age=None
+            )
+            pd_air_quality_data = pd.read_excel(io.BytesIO(content), WHO_SHEET_NAME)
+        except Exception as e:
+            print(
+                f"An error occured and we can't continue, as we don't have the WHO data: {e}"
+            )
+            ## stop the execution of the programm
+            raise SystemError(e) from e
+
+        pd_air_quality_data = prepare_who_air_quality_data(pd_air_quality_data)
+        # save the data, the other processes never read a partial file
+        atomic.write_pickle(pd_air_quality_data, DATA_LOCATION)
         return pd_air_quality_data
 
     def load_who_air_quality_data(self):
         """
-        Loads the WHO air quality data from the pickle file.
+        Loads the WHO air quality data from the build artifacts if available,
+        otherwise from the pickle file.
 
         Returns:
         pd.DataFrame: the WHO air quality data
         """
-        return pd.read_pickle(os.path.join("data", "air_quality_data.xz"))
+        pd_air_quality_data = artifacts.load_current("who_data")
+        if pd_air_quality_data is not None:
+            return pd_air_quality_data
+        return pd.read_pickle(DATA_LOCATION)
 
     def get_who_air_quality_data(self):
         """
         Downloads the WHO air quality data if it does not exist, \
             otherwise loads it from the pickle file.
+        If several processes start together, only one downloads the data,
+        the others wait for it and load its file.
 
         Returns:
         pd.DataFrame: the WHO air quality data
         """
+        version = atomic.file_version(DATA_LOCATION)
         try:
             return self.load_who_air_quality_data()
         except FileNotFoundError:
-            return self.download_who_air_quality_data()
+            pass
         except pd.errors.EmptyDataError:
             print("The data file is empty, start from scratch.")
-            return self.download_who_air_quality_data()
         except pd.errors.ParserError:
             print("The data file is corrupted, start from scratch.")
+        with atomic.WriterLock(DATA_LOCATION):
+            if atomic.file_version(DATA_LOCATION) != version:
+                # downloaded by another process in the meantime
+                return self.load_who_air_quality_data()
             return self.download_who_air_quality_data()
 
     def calculate_statistics(self):
         """
         Calculates some statistics for the WHO air quality data.
+        The running statistics can be updated with new rows, without recalculating everything.
 
         Returns:
         None
         """
-        self.years = self.df["year"].unique().tolist()
-        self.years.sort()
-        self.n_countries = self.df["country_name"].nunique()
+        self.statistics = RunningStatistics(
+            group_column="country_name",
+            value_columns=POLLUTANT_COLUMNS,
+            time_column="year",
+            distinct_columns=["year", "country_name"],
+        )
+        self.statistics.update(self.df)
+        self.years = sorted(self.statistics.distinct["year"])
+        self.n_countries = self.statistics.n_distinct("country_name")
+
+    @property
+    def version(self) -> str:
+        """
+        Version of the dataset (number of rows and last year), e.g. for the keys of cached results.
+        """
+        return f"{self.statistics.n_rows}:{self.statistics.max_time}"
+
+    def station_country_lookup(self) -> dict:
+        """
+        Returns a compact lookup of the types of stations available in each country.
+        It is small and static per dataset, hence it is sent once to the webbrowser,
+        where the chained country / type of station dropdowns are resolved.
+
+        Returns:
+        dict: sorted "countries" and "stations" names, as well as "country_stations",
+        the indices of the stations available per country (same order as "countries")
+        """
+        pairs = (
+            self.df[["country_name", "type_of_stations"]]
+            .dropna()
+            .astype(str)
+            .drop_duplicates()
+        )
+        countries = sorted(self.df["country_name"].astype(str).unique())
+        stations = sorted(pairs["type_of_stations"].unique())
+        station_index = {station: index for index, station in enumerate(stations)}
+        stations_per_country = pairs.groupby("country_name")["type_of_stations"].agg(
+            lambda country_stations: sorted(
+                station_index[station] for station in country_stations
+            )
+        )
+        return {
+            "countries": countries,
+            "stations": stations,
+            "country_stations": [
+                stations_per_country.get(country, []) for country in countries
+            ],
+        }
+
+    @functools.cached_property
+    def stations(self) -> pd.DataFrame:
+        """
+        Distinct measurement stations (cities) with their coordinates, built once per dataset.
+
+        Returns:
+        pd.DataFrame: city, country_name, latitude and longitude of each station
+        """
+        return (
+            self.df.dropna(subset=["latitude", "longitude"])
+            .drop_duplicates(subset=["country_name", "city"])[
+                ["city", "country_name", "latitude", "longitude"]
+            ]
+            .reset_index(drop=True)
+        )
+
+    @functools.cached_property
+    def spatial_index(self) -> SpatialIndex:
+        """
+        Spatial index over the stations, for the radius and nearest station queries.
+        """
+        return SpatialIndex(self.stations["latitude"], self.stations["longitude"])
+
+    @functools.cached_property
+    def country_centers(self) -> pd.DataFrame:
+        """
+        Center (median coordinates of the stations) of each country.
+        """
+        return self.stations.groupby("country_name")[["latitude", "longitude"]].median()
+
+    @functools.cached_property
+    def year_range_max(self) -> GroupRangeMax:
+        """
+        Max of the pollutants per country over any range of years (and the year of the max),
+        built once per dataset.
+        """
+        return GroupRangeMax(self.df, "country_name", "year_int", POLLUTANT_COLUMNS)
+
+    def nearest_stations(self, lat, lon, k: int = 5) -> pd.DataFrame:
+        """
+        Returns the k nearest stations of a coordinate, with their distance in km.
+        """
+        indices, distances = self.spatial_index.nearest(lat, lon, k)
+        stations = self.stations.iloc[indices].copy()
+        stations["distance_km"] = distances
+        return stations
+
+    @functools.cached_property
+    def forecaster(self) -> WHOForecaster:
+        """
+        Forecast of the yearly mean concentration per country and pollutant (linear trend).
+        """
+        return WHOForecaster(self.df, POLLUTANT_COLUMNS)
@@ -0,0 +1,245 @@
+"""
+Batch rendering of the static reports (python -m air_quality_dashboard report): per country the bar
+plot of the max values and the yearly trend of each pollutant, per concentration the map of the
+last snapshot of the local sites. The figures are the ones of the dashboard pages (see figures).
+The jobs are rendered in a process pool, the state of each job is kept in the manifest of the
+report, so that an interrupted or partly failed run is resumed where it stopped.
+"""
+
+import concurrent.futures
+import hashlib
+import html
+import json
+import os
+import re
+import time
+import unicodedata
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+from air_quality_dashboard.dashboard import figures
+from air_quality_dashboard.data_parser import atomic
+from air_quality_dashboard.data_parser.who_data import WHOData
+
+REPORT_DIRECTORY = "reports"
+MANIFEST_NAME = "report.json"
+FIGURE_DIRECTORY = "figures"
+FORMATS = ("html", "png")
+MAP_CONCENTRATIONS = ("O3", "NO2", "PM10")
+PLOTLY_JS = "plotly.min.js"  # shared by the html figures of a report
+
+# data of a worker process, set once by _init_worker instead of being sent with every job
+_data = {}
+
+
+def slug(name: str) -> str:
+    """
+    Returns a file name for a job or country, e.g. "trend/Côte d'Ivoire" -> "trend_cote_d_ivoire".
+    """
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "_", ascii_name.lower()).strip("_")
+
+
+def figure_name(job_id: str) -> str:
+    """
+    Returns the file name (without extension) of the figure of a job: its slug and a short hash
+    of the job id, as several jobs can have the same slug (e.g. "Curaçao" and "Curacao").
+    """
+    digest = hashlib.sha1(job_id.encode("utf-8")).hexdigest()[:8]
+    return f"{slug(job_id)}_{digest}"
+
+
+def report_jobs(countries, concentrations=MAP_CONCENTRATIONS) -> list:
+    """
+    Returns the jobs of a report.
+
+    Returns:
+    list: (job id, kind, subject) of each figure
+    """
+    jobs = []
+    for country in countries:
+        jobs.append((f"bar_max/{country}", "bar_max", country))
+        for pollutant in figures.POLLUTANT_LABELS:
+            jobs.append((f"trend/{country}/{pollutant}", "trend", (country, pollutant)))
+    for concentration in concentrations:
+        jobs.append((f"map/{concentration}", "map", concentration))
+    return jobs
+
+
+def _init_worker(who_df, snapshot, geocodes) -> None:
+    _data["whodata"] = WHOData.from_dataframe(who_df)
+    _data["snapshot"] = snapshot
+    _data["geocodes"] = geocodes
+
+
+def build_figure(kind: str, subject, data: dict) -> go.Figure:
+    """
+    Builds the figure of a job with the figure functions of the dashboard pages.
+    """
+    if kind == "bar_max":
+        return go.Figure(figures.bar_max_figure(data["whodata"], subject))
+    if kind == "trend":
+        country, pollutant = subject
+        df = data["whodata"].df
+        return figures.trend_figure(
+            df[df["country_name"] == country], pollutant, f" in {country}"
+        )
+    if kind == "map":
+        return figures.concentration_map(data["snapshot"], data["geocodes"], subject)
+    raise ValueError(f"Unknown kind of figure {kind}")
+
+
+def render_job(job: tuple, directory: str, formats: tuple) -> dict:
+    """
+    Renders the figure of a job into the figure directory of the report (in a worker process).
+
+    Returns:
+    dict: status ("done" or "failed"), files, error and seconds of the job
+    """
+    job_id, kind, subject = job
+    started = time.perf_counter()
+    try:
+        fig = build_figure(kind, subject, _data)
+        files = []
+        for file_format in formats:
+            name = os.path.join(FIGURE_DIRECTORY, f"{figure_name(job_id)}.{file_format}")
+            with atomic.commit(os.path.join(directory, name)) as temporary_path:
+                if file_format == "html":
+                    fig.write_html(temporary_path, include_plotlyjs=PLOTLY_JS)
+                else:
+                    fig.write_image(temporary_path, format=file_format)
+            files.append(name)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # one failing figure must not stop the others, it is retried with the next run
+        return {
+            "status": "failed",
+            "error": f"{type(e).__name__}: {e}",
+            "seconds": time.perf_counter() - started,
+        }
+    return {"status": "done", "files": files, "seconds": time.perf_counter() - started}
+
+
+def load_manifest(directory: str) -> dict:
+    """
+    Returns the manifest of a report (None if there is none).
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _is_done(directory: str, state: dict) -> bool:
+    return state.get("status") == "done" and all(
+        os.path.exists(os.path.join(directory, name)) for name in state["files"]
+    )
+
+
+def write_index(directory: str, manifest: dict) -> str:
+    """
+    Writes the index.html of the report, with the links to the rendered figures.
+
+    Returns:
+    str: the path of the index
+    """
+    sections = {}
+    for job_id, state in sorted(manifest["jobs"].items()):
+        kind, _separator, subject = job_id.partition("/")
+        links = (
+            " ".join(
+                f'<a href="{html.escape(name)}">{os.path.splitext(name)[1][1:]}</a>'
+                for name in state["files"]
+            )
+            if state["status"] == "done"
+            else f"failed: {html.escape(state.get('error', ''))}"
+        )
+        sections.setdefault(kind, []).append(
+            f"<tr><td>{html.escape(subject)}</td><td>{links}</td></tr>"
+        )
+    titles = {"bar_max": "Max values", "trend": "Yearly trends", "map": "Local sites"}
+    body = "".join(
+        f"<h2>{titles.get(kind, kind)}</h2><table>{''.join(rows)}</table>"
+        for kind, rows in sections.items()
+    )
+    path = os.path.join(directory, "index.html")
+    with atomic.commit(path) as temporary_path:
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(
+                "<html><head><title>Air quality report</title></head><body>"
+                f"<h1>Air quality report</h1><p>Data version {html.escape(manifest['version'])}"
+                f"</p>{body}</body></html>"
+            )
+    return path
+
+
+def render_reports(
+    whodata,
+    snapshot,
+    geocodes,
+    directory: str = REPORT_DIRECTORY,
+    countries: list = None,
+    formats: tuple = ("html",),
+    workers: int = None,
+) -> dict:
+    """
+    Renders the figures of the report which are not done yet in a process pool, prints the
+    progress and writes the manifest after every job, so that the next run resumes from there.
+
+    Args:
+    whodata (WHOData): the WHO data
+    snapshot (pd.DataFrame): the snapshot of the local data shown on the maps
+    geocodes (pd.DataFrame): Location, Latitude and Longitude of the local sites
+    directory (str): the directory of the report
+    countries (list): the countries of the report (None for all)
+    formats (tuple): "html" and / or "png" (png needs kaleido)
+    workers (int): number of worker processes (None for the number of cores)
+
+    Returns:
+    dict: the manifest of the report, with the state of each job
+    """
+    version = f"{whodata.version}:{snapshot['timestamp'].max()}"
+    if countries is None:
+        countries = sorted(whodata.df["country_name"].dropna().astype(str).unique())
+    manifest = load_manifest(directory)
+    if manifest is None or manifest["version"] != version or manifest["formats"] != list(formats):
+        manifest = {"version": version, "formats": list(formats), "runs": 0, "jobs": {}}
+    manifest["runs"] += 1
+    os.makedirs(os.path.join(directory, FIGURE_DIRECTORY), exist_ok=True)
+    if "html" in formats:
+        with open(
+            os.path.join(directory, FIGURE_DIRECTORY, PLOTLY_JS), "w", encoding="utf-8"
+        ) as file:
+            file.write(get_plotlyjs())
+
+    jobs = [
+        job
+        for job in report_jobs(countries)
+        if not _is_done(directory, manifest["jobs"].get(job[0], {}))
+    ]
+    print(f"{len(jobs)} figures to render, {len(report_jobs(countries)) - len(jobs)} done")
+    started = time.perf_counter()
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(whodata.df, snapshot, geocodes),
+    ) as executor:
+        futures = {
+            executor.submit(render_job, job, directory, formats): job[0] for job in jobs
+        }
+        try:
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                job_id = futures[future]
+                state = {**future.result(), "run": manifest["runs"]}
+                manifest["jobs"][job_id] = state
+                atomic.write_json(manifest, manifest_path)
+                elapsed = time.perf_counter() - started
+                print(
+                    f"[{done}/{len(jobs)}] {job_id}: {state['status']} "
+                    f"({state['seconds']:.2f} s, {elapsed / done * (len(jobs) - done):.0f} s left)"
+                )
+        except concurrent.futures.process.BrokenProcessPool as e:
+            print(f"A worker process died, run the report again to resume: {e}")
+    atomic.write_json(manifest, manifest_path)
+    write_index(directory, manifest)
+    return manifest
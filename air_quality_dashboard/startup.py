@@ -0,0 +1,117 @@
+"""
+Module to measure the cold start of the dashboard: the duration of the imports (python -X importtime)
+and of the data-load phases of the pages, which are recorded with phase() while main.py is imported.
+The measurement can be compared with a baseline, to detect regressions of the startup time.
+"""
+
+import contextlib
+import json
+import subprocess
+import sys
+import time
+
+PHASES = {}  # phase -> duration in seconds, filled while the pages are imported
+DEFAULT_TOLERANCE = 0.25  # relative slowdown accepted before a regression is reported
+MIN_REGRESSION = 0.05  # seconds, smaller slowdowns are measurement noise
+OWN_PACKAGES = {"main", "pages", "air_quality_dashboard"}
+
+# imported in a fresh interpreter, main.py imports all pages (use_pages=True)
+_STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import main
+total = time.perf_counter() - start
+from air_quality_dashboard import startup
+print(json.dumps({"total": total, "phases": startup.PHASES}))
+"""
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    """
+    Records the duration of a startup phase (e.g. loading the data of a page).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASES[name] = time.perf_counter() - start
+
+
+def parse_importtime(output: str) -> dict:
+    """
+    Parses the output of python -X importtime and returns the libraries imported by the
+    dashboard itself (main.py, the pages and this package), with their cumulative import time.
+
+    Returns:
+    dict: library module -> cumulative import time in seconds
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _self_time, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1e6))
+
+    # the imports of a module are printed before the module itself
+    imports, parents = {}, {}
+    for depth, name, cumulative in reversed(entries):
+        parents[depth] = name
+        parent = parents.get(depth - 1) if depth > 0 else None
+        if name.split(".")[0] in OWN_PACKAGES:
+            continue
+        if parent is not None and parent.split(".")[0] in OWN_PACKAGES:
+            imports[name] = imports.get(name, 0) + cumulative
+    return imports
+
+
+def measure_startup(python: str = sys.executable, cwd: str = None) -> dict:
+    """
+    Imports main.py in a fresh interpreter and measures the startup.
+
+    Returns:
+    dict: "total" startup time and "imports" time of the libraries in seconds,
+    the data-load "phases" and the "top_imports" (the ten slowest libraries)
+    """
+    completed = subprocess.run(
+        [python, "-X", "importtime", "-c", _STARTUP_SCRIPT],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"The dashboard could not be started:\n{completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    imports = parse_importtime(completed.stderr)
+    result["imports"] = sum(imports.values())
+    result["top_imports"] = sorted(imports.items(), key=lambda item: -item[1])[:10]
+    return result
+
+
+def find_regressions(
+    result: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE
+) -> list:
+    """
+    Compares a measurement with a baseline measurement.
+
+    Returns:
+    list: description of the values (total, imports, phases) slower than the baseline
+    by more than the tolerance (and MIN_REGRESSION)
+    """
+    current = {"total": result["total"], "imports": result["imports"], **result["phases"]}
+    reference = {
+        "total": baseline["total"],
+        "imports": baseline["imports"],
+        **baseline["phases"],
+    }
+    return [
+        f"{name}: {current[name]:.3f} s (baseline {reference[name]:.3f} s)"
+        for name in current
+        if name in reference
+        and current[name] > reference[name] * (1 + tolerance)
+        and current[name] - reference[name] > MIN_REGRESSION
+    ]
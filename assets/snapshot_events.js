@@ -0,0 +1,15 @@
+// Listens to the server-sent events of new snapshots of the local data and hands them to
+// the dash callbacks (Input("snapshot-event", "data")), which fetch only what changed.
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+    var source = new EventSource("/events/snapshots");
+    source.addEventListener("snapshot", function (event) {
+        if (window.dash_clientside && window.dash_clientside.set_props) {
+            window.dash_clientside.set_props("snapshot-event", {
+                data: JSON.parse(event.data),
+            });
+        }
+    });
+})();
@@ -0,0 +1,54 @@
+"""
+Local http server serving the files of data_for_unit_testing, so that the data sources can be
+tested without network. Files requested below /slow/ are served with a delay, to test timeouts.
+"""
+
+import functools
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SLOW_DELAY = 2  # seconds
+
+
+class FixtureRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the fixture files, with a delay for the paths below /slow/.
+    """
+
+    def do_GET(self):
+        if self.path.startswith("/slow/"):
+            time.sleep(SLOW_DELAY)
+            self.path = self.path[len("/slow") :]
+        super().do_GET()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass  # keep the output of the unit tests clean
+
+
+class FixtureServer:
+    """
+    Context manager running the fixture server in a background thread on a free port.
+    """
+
+    def __init__(self, directory: str = FIXTURE_DIRECTORY) -> None:
+        handler = functools.partial(FixtureRequestHandler, directory=directory)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        """
+        Returns the URL of a fixture file, e.g. url("nabel_snapshot.html")
+        """
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,5 +1,15 @@
 import dash
 from dash import Dash, html, dcc
+from air_quality_dashboard.dashboard import (
+    api,
+    compression,
+    datasets,
+    events,
+    export,
+    memory,
+    profiling,
+)
+from air_quality_dashboard.data_parser import local_data
 
 app = Dash(
     __name__,
@@ -7,6 +17,23 @@ app = Dash(
     suppress_callback_exceptions=True,
     use_pages=True,
 )
+# compress the responses first, then check the payload budget (on the uncompressed size)
+compression.enable_compression(app.server)
+compression.enable_payload_budget(app.server)
+# opt-in profiling of single requests (X-Profile: 1 or ?profile=1), listed on /admin/profiles
+profiling.enable_profiling(app.server, app.callback_map)
+# bytes of the datasets and caches, tracemalloc snapshots on /admin/memory
+app.server.register_blueprint(memory.blueprint)
+# streaming export of the filtered data tables, next to the dash app
+app.server.register_blueprint(export.blueprint)
+# JSON API, e.g. /api/exceedances/Switzerland
+app.server.register_blueprint(api.blueprint)
+# new snapshots of the local data are pushed to the webbrowsers via /events/snapshots
+app.server.register_blueprint(events.blueprint)
+events.register_local_data(local_data.shared_local_data())
+# the WHO data of a new build is swapped in without restart, versions listed on /admin/datasets
+app.server.register_blueprint(datasets.blueprint)
+datasets.who_data_handle().start_reloading()
 
 
 def main():
@@ -26,6 +53,8 @@ def main():
                 ]
             ),
             dash.page_container,
+            # last snapshot event, set by assets/snapshot_events.js (EventSource)
+            dcc.Store(id="snapshot-event"),
         ]
     )
 
@@ -0,0 +1,129 @@
+"""
+Dash page comparing the local data (NABEL) with the WHO data: the local sites are matched with the
+nearest WHO city, and the yearly means of the local sites are shown next to the yearly values of
+the WHO data (both in µg/m³).
+"""
+
+import dash
+from dash import html, dash_table, Input, Output, callback, dcc
+import plotly
+import plotly.graph_objects as go
+from air_quality_dashboard import startup
+from air_quality_dashboard.dashboard import datasets
+from air_quality_dashboard.data_parser import comparison, local_data
+
+dash.register_page(__name__, path="/comparison", name="WHO and local data")
+plotly.io.templates.default = "plotly_white"
+
+with startup.phase("comparison: load data"):
+    who = datasets.who_data_handle()  # the current version is taken per callback
+    localdata = local_data.shared_local_data()  # updated in the background
+
+
+def site_comparison(dataset):
+    """
+    Returns the comparison of the local data with a version of the WHO data. The sites are
+    matched by the build of the version (python -m air_quality_dashboard build), otherwise here,
+    the yearly means of the local data follow the new snapshots.
+    """
+    return comparison.Comparison(
+        dataset.data,
+        localdata,
+        local_data.site_geocodes(localdata),
+        dataset.artifact(f"site_matches_{localdata.data_source_name}"),
+    )
+
+
+who.derive("comparison", site_comparison)
+with startup.phase("comparison: match sites"):
+    who.current().derived("comparison")
+
+dropdown_style_concentration = {"width": "200px"}
+
+
+def layout(**kwargs):
+    """
+    Layout of the page, with the matches of the current version of the WHO data.
+    """
+    matches = who.current().derived("comparison").matches
+    return html.Div(
+        [
+            html.H1("WHO and local data"),
+            html.P(
+                f"The sites of the local data are compared with the nearest WHO city within \
+                    {comparison.MATCH_RADIUS_KM} km, the local data is averaged per year."
+            ),
+            html.Div(
+                [
+                    html.H5("Concentration"),
+                    dcc.Dropdown(
+                        id="comparison-concentration",
+                        options=[
+                            {"label": local_column, "value": who_column}
+                            for who_column, local_column in comparison.POLLUTANTS.items()
+                        ],
+                        value="pm10_concentration",
+                        style=dropdown_style_concentration,
+                        clearable=False,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            dcc.Graph(id="comparison-graph"),
+            html.H2("Matched sites"),
+            dash_table.DataTable(
+                id="comparison-matches",
+                columns=[
+                    {"name": "Site", "id": "Location"},
+                    {"name": "WHO city", "id": "city"},
+                    {"name": "Distance [km]", "id": "distance_km"},
+                ],
+                data=matches.round({"distance_km": 1}).to_dict("records"),
+            ),
+        ]
+    )
+
+
+@callback(
+    Output(component_id="comparison-graph", component_property="figure"),
+    Input(component_id="comparison-concentration", component_property="value"),
+    Input(component_id="snapshot-event", component_property="data"),
+)
+def comparison_graph(concentration, snapshot_event):
+    """
+    Shows the yearly values of the WHO cities (lines) and of the matched local sites (markers),
+    a new snapshot updates the yearly mean of the current year.
+    """
+    df = who.current().derived("comparison").table(concentration)
+    fig = go.Figure()
+    for (city, site), pair in df.groupby(["city", "Location"], sort=False):
+        color = plotly.colors.qualitative.Plotly[
+            len(fig.data) // 2 % len(plotly.colors.qualitative.Plotly)
+        ]
+        fig.add_trace(
+            go.Scatter(
+                x=pair["year"],
+                y=pair["WHO"],
+                mode="lines+markers",
+                line={"color": color},
+                name=f"{city} (WHO)",
+                legendgroup=site,
+            )
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=pair["year"],
+                y=pair["local"],
+                mode="markers",
+                marker={"color": color, "symbol": "diamond", "size": 10},
+                name=f"{site} ({localdata.data_source_name})",
+                legendgroup=site,
+            )
+        )
+    fig.update_layout(
+        title=f"Yearly {comparison.POLLUTANTS[concentration]} concentration",
+        xaxis_title="Year",
+        yaxis_title="Concentration [ug/m<sup>3</sup>]",
+        height=700,
+    )
+    return fig
@@ -4,96 +4,164 @@ Further, some small statistics regarding the dataset are shown.
 """
 
 import dash
-from dash import html, dash_table, Input, Output, callback
-from air_quality_dashboard.dashboard import helper_functions
-from air_quality_dashboard.data_parser import who_data
+from dash import html, dash_table, dcc, Input, Output, State, callback, clientside_callback
+from air_quality_dashboard import startup
+from air_quality_dashboard.dashboard import (
+    datasets,
+    export,
+    helper_functions,
+    result_store,
+    text_index,
+)
 from air_quality_dashboard.data_parser import local_data
 
 dash.register_page(__name__, path="/", name="Home")
 
 
 ITEMS_PER_PAGE = 10  # set the number of elements per page
-whodata = who_data.WHOData()
-localdata = local_data.LocalData()
-
-layout = html.Div(
-    [
-        html.H1("Air Quality Dashboard"),
-        html.P(
-            "This dashboard shows air quality data from the WHO, as well as the \
-                NABEL database from Switzerland."
-        ),
-        html.H2("General Data"),
-        html.H3("WHO Data"),
-        html.P(
-            f"Data from the following year is available: :  \
-                    {whodata.years[0]} - {whodata.years[-1]}"
-        ),
-        html.P(f"N° countries: {whodata.n_countries}"),
-        html.H4("Data Table"),
-        html.P(
-            "This table shows the WHO data. Please use the =, >, <, >=, <=, != operators for filtering when using numbers.  \
-                    For the Country and type of station column the '=' operator has to be put in front of the word ('=Switzerland')"
-        ),
-        dash_table.DataTable(  # initalize the dash data table
-            id="who_data",
-            columns=[
-                {"id": "country_name", "name": "Country", "type": "text"},
-                {"id": "year_int", "name": "Year"},
-                {"id": "city", "name": "City"},
-                {"id": "pm10_concentration", "name": "PM10"},
-                {"id": "pm10_tempcov", "name": "PM10 Coverage"},
-                {"id": "pm25_concentration", "name": "PM25"},
-                {"id": "pm25_tempcov", "name": "PM25 Coverage"},
-                {"id": "no2_concentration", "name": "NO2"},
-                {"id": "no2_coverage", "name": "NO2 Coverage"},
-                {
-                    "id": "type_of_stations",
-                    "name": "Type of Station",
-                    "type": "text",
-                },
-            ],
-            page_current=0,
-            page_size=ITEMS_PER_PAGE,  # set the number of elements per page
-            page_action="custom",
-            filter_action="custom",
-            filter_query="",
-            sort_action="custom",
-            sort_mode="multi",
-            sort_by=[],
-        ),
-        html.H3("Switzerland Data"),
-        html.P(f"First data entry from: {localdata.min_date()}"),
-        html.P(f"Data last updated: {localdata.max_date()}"),
-        html.H4("Data Table"),
-        html.P(
-            "This table shows the local data from Switzerland.  \
-                    Please use the =, >, <, >=, <=, != operators for filtering when using numbers.  \
-                        The Type of site, and the Location column can be filtered directly. "
-        ),
-        dash_table.DataTable(  # initalize the dash data table
-            id="local_data_switzerland",
-            columns=[
-                {
-                    "name": i,
-                    "id": i,
-                    "deletable": True,
-                }  # use all columns from the local data (Switzerland)
-                for i in localdata.df.columns  # use all columns from the local data (Switzerland)
-            ],
-            page_current=0,
-            page_size=ITEMS_PER_PAGE,  # set the number of elements per page
-            page_action="custom",
-            filter_action="custom",
-            filter_query="",
-            sort_action="custom",
-            sort_mode="multi",
-            sort_by=[],
-        ),
-    ]
+# the WHO data is taken from its handle once per callback or page load, see datasets
+with startup.phase("home: load WHO data"):
+    who = datasets.who_data_handle()
+    who.current()
+with startup.phase("home: load local data"):
+    localdata = local_data.shared_local_data()  # updated in the background
+
+# columns on which the "contains" operator of the table filter is applied
+WHO_TEXT_COLUMNS = ["country_name", "city", "type_of_stations"]
+LOCAL_TEXT_COLUMNS = ["Type of site", "Location"]
+# substring index over the distinct values of the text columns, per version of the WHO data
+who.derive(
+    "WHO text indexes",
+    lambda dataset: text_index.build_text_indexes(dataset.data.df, WHO_TEXT_COLUMNS),
+)
+with startup.phase("home: text indexes"):
+    who.current().derived("WHO text indexes")
+
+# row positions of the filtered and sorted WHO table per session and query, shared by the workers
+who_results = result_store.ResultStore()
+
+
+def who_table():
+    """
+    Returns the WHO data and its text indexes, of the same version.
+    """
+    dataset = who.current()
+    return dataset.data.df, dataset.derived("WHO text indexes")
+
+
+# the filtered tables can be exported via /export/<table id> (see export_link below)
+export.register_table("who_data", who_table, WHO_TEXT_COLUMNS)
+export.register_table(
+    "local_data_switzerland", lambda: (localdata.df, {}), LOCAL_TEXT_COLUMNS
 )
 
 
+def export_links(table_id):
+    """
+    Links to download the filtered and sorted data of a table, the href of the links
+    is updated in the webbrowser when the filter or sorting changes.
+    """
+    return html.P(
+        ["Download filtered data: "]
+        + [
+            html.A(
+                export_format.upper(),
+                id=f"{table_id}-export-{export_format}",
+                href=f"/export/{table_id}?format={export_format}",
+                style={"margin-right": "10px"},
+            )
+            for export_format in export.EXPORT_FORMATS
+        ]
+    )
+
+
+def layout(**kwargs):
+    """
+    Layout of the page, with the statistics of the current version of the WHO data.
+    """
+    whodata = who.current().data
+    return html.Div(
+        [
+            html.H1("Air Quality Dashboard"),
+            dcc.Store(id="session-id", storage_type="session"),
+            html.P(
+                "This dashboard shows air quality data from the WHO, as well as the \
+                    NABEL database from Switzerland."
+            ),
+            html.H2("General Data"),
+            html.H3("WHO Data"),
+            html.P(
+                f"Data from the following year is available: :  \
+                        {whodata.years[0]} - {whodata.years[-1]}"
+            ),
+            html.P(f"N° countries: {whodata.n_countries}"),
+            html.H4("Data Table"),
+            html.P(
+                "This table shows the WHO data. Please use the =, >, <, >=, <=, != operators for filtering when using numbers.  \
+                        The Country, City and Type of Station columns can be filtered directly (e.g. 'bern'),  \
+                            use the '=' operator for an exact match ('=Switzerland')"
+            ),
+            dash_table.DataTable(  # initalize the dash data table
+                id="who_data",
+                columns=[
+                    {"id": "country_name", "name": "Country", "type": "text"},
+                    {"id": "year_int", "name": "Year"},
+                    {"id": "city", "name": "City", "type": "text"},
+                    {"id": "pm10_concentration", "name": "PM10"},
+                    {"id": "pm10_tempcov", "name": "PM10 Coverage"},
+                    {"id": "pm25_concentration", "name": "PM25"},
+                    {"id": "pm25_tempcov", "name": "PM25 Coverage"},
+                    {"id": "no2_concentration", "name": "NO2"},
+                    {"id": "no2_coverage", "name": "NO2 Coverage"},
+                    {
+                        "id": "type_of_stations",
+                        "name": "Type of Station",
+                        "type": "text",
+                    },
+                ],
+                page_current=0,
+                page_size=ITEMS_PER_PAGE,  # set the number of elements per page
+                page_action="custom",
+                filter_action="custom",
+                filter_query="",
+                sort_action="custom",
+                sort_mode="multi",
+                sort_by=[],
+            ),
+            export_links("who_data"),
+            html.H3("Switzerland Data"),
+            html.P(f"First data entry from: {localdata.min_date()}"),
+            html.P(f"Data last updated: {localdata.max_date()}", id="local-last-updated"),
+            html.H4("Data Table"),
+            html.P(
+                "This table shows the local data from Switzerland.  \
+                        Please use the =, >, <, >=, <=, != operators for filtering when using numbers.  \
+                            The Type of site, and the Location column can be filtered directly. "
+            ),
+            dash_table.DataTable(  # initalize the dash data table
+                id="local_data_switzerland",
+                columns=[
+                    {
+                        "name": i,
+                        "id": i,
+                        "deletable": True,
+                    }  # use all columns from the local data (Switzerland)
+                    for i in localdata.df.columns  # use all columns from the local data (Switzerland)
+                ],
+                page_current=0,
+                page_size=ITEMS_PER_PAGE,  # set the number of elements per page
+                page_action="custom",
+                filter_action="custom",
+                filter_query="",
+                sort_action="custom",
+                sort_mode="multi",
+                sort_by=[],
+            ),
+            export_links("local_data_switzerland"),
+        ]
+    )
+
+
 # Callback function to update the table based on sorting and filtering criteria, hence we have a data table
 # that is updated based on backend operations.
 # here we have the callback function for the local data
@@ -103,36 +171,19 @@ layout = html.Div(
     Input("local_data_switzerland", "page_size"),
     Input("local_data_switzerland", "sort_by"),
     Input("local_data_switzerland", "filter_query"),
+    Input("snapshot-event", "data"),  # a new snapshot was committed
 )
 def update_table_switzerland(
     page_current,
     page_size,
     sort_by,
     filter,
+    snapshot_event,
 ):
-    # Split the filter query into individual filtering expressions
-    filtering_expressions = filter.split(" && ")
-    dff = localdata.df
-    # Apply each filtering expression to the DataFrame
-    for filter_part in filtering_expressions:
-        col_name, operator, filter_value = helper_functions.split_filter_part(
-            filter_part
-        )  # split the filter part
-        if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
-            # Apply comparison operators to filter the DataFrame
-            dff = dff.loc[getattr(dff[col_name], operator)(filter_value)]
-        elif operator == "contains":
-            if col_name in [
-                "Type of site",
-                "Location",
-            ]:  # Workaround to avoid error when filtering on non-string columns. Not nice, should be fixed in the future.
-                dff = dff.loc[dff[col_name].str.contains(filter_value, case=False)]
-    if len(sort_by):  # Code to sort the data based on the chosen column
-        dff = dff.sort_values(
-            [col["column_id"] for col in sort_by],
-            ascending=[col["direction"] == "asc" for col in sort_by],
-            inplace=False,
-        )
+    dff = helper_functions.filter_dataframe(
+        localdata.df, filter, LOCAL_TEXT_COLUMNS
+    )
+    dff = helper_functions.sort_dataframe(dff, sort_by)
 
     page = page_current
     size = page_size
@@ -141,43 +192,68 @@ def update_table_switzerland(
     )  # only hand the data of the current page to the webbrowser frontend
 
 
-# same function as above, but for the WHO data
+@callback(
+    Output("local-last-updated", "children"),
+    Input("snapshot-event", "data"),
+    prevent_initial_call=True,
+)
+def update_last_updated(snapshot_event):
+    return f"Data last updated: {localdata.max_date()}"
+
+
+# same function as above, but for the WHO data, the row positions of the filtered and sorted
+# data are stored per session and query, so that paging only slices them
 @callback(
     Output("who_data", "data"),
     Input("who_data", "page_current"),
     Input("who_data", "page_size"),
     Input("who_data", "sort_by"),
     Input("who_data", "filter_query"),
+    State("session-id", "data"),
 )
-def update_table_whodata(page_current, page_size, sort_by, filter):
-    # Split the filter query into individual filtering expressions
-    filtering_expressions = filter.split(" && ")
-    dff = whodata.df
-    # dff["year"] = dff["year"].strftime("%Y")
-    # Apply each filtering expression to the DataFrame
-    for filter_part in filtering_expressions:
-        col_name, operator, filter_value = helper_functions.split_filter_part(
-            filter_part
-        )  # split the filter part
-
-        if operator == "contains":
-            if col_name in ["Country", "Type of Station"]:
-                # Workaround to avoid error when filtering on non-string columns. Not nice, should be fixed in the future.
-                dff = dff.loc[dff[col_name].str.contains(filter_value, case=False)]
-
-        elif operator in ("eq", "ne", "lt", "le", "gt", "ge"):
-            # Apply comparison operators to filter the DataFrame
-            dff = dff.loc[getattr(dff[col_name], operator)(filter_value)]
-
-    if len(sort_by):  # Code to sort the data based on the chosen column
-        dff = dff.sort_values(
-            [col["column_id"] for col in sort_by],
-            ascending=[col["direction"] == "asc" for col in sort_by],
-            inplace=False,
+def update_table_whodata(page_current, page_size, sort_by, filter, session_id):
+    dataset = who.current()  # the positions are only valid on this version
+    df = dataset.data.df
+    who_text_indexes = dataset.derived("WHO text indexes")
+    key = result_store.query_key(session_id, "who_data", str(dataset), filter, sort_by)
+    positions = who_results.get(key)
+    if positions is None:
+        positions = helper_functions.query_positions(
+            df, filter, sort_by, WHO_TEXT_COLUMNS, who_text_indexes
         )
+        who_results.put(key, positions)
 
     page = page_current
     size = page_size
-    return dff.iloc[page * size : (page + 1) * size].to_dict(
+    return df.iloc[positions[page * size : (page + 1) * size]].to_dict(
         "records"
     )  # only hand the data of the current page to the webbrowser frontend
+
+
+# random id of the browser session (kept in the session storage of the webbrowser)
+clientside_callback(
+    """
+    function(session_id) {
+        return session_id || (Date.now().toString(36) + Math.random().toString(36).slice(2));
+    }
+    """,
+    Output("session-id", "data"),
+    Input("session-id", "data"),
+)
+
+
+# update the export links of both tables with the current filter and sorting (client side)
+for table_id in ["who_data", "local_data_switzerland"]:
+    for export_format in export.EXPORT_FORMATS:
+        clientside_callback(
+            f"""
+            function(filter_query, sort_by) {{
+                return "/export/{table_id}?format={export_format}"
+                    + "&filter_query=" + encodeURIComponent(filter_query || "")
+                    + "&sort_by=" + encodeURIComponent(JSON.stringify(sort_by || []));
+            }}
+            """,
+            Output(f"{table_id}-export-{export_format}", "href"),
+            Input(table_id, "filter_query"),
+            Input(table_id, "sort_by"),
+        )
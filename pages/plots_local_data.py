@@ -1,13 +1,13 @@
 import dash
-from dash import html, Input, Output, callback, dcc
+from dash import html, dash_table, Input, Output, Patch, callback, dcc
 import copy
 import pandas as pd
 import numpy as np
 import plotly
-import plotly.express as px
 import plotly.graph_objects as go
+from air_quality_dashboard import startup
+from air_quality_dashboard.dashboard import api, figures, memory
 from air_quality_dashboard.data_parser import local_data
-from geopy.geocoders import Nominatim
 
 
 dash.register_page(__name__, path="/localdata", name="Plots Local data")
@@ -15,84 +15,129 @@ plotly.io.templates.default = "plotly_white"
 
 ITEMS_PER_PAGE = 10  # set the number of elements per page
 
-localdata = local_data.LocalData()
-
-df = localdata.df
-
-filtered_location = df.drop_duplicates(subset="Location").sort_values(by="Location")
-
-geolocator = Nominatim(user_agent="my_geocoder")
-
-geocoded_data = []
-
-for location in filtered_location["Location"]:
-    location_info = geolocator.geocode(location + ", Switzerland")
-    if location_info:
-        geocoded_data.append(
-            {
-                "Location": location,
-                "Latitude": location_info.latitude,
-                "Longitude": location_info.longitude,
-            }
-        )
-
-geocoded_df = pd.DataFrame(geocoded_data)
-
+with startup.phase("local page: load local data"):
+    localdata = local_data.shared_local_data()  # updated in the background
+api.register_local_data(localdata)  # exceedances available via /api/exceedances/Switzerland
+memory.register_dataset(
+    f"local data {localdata.data_source_name}", localdata.memory_usage
+)
 
-df["date"] = df["timestamp"].dt.date
-filter_date = df.drop_duplicates(subset="date").sort_values(by="date")
+# the geocodes are taken from the build artifacts (python -m air_quality_dashboard build),
+# only sites missing there are geocoded at runtime
+with startup.phase("local page: geocoding"):
+    geocoded_df = local_data.site_geocodes(localdata)
 
 
 dropdown_style_date = {"width": "400px"}
 dropdown_style_concentration = {"width": "200px"}
 
-layout = html.Div(
-    [
-        html.H1("Local Data Statistics"),
-        html.H2("See concentrations in function of the date in Switzerland"),
-        html.Div(
-            [
-                html.H5("Date"),
-                dcc.Dropdown(
-                    id="date",
-                    options=[
-                        {"label": date.strftime("%Y-%m-%d"), "value": date}
-                        for date in filter_date["timestamp"]
-                    ],
-                    value=filter_date["timestamp"].iloc[0],
-                    style=dropdown_style_date,
-                    clearable=False,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        html.Div(
-            [
-                html.H5("Concentration"),
-                dcc.Dropdown(
-                    id="concentration-selector",
-                    options=[
-                        {"label": "O3", "value": "O3"},
-                        {"label": "NO2", "value": "NO2"},
-                        {"label": "PM10", "value": "PM10"},
-                    ],
-                    value="O3",
-                    style=dropdown_style_concentration,
-                    clearable=False,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        html.Div(
-            dcc.Graph(id="switzerland"),
-            style={
-                "display": "flex",
-                "justify-content": "center",
-                "align-items": "center",
-            },
-        ),
-    ]
-)
+
+def exceedances_text(evaluator) -> str:
+    """
+    Returns the text above the table of the exceedances.
+    """
+    if evaluator is None:
+        return "The ambient air quality standard is not available."
+    return f"Sites exceeding the ambient air quality standard on {localdata.max_date()}, \
+        with the number of exceedances within the last {evaluator.window} snapshots."
+
+
+def exceedance_alerts(evaluator) -> pd.DataFrame:
+    """
+    Returns the sites exceeding the ambient air quality standard in the last snapshot.
+    """
+    if evaluator is None:
+        return pd.DataFrame()
+    return evaluator.alerts().drop(columns="timestamp")
+
+
+def table_columns(df: pd.DataFrame) -> list:
+    return [{"name": i, "id": i} for i in df.columns]
+
+
+def layout(**kwargs):
+    """
+    Layout of the page, built on every page load from the data of the last snapshot,
+    the dates (including the snapshots evicted to the history on disk) and the exceedances.
+    """
+    locations = sorted(localdata.df["Location"].unique())
+    # first snapshot of each date, including the snapshots evicted to the history on disk
+    timestamps = pd.Series(sorted(localdata.statistics.distinct["timestamp"]))
+    filter_date = timestamps.groupby(timestamps.dt.date).min()
+    evaluator = localdata.exceedances
+    alerts = exceedance_alerts(evaluator)
+    return html.Div(
+        [
+            html.H1("Local Data Statistics"),
+            html.H2("See concentrations in function of the date in Switzerland"),
+            html.Div(
+                [
+                    html.H5("Date"),
+                    dcc.Dropdown(
+                        id="date",
+                        options=[
+                            {"label": date.strftime("%Y-%m-%d"), "value": date}
+                            for date in filter_date
+                        ],
+                        value=filter_date.iloc[0],
+                        style=dropdown_style_date,
+                        clearable=False,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            html.Div(
+                [
+                    html.H5("Concentration"),
+                    dcc.Dropdown(
+                        id="concentration-selector",
+                        options=[
+                            {"label": "O3", "value": "O3"},
+                            {"label": "NO2", "value": "NO2"},
+                            {"label": "PM10", "value": "PM10"},
+                        ],
+                        value="O3",
+                        style=dropdown_style_concentration,
+                        clearable=False,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            html.Div(
+                dcc.Graph(id="switzerland"),
+                style={
+                    "display": "flex",
+                    "justify-content": "center",
+                    "align-items": "center",
+                },
+            ),
+            html.H2("Forecast of the next 24 hours"),
+            html.Div(
+                [
+                    html.H5("Site"),
+                    dcc.Dropdown(
+                        id="forecast-site",
+                        options=[
+                            {"label": location, "value": location}
+                            for location in locations
+                        ],
+                        value=locations[0],
+                        style=dropdown_style_date,
+                        clearable=False,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            dcc.Graph(id="forecast"),
+            html.H2("Exceedances of the ambient air quality standard"),
+            html.P(id="exceedances-text", children=exceedances_text(evaluator)),
+            dash_table.DataTable(
+                id="exceedances",
+                columns=table_columns(alerts),
+                data=alerts.to_dict("records"),
+            ),
+        ]
+    )
 
 
 @callback(
@@ -101,27 +146,85 @@ layout = html.Div(
     Input(component_id="concentration-selector", component_property="value"),
 )
 def switzerland_concentrations(date, concentration):
-    dff = df.dropna(subset=[concentration], inplace=True)
-    dff = df[df["timestamp"] == date]
-    dff = dff.groupby(["Location"]).mean(numeric_only=True).reset_index()
-    merged_df = pd.merge(dff, geocoded_df, on="Location")
-
-    fig = px.scatter_mapbox(
-        merged_df,
-        lat="Latitude",
-        lon="Longitude",
-        mapbox_style="open-street-map",
-        size=concentration,
-        color=concentration,
-        center={"lat": 46.8182, "lon": 8.2275},
-        zoom=7,
-        size_max=20,
+    # the snapshot is read from the history on disk, if it is not in memory anymore
+    return figures.concentration_map(
+        localdata.snapshot_on(date), geocoded_df, concentration
     )
 
+
+@callback(
+    Output(component_id="forecast", component_property="figure"),
+    Input(component_id="forecast-site", component_property="value"),
+    Input(component_id="concentration-selector", component_property="value"),
+    Input(component_id="snapshot-event", component_property="data"),
+)
+def site_forecast(site, concentration, snapshot_event):
+    """
+    Shows the last two days and the forecast of the next 24 hours of a site,
+    the forecast is only recalculated when a new snapshot arrived (otherwise it is cached).
+    """
+    df = localdata.df
+    forecast = localdata.forecaster.forecast()
+    forecast = forecast[
+        (forecast["Location"] == site) & (forecast["Pollutant"] == concentration)
+    ]
+    history = df[
+        (df["Location"] == site)
+        & (df["timestamp"] > df["timestamp"].max() - pd.Timedelta(hours=48))
+    ]
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scatter(
+            x=history["timestamp"], y=history[concentration], mode="lines+markers", name="Measured"
+        )
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=forecast["timestamp"],
+            y=forecast["Forecast"],
+            mode="lines",
+            line={"dash": "dash"},
+            name="Forecast",
+        )
+    )
     fig.update_layout(
-        width=1000,
-        height=800,
-        title=f"mean {concentration} concentration on a specific date in Switzerland",
+        title=f"{concentration} concentration at {site}",
+        yaxis_title="Concentration [ug/m<sup>3</sup>]",
     )
-
     return fig
+
+
+@callback(
+    Output(component_id="date", component_property="options"),
+    Input(component_id="snapshot-event", component_property="data"),
+    prevent_initial_call=True,
+)
+def add_snapshot_date(snapshot_event):
+    """
+    Adds the date of a new snapshot to the dropdown, if it is the first snapshot of the date.
+    Only the new option is sent to the webbrowser (Patch), not the whole list.
+    """
+    timestamp = pd.Timestamp(snapshot_event["timestamp"])
+    timestamps = localdata.df["timestamp"]
+    same_date = timestamps[timestamps.dt.date == timestamp.date()]
+    if len(same_date) == 0 or same_date.min() != timestamp:
+        return dash.no_update
+    options = Patch()
+    options.append({"label": timestamp.strftime("%Y-%m-%d"), "value": timestamp})
+    return options
+
+
+@callback(
+    Output(component_id="exceedances", component_property="data"),
+    Output(component_id="exceedances", component_property="columns"),
+    Output(component_id="exceedances-text", component_property="children"),
+    Input(component_id="snapshot-event", component_property="data"),
+    prevent_initial_call=True,
+)
+def update_exceedances(snapshot_event):
+    """
+    Shows the exceedances of the new snapshot (evaluated incrementally on the server).
+    """
+    evaluator = localdata.exceedances
+    alerts = exceedance_alerts(evaluator)
+    return alerts.to_dict("records"), table_columns(alerts), exceedances_text(evaluator)
@@ -2,13 +2,19 @@
 # For the next task also graph would be nice.  Also add a third page with local_data
 
 import dash
-from dash import html, Input, Output, callback, dcc
-import copy
-import pandas as pd
-import numpy as np
+from dash import html, Input, Output, callback, clientside_callback, dcc
+import functools
 import plotly
-import plotly.express as px
 import plotly.graph_objects as go
+from air_quality_dashboard import startup
+from air_quality_dashboard.dashboard import (
+    api,
+    datasets,
+    figures,
+    helper_functions,
+    memory,
+    single_flight,
+)
 from air_quality_dashboard.data_parser import who_data
 
 # register page for navigation selection
@@ -17,174 +23,228 @@ plotly.io.templates.default = "plotly_white"
 
 
 ITEMS_PER_PAGE = 10  # set the number of elements per page
-# init instance whodata class, to have access to stored data
-whodata = who_data.WHOData()
+GLOBE_CACHE_BYTES = 256 * 1024**2  # the traces of the globe contain all animation frames
+# the WHO data is taken from its handle once per callback or page load, hence a new version
+# (e.g. of a new build) is swapped in without restart, see datasets
+with startup.phase("WHO page: load WHO data"):
+    who = datasets.who_data_handle()
+    who.current()
+api.register_who_data(who)  # forecasts available via /api/forecast/who/<country>
 
-# Filter the countries and years for the dropdown menu
-filter_years = whodata.df.drop_duplicates(subset="year").sort_values(by="year")
-filtered_countries = whodata.df.drop_duplicates(subset="country_name").sort_values(
-    by="country_name"
-)
+# concurrent identical computations (e.g. the default figures when many users open the page)
+# are computed once and shared, between the threads and (if small enough) the worker processes
+flights = single_flight.SingleFlight()
 
-# Filter first string of type of stations for easier manipulation
-dff = whodata.df
 
-dff["type_of_stations"] = dff["type_of_stations"].str.replace(",", " ")
-dff["type_of_stations"] = dff["type_of_stations"].str.split().str[0]
-filtered_stations = dff.drop_duplicates(subset="type_of_stations").sort_values(
-    by="type_of_stations"
-)
-filtered_stations["type_of_stations_str"] = filtered_stations["type_of_stations"]
-filtered_stations.dropna(subset=["type_of_stations"], inplace=True)
+def plot_data(dataset):
+    """
+    Returns the WHO data of the plots, with the simplified types of stations for an easier
+    selection (on a shallow copy, the other pages show the original types of stations).
+    """
+    whodata = dataset.data
+    plots = who_data.WHOData.from_dataframe(
+        whodata.df.assign(
+            type_of_stations=who_data.simplify_type_of_stations(whodata.df["type_of_stations"])
+        )
+    )
+    # the indexes of the bar plot and of the centering are built before the version is used
+    plots.year_range_max, plots.country_centers  # pylint: disable=pointless-statement
+    return plots
+
+
+def dropdown_options(dataset):
+    """
+    Returns the options of the dropdown menus and the lookup of the chained dropdowns.
+    """
+    plots = dataset.derived("WHO plots")
+    # Filter the countries and years for the dropdown menu
+    filter_years = plots.df.drop_duplicates(subset="year").sort_values(by="year")
+    filtered_countries = plots.df.drop_duplicates(subset="country_name").sort_values(
+        by="country_name"
+    )
+    filtered_stations = plots.df.drop_duplicates(subset="type_of_stations").sort_values(
+        by="type_of_stations"
+    )
+    filtered_stations = filtered_stations.dropna(subset=["type_of_stations"])
+    return {
+        "years": [
+            {"label": row_year["year_int"], "value": row_year["year"]}
+            for index, row_year in filter_years.iterrows()
+        ],
+        "countries": [
+            {
+                "label": row_country["country_name"],
+                "value": row_country["country_name"],
+            }
+            for index, row_country in filtered_countries.iterrows()
+        ],
+        "stations": [
+            {
+                "label": row_stations["type_of_stations"],
+                "value": row_stations["type_of_stations"],
+            }
+            for index, row_stations in filtered_stations.iterrows()
+        ],
+        # lookup for the chained dropdowns (after the simplification of the type of stations),
+        # from the build of this version
+        "station_country_lookup": (
+            dataset.artifact("station_country_lookup") or plots.station_country_lookup()
+        ),
+    }
+
+
+who.derive("WHO plots", plot_data)
+who.derive("WHO plot options", dropdown_options)
 
 dropdown_style_year = {"width": "200px"}
 dropdown_style_country = {"width": "600px"}
 dropdown_style_station = {"width": "400px"}
 dropdown_style_concentration = {"width": "200px"}
 
-layout = html.Div(
-    [
-        html.H1("WHOdata Statistics"),
-        # Dropdown menus to chose different countries and their corresponding max_value in a certain timespan
-        # Dropdown menus for years
-        html.H2(
-            "See max values in function of the country, timespan and concentration (Task2)"
-        ),
-        html.Div(
-            [
-                html.H5("Year 1"),
-                dcc.Dropdown(
-                    id="year-1",
-                    options=[
-                        {"label": row_year["year_int"], "value": row_year["year"]}
-                        for index, row_year in filter_years.iterrows()
-                    ],
-                    value=filter_years["year"].iloc[0],
-                    style=dropdown_style_year,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        html.Div(
-            [
-                html.H5("Year 2"),
-                dcc.Dropdown(
-                    id="year-2",
-                    options=[
-                        {"label": row_year["year_int"], "value": row_year["year"]}
-                        for index, row_year in filter_years.iterrows()
-                    ],
-                    value=filter_years["year"].iloc[1],
-                    style=dropdown_style_year,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        # Dropdown menu for countrys
-        html.Div(
-            [
-                html.H5("Country"),
-                dcc.Dropdown(
-                    id="countries",
-                    options=[
-                        {
-                            "label": row_country["country_name"],
-                            "value": row_country["country_name"],
-                        }
-                        for index, row_country in filtered_countries.iterrows()
-                    ],
-                    value=["Switzerland", "Spain", "Norway"],
-                    style=dropdown_style_country,
-                    multi=True,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        # Put a Bar Plot for the max values
-        dcc.Graph(id="bar-max"),
-        # Begin layout for the globe representation
-        html.H2("See a representation of different concentrations in the world."),
-        # Put maybe a small explanation about the simulation
-        html.Div(
-            [
-                html.H5("Concentration"),
-                dcc.Dropdown(
-                    id="concentration-selector",
-                    options=[
-                        {"label": "PM10", "value": "pm10_concentration"},
-                        {"label": "PM25", "value": "pm25_concentration"},
-                        {"label": "NO2", "value": "no2_concentration"},
-                    ],
-                    value="pm10_concentration",
-                    style=dropdown_style_concentration,
-                    clearable=False,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        # Dropdown menu for type of stations
-        html.Div(
-            [
-                html.H5("Type of station"),
-                dcc.Dropdown(
-                    id="station",
-                    options=[
-                        {
-                            "label": row_stations["type_of_stations_str"],
-                            "value": row_stations["type_of_stations_str"],
-                        }
-                        for index, row_stations in filtered_stations.iterrows()
-                    ],
-                    value=None,
-                    style=dropdown_style_station,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        # Dropdown menu for the country to zoom in.
-        html.Div(
-            [
-                html.H5("Country to center"),
-                dcc.Dropdown(
-                    id="country",
-                    options=[
-                        {
-                            "label": row_country["country_name"],
-                            "value": row_country["country_name"],
-                        }
-                        for index, row_country in filtered_countries.iterrows()
-                    ],
-                    value=None,
-                    style=dropdown_style_country,
-                ),
-            ],
-            style={"display": "inline-block"},
-        ),
-        html.Div(
-            dcc.Graph(id="globe"),
-            style={
-                "display": "flex",
-                "justify-content": "center",
-                "align-items": "center",
-            },
-        ),
-        # Begin of Layout for Boxplot and points over year
-        html.H2(
-            "See mean concentration of all countries over the years (just for fun)"
-        ),
-        # Selection with dropdown menu for different concentrations for graph plotting
-        dcc.Dropdown(
-            id="graph-selector",
-            options=[
-                {"label": "PM10", "value": "pm10_concentration"},
-                {"label": "PM25", "value": "pm25_concentration"},
-                {"label": "NO2", "value": "no2_concentration"},
-            ],
-            value="pm10_concentration",
-        ),
-        dcc.Graph(id="graph"),
-    ]
-)
+
+def layout(**kwargs):
+    """
+    Layout of the page, with the dropdown options of the current version of the WHO data.
+    """
+    options = who.current().derived("WHO plot options")
+    return html.Div(
+        [
+            html.H1("WHOdata Statistics"),
+            # Dropdown menus to chose different countries and their corresponding max_value in a certain timespan
+            # Dropdown menus for years
+            html.H2(
+                "See max values in function of the country, timespan and concentration (Task2)"
+            ),
+            html.Div(
+                [
+                    html.H5("Year 1"),
+                    dcc.Dropdown(
+                        id="year-1",
+                        options=options["years"],
+                        value=options["years"][0]["value"],
+                        style=dropdown_style_year,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            html.Div(
+                [
+                    html.H5("Year 2"),
+                    dcc.Dropdown(
+                        id="year-2",
+                        options=options["years"],
+                        value=options["years"][1]["value"],
+                        style=dropdown_style_year,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            # Dropdown menu for countrys
+            html.Div(
+                [
+                    html.H5("Country"),
+                    dcc.Dropdown(
+                        id="countries",
+                        options=options["countries"],
+                        value=["Switzerland", "Spain", "Norway"],
+                        style=dropdown_style_country,
+                        multi=True,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            # Put a Bar Plot for the max values
+            dcc.Graph(id="bar-max"),
+            # Begin layout for the globe representation
+            html.H2("See a representation of different concentrations in the world."),
+            # Put maybe a small explanation about the simulation
+            html.Div(
+                [
+                    html.H5("Concentration"),
+                    dcc.Dropdown(
+                        id="concentration-selector",
+                        options=[
+                            {"label": "PM10", "value": "pm10_concentration"},
+                            {"label": "PM25", "value": "pm25_concentration"},
+                            {"label": "NO2", "value": "no2_concentration"},
+                        ],
+                        value="pm10_concentration",
+                        style=dropdown_style_concentration,
+                        clearable=False,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            # Dropdown menu for type of stations
+            html.Div(
+                [
+                    html.H5("Type of station"),
+                    dcc.Dropdown(
+                        id="station",
+                        options=options["stations"],
+                        value=None,
+                        style=dropdown_style_station,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            # Dropdown menu for the country to zoom in.
+            html.Div(
+                [
+                    html.H5("Country to center"),
+                    dcc.Dropdown(
+                        id="country",
+                        options=options["countries"],
+                        value=None,
+                        style=dropdown_style_country,
+                    ),
+                ],
+                style={"display": "inline-block"},
+            ),
+            dcc.Store(
+                id="station-country-lookup", data=options["station_country_lookup"]
+            ),
+            html.Div(
+                dcc.Graph(id="globe"),
+                style={
+                    "display": "flex",
+                    "justify-content": "center",
+                    "align-items": "center",
+                },
+            ),
+            # Nearest stations to the position of the user (position from the webbrowser)
+            html.H2("Find the stations nearest to you"),
+            html.Button("Locate me", id="locate-me"),
+            dcc.Geolocation(id="geolocation"),
+            html.Div(id="nearest-stations"),
+            # Begin of Layout for Boxplot and points over year
+            html.H2(
+                "See mean concentration of all countries over the years (just for fun)"
+            ),
+            # Selection with dropdown menu for different concentrations for graph plotting
+            dcc.Dropdown(
+                id="graph-selector",
+                options=[
+                    {"label": "PM10", "value": "pm10_concentration"},
+                    {"label": "PM25", "value": "pm25_concentration"},
+                    {"label": "NO2", "value": "no2_concentration"},
+                ],
+                value="pm10_concentration",
+            ),
+            dcc.Graph(id="graph"),
+        ]
+    )
+
+
+@flights.coalesced()
+def bar_max_updates(dataset, countries, year_1, year_2):
+    """
+    Calculates the traces and title of the bar plot which presents the max values in function of the country.
+
+    Returns:
+    dict: the figure updates (property path -> value) for the selection
+    """
+    return figures.bar_max_updates(dataset.derived("WHO plots"), countries, year_1, year_2)
 
 
 @callback(
@@ -195,403 +255,275 @@ layout = html.Div(
 )
 def update_bar_max(countries, year_1, year_2):
     """
-    Barplot which presents the max values in function of the country
+    Barplot which presents the max values in function of the country.
+    Only the initial rendering sends the whole figure, afterwards only traces and titles are patched.
     """
-    country_list = countries
-    if isinstance(
-        countries, str
-    ):  # if only one country is selected, dash returns a string,
-        #  which can't be used for the compairson, hence convert it to a list.
-        country_list = list(countries)
-    # filter the dataframe for the year + country
-    df = whodata.df[
-        (whodata.df["year"] >= year_1)
-        & (whodata.df["year"] <= year_2)
-        & (whodata.df["country_name"].isin(country_list))
-    ]
-
-    # test if for the chosen combination of polluant, and timespan one of the polluant
-    # data is not available, if yes, print no matching data found.
-    # algorithme however could be improved, here it serves as a proof of concept.
-    if (
-        df[["pm10_concentration", "pm25_concentration", "no2_concentration"]]
-        .isnull()
-        .all()
-        .any()
-    ):
-        return {
-            "layout": {
-                "xaxis": {"visible": False},
-                "yaxis": {"visible": False},
-                "annotations": [
-                    {
-                        "text": "No matching data found",
-                        "xref": "paper",
-                        "yref": "paper",
-                        "showarrow": False,
-                        "font": {"size": 28},
-                    }
-                ],
-            }
-        }
-
-    # create a new dataframe with only max values
-    df_max = (
-        df.groupby("country_name")[
-            ["pm10_concentration", "pm25_concentration", "no2_concentration"]
-        ]
-        .max()
-        .reset_index()
-    )
-    # convert from wide to long datafromat
-    df_max = pd.melt(
-        df_max,
-        id_vars=["country_name"],
-        value_vars=["pm10_concentration", "pm25_concentration", "no2_concentration"],
-    )
-    # add when the observation of the max value had been made
-    df_max.loc[df_max["variable"] == "pm10_concentration", "year"] = df.loc[
-        df.groupby("country_name")["pm10_concentration"].idxmax(), "year_int"
-    ].values
-    df_max.loc[df_max["variable"] == "pm25_concentration", "year"] = df.loc[
-        df.groupby("country_name")["pm25_concentration"].idxmax(), "year_int"
-    ].values
-    df_max.loc[df_max["variable"] == "no2_concentration", "year"] = df.loc[
-        df.groupby("country_name")["no2_concentration"].idxmax(), "year_int"
-    ].values
-    # for hoover overlay, we need a customdata list with the year + value
-    customdata = np.stack((df_max["value"], df_max["year"]), axis=-1)
-    df_max = df_max.replace(
-        to_replace={
-            "pm10_concentration": "PM10",
-            "pm25_concentration": "PM25",
-            "no2_concentration": "NO2",
-        }
-    )
-    # convert float year to int, if not possible, as it does not exist (Nan), print NA
-    try:
-        year_min_str = str(int(df["year_int"].min()))
-        year_max_str = str(int(df["year_int"].max()))
-    except ValueError:
-        year_min_str = "NA"
-        year_max_str = "NA"
-    # add a barplot (using histogram element from plotly express, as it enables us to use more
-    # finetuning parameters)
-    fig = px.histogram(
-        data_frame=df_max,
-        x="country_name",
-        y="value",
-        color="variable",
-        barmode="group",
-        title=f"Air quality data from {year_min_str} to {year_max_str}",
-        color_discrete_sequence=px.colors.qualitative.D3,
-    )
-    # change axe labeling and legend
-    fig.update_layout(
-        xaxis_title="Country",
-        yaxis_title="Max concentration [ug/m<sup>3</sup>]",
-        legend_title_text="Polluant",
-    )
-    # add hoover traces
-    fig.update_traces(
-        customdata=customdata,
-        hovertemplate="<b>Concentration:</b> %{y} ug/m<sup>3</sup><br> <b>Year of max. data:</b> %{customdata[1]} <extra></extra>",
-    )
-    return fig
+    updates = bar_max_updates(who.current(), countries, year_1, year_2)
+    if dash.ctx.triggered_id is None:
+        return helper_functions.apply_figure_updates(figures.bar_skeleton(), updates)
+    return helper_functions.patch_figure(updates)
 
 
 # Dynamic callback to filter out if there is a station avialbe for a country or not
 # https://dash-example-index.herokuapp.com/dynamic-callback
+# The lookup of the stations per country is stored in the webbrowser, hence the chained
+# dropdowns are resolved on the client side, without round trip to the server.
 
-
-@callback(
+# function to filter out the stations in function of the countries
+clientside_callback(
+    """
+    function(country, lookup) {
+        let stations = lookup.stations;
+        const index = lookup.countries.indexOf(country);
+        if (country !== null && index !== -1) {
+            stations = lookup.country_stations[index].map((i) => lookup.stations[i]);
+        }
+        return stations.map((station) => ({label: station, value: station}));
+    }
+    """,
     Output("station", "options"),
     Input("country", "value"),
-    Input("concentration-selector", "value"),
+    Input("station-country-lookup", "data"),
 )
 
-# function to filter out the stations in function of the countries
-
-
-def chained_callback_station(country, concentration):
-    dff = copy.deepcopy(whodata.df)
-    if country is not None:
-        dff = dff[dff["country_name"] == country]
-        dff.dropna(subset=["type_of_stations"], inplace=True)
-    # Convert all station types to strings
-    station_types = dff["type_of_stations"].dropna().astype(str).unique()
-    return [{"label": station, "value": station} for station in sorted(station_types)]
-
-
-@callback(
+# function to filter out the countries in function of the stations
+clientside_callback(
+    """
+    function(station, lookup) {
+        let countries = lookup.countries;
+        const index = lookup.stations.indexOf(station);
+        if (station !== null) {
+            countries = countries.filter(
+                (country, i) => lookup.country_stations[i].includes(index)
+            );
+        }
+        return countries.map((country) => ({label: country, value: country}));
+    }
+    """,
     Output("country", "options"),
     Input("station", "value"),
-    Input("concentration-selector", "value"),
+    Input("station-country-lookup", "data"),
 )
 
-# function to filter out the countries in function of the stations
-
-
-def chained_callback_country(station, concentration):
-    dff = copy.deepcopy(whodata.df)
-    if station is not None:
-        dff = dff[dff["type_of_stations"] == station]
-        dff.dropna(subset=["country_name"], inplace=True)
-    # Convert all country names to strings (made some problems if not)
-    country_names = dff["country_name"].astype(str).unique()
-    return [{"label": country, "value": country} for country in sorted(country_names)]
-
 
-# Here is where the magic is made
-
-
-@callback(
-    Output(component_id="globe", component_property="figure"),
-    Input(component_id="country", component_property="value"),
-    Input(component_id="station", component_property="value"),
-    Input(component_id="concentration-selector", component_property="value"),
+# Styling of the globe, which is the same for every projection / centering mode
+GEO_STYLE = {
+    "showcoastlines": True,
+    "coastlinecolor": "Black",
+    "showland": True,
+    "landcolor": "LightGrey",
+    "showcountries": True,
+    "countrycolor": "Black",
+    "showocean": True,
+    "oceancolor": "LightBlue",
+    "showlakes": True,
+    "lakecolor": "LightBlue",
+    "showrivers": True,
+    "rivercolor": "Blue",
+}
+LABELING_COLUMNS = {
+    "pm10_concentration": "PM10",
+    "pm25_concentration": "PM25",
+    "no2_concentration": "NO2",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def globe_skeleton(centered):
+    """
+    Returns the geo layout for one projection / centering mode: a 3D globe if no country is
+    centered, otherwise a zoomed 2D world map.
+    """
+    if centered:
+        return {**GEO_STYLE, "projection": {"type": "natural earth", "scale": 5}}
+    return {**GEO_STYLE, "projection": {"type": "orthographic", "scale": 1}}
+
+
+# the traces are cached per version of the WHO data (by its name, the cache doesn't keep
+# an old version alive), the cache is emptied when a new version is swapped in
+@memory.sized_cache(
+    "globe traces",
+    max_entries=16,
+    max_bytes=GLOBE_CACHE_BYTES,
+    key=lambda dataset, *args: (str(dataset), *args),
 )
+@flights.coalesced(shared=False)  # several MB, computed by each process
+def globe_traces(dataset, concentration, station):
+    """
+    Builds the traces and animation frames of the globe for one concentration and type of station.
+    The last trace is a hidden choropleth, which is used to contour the centered country.
 
-# representation of a globe, different configurations are made in function of the inputs
-
-
-def globe_representation(country_to_zoom, station, concentration):
-    dff = whodata.df
+    Returns:
+    dict: the figure dictionary (without centering and title)
+    """
     # sort years for the bar and drop Nan values of concentration for further processing
-    dff = dff.sort_values(by="year_int", ascending=True)
-    dff.dropna(subset=[concentration, "year_int"], inplace=True)
+    dff = dataset.derived("WHO plots").df.sort_values(by="year_int", ascending=True)
+    dff = dff.dropna(subset=[concentration, "year_int"])
     dff["year_int"] = dff["year_int"].astype(int)
-    dff_labeling_columns = {
-        "pm10_concentration": "PM10",
-        "pm25_concentration": "PM25",
-        "no2_concentration": "NO2",
-    }
     range_min_value = dff[concentration].quantile(0.05)
     range_max_value = dff[concentration].quantile(0.95)
     dff["point_size"] = dff[concentration].clip(range_min_value, range_max_value)
-    customdata = np.stack(
-        (
-            dff[concentration],
-            dff["city"],
-        ),
-        axis=-1,
+    range_color = [range_min_value, range_max_value]
+    if station is not None:
+        dff = dff.dropna(subset=["type_of_stations"])
+        dff = dff[dff["type_of_stations"] == str(station)]
+        range_color = None
+
+    # plot points by their size and color in function of the concentration
+    import plotly.express as px  # loaded with the first figure, not at startup
+
+    fig = px.scatter_geo(
+        dff,
+        lat="latitude",
+        lon="longitude",
+        size="point_size",
+        color=concentration,
+        animation_frame="year_int",
+        projection="orthographic",
+        color_continuous_scale="Viridis",
+        range_color=range_color,
+        custom_data=[concentration, "city"],
+        labels={
+            concentration: f"{LABELING_COLUMNS[concentration]} [ug/m<sup>3</sup>] "
+        },
     )
-
-    # plot the concentrations without centering and specify station on the 3D globe
-    if (country_to_zoom is None) and (station is None):
-        # plot points by their size and color in function of the concentration
-        fig = px.scatter_geo(
-            dff,
-            lat="latitude",
-            lon="longitude",
-            size="point_size",
-            color=concentration,
-            animation_frame="year_int",
-            projection="orthographic",
-            color_continuous_scale="Viridis",
-            range_color=[range_min_value, range_max_value],
-            labels={
-                concentration: f"{dff_labeling_columns[concentration]} [ug/m<sup>3</sup>] "
-            },
+    hovertemplate = "<b>%{customdata[1]} </b><br>Concentration: %{customdata[0]} ug/m<sup>3</sup><br><extra></extra>"
+    fig.update_traces(hovertemplate=hovertemplate)
+    for frame in fig.frames:
+        frame.data[0].hovertemplate = hovertemplate
+
+    # Contour of the centered country in red, hidden as long as no country is chosen
+    fig.add_trace(
+        go.Choropleth(
+            locations=[],
+            locationmode="country names",
+            z=[0],  # Dummy variable for color scale
+            colorscale=[[0, "LightGrey"], [1, "LightGrey"]],
+            showscale=False,
+            marker=dict(line=dict(width=2, color="red")),
+            visible=False,
         )
+    )
+    fig.update_layout(
+        width=1000,
+        height=800,
+        sliders=[{"currentvalue": {"prefix": "Year: "}}],
+    )
+    return fig.to_plotly_json()
 
-        # Update colors and globe
-        fig.update_geos(
-            showcoastlines=True,
-            coastlinecolor="Black",
-            showland=True,
-            landcolor="LightGrey",
-            showcountries=True,
-            countrycolor="Black",
-            showocean=True,
-            oceancolor="LightBlue",
-            showlakes=True,
-            lakecolor="LightBlue",
-            showrivers=True,
-            rivercolor="Blue",
-        )
-        fig.update_layout(
-            title=f"{dff_labeling_columns[concentration]} over the years on a 3D globe"
-        )
 
-    # show globe with concentration over all stations focused on one country
-    elif (country_to_zoom is not None) and (station is None):
+who.add_listener(lambda dataset: globe_traces.cache_clear())
 
-        # get coordinates to zoom the on the map the country of interest
-        index = filtered_countries[
-            filtered_countries["country_name"] == str(country_to_zoom)
-        ].index
-        # Get the latitude and longitude coordinates of the first row (by default)
-
-        coordinates = filtered_countries.loc[index[0], ["latitude", "longitude"]]
-
-        center_lat = coordinates["latitude"]
-        center_lon = coordinates["longitude"]
-
-        # plot points by their size and color in function of the concentration
-        fig = px.scatter_geo(
-            dff,
-            lat="latitude",
-            lon="longitude",
-            size="point_size",
-            color=concentration,
-            animation_frame="year_int",
-            projection="natural earth",
-            color_continuous_scale="Viridis",
-            range_color=[range_min_value, range_max_value],
-            labels={
-                concentration: f"{dff_labeling_columns[concentration]} [ug/m<sup>3</sup>] "
-            },
-        )
 
-        # Update colors and globe and center on wished country
-        fig.update_geos(
-            center=dict(lat=center_lat, lon=center_lon),
-            projection_scale=5,
-            showcoastlines=True,
-            coastlinecolor="Black",
-            showland=True,
-            landcolor="LightGrey",
-            showcountries=True,
-            countrycolor="Black",
-            showocean=True,
-            oceancolor="LightBlue",
-            showlakes=True,
-            lakecolor="LightBlue",
-            showrivers=True,
-            rivercolor="Blue",
-        )
+def globe_centering_updates(dataset, country_to_zoom, outline_trace):
+    """
+    Returns the figure updates to center the globe on a country (or to reset the centering).
 
-        # Contour the chosed country in red
-        fig.add_trace(
-            go.Choropleth(
-                locations=[country_to_zoom],
-                locationmode="country names",
-                z=[0],  # Dummy variable for color scale
-                colorscale=[[0, "LightGrey"], [1, "LightGrey"]],
-                showscale=False,
-                marker=dict(line=dict(width=2, color="red")),
-            )
-        )
+    Args:
+    dataset (DatasetVersion): the version of the WHO data
+    country_to_zoom (str): the country to center on, None for the 3D globe
+    outline_trace (int): index of the choropleth trace contouring the country
+    """
+    geo = dict(globe_skeleton(country_to_zoom is not None))
+    if country_to_zoom is not None:
+        # get coordinates to zoom the on the map the country of interest
+        coordinates = dataset.derived("WHO plots").country_centers.loc[str(country_to_zoom)]
+        geo["center"] = dict(lat=coordinates["latitude"], lon=coordinates["longitude"])
+    return {
+        ("layout", "geo"): geo,
+        ("data", outline_trace, "locations"): (
+            [] if country_to_zoom is None else [country_to_zoom]
+        ),
+        ("data", outline_trace, "visible"): country_to_zoom is not None,
+    }
 
-        fig.update_layout(
-            title=f"{dff_labeling_columns[concentration]} over the years centered on {country_to_zoom} on a 2D world map"
-        )
 
-    # show globe with station and concentration without to zoom on a country
-    elif (country_to_zoom is None) and (station is not None):
-        dff.dropna(subset=["type_of_stations"], inplace=True)
-        dff = dff[dff["type_of_stations"] == str(station)]
+def globe_title(country_to_zoom, station, concentration):
+    """
+    Returns the title of the globe in function of the inputs
+    """
+    label = LABELING_COLUMNS[concentration]
+    if station is None and country_to_zoom is None:
+        return f"{label} over the years on a 3D globe"
+    if station is None:
+        return f"{label} over the years centered on {country_to_zoom} on a 2D world map"
+    if country_to_zoom is None:
+        return f"{label} on {station} station over the years on a 3D globe"
+    return f"{label} on {station} stations over the years centered on {country_to_zoom} on a 2D world map"
 
-        fig = px.scatter_geo(
-            dff,
-            lat="latitude",
-            lon="longitude",
-            size="point_size",
-            color=concentration,
-            animation_frame="year_int",
-            projection="orthographic",
-            color_continuous_scale="Viridis",
-            labels={
-                concentration: f"{dff_labeling_columns[concentration]} [ug/m<sup>3</sup>] "
-            },
-        )
 
-        # Update colors and globe
-        fig.update_geos(
-            showcoastlines=True,
-            coastlinecolor="Black",
-            showland=True,
-            landcolor="LightGrey",
-            showcountries=True,
-            countrycolor="Black",
-            showocean=True,
-            oceancolor="LightBlue",
-            showlakes=True,
-            lakecolor="LightBlue",
-            showrivers=True,
-            rivercolor="Blue",
-        )
-        fig.update_layout(
-            title=f"{dff_labeling_columns[concentration]} on {station} station over the years on a 3D globe",
-        )
+# Here is where the magic is made
 
-    # show globe when every input is chosen
-    elif (country_to_zoom is not None) and (station is not None):
 
-        # get coordinates to zoom the on the map the country of interest
-        index = filtered_countries[
-            filtered_countries["country_name"] == str(country_to_zoom)
-        ].index
-        # Get the latitude and longitude coordinates of the first row (by default)
+@callback(
+    Output(component_id="globe", component_property="figure"),
+    Input(component_id="country", component_property="value"),
+    Input(component_id="station", component_property="value"),
+    Input(component_id="concentration-selector", component_property="value"),
+)
 
-        coordinates = filtered_countries.loc[index[0], ["latitude", "longitude"]]
+# representation of a globe, different configurations are made in function of the inputs.
+# The whole figure is only sent for the initial rendering, afterwards a change of the country
+# only patches the centering, and a change of the concentration / station only swaps the traces.
 
-        dff.dropna(subset=["type_of_stations"], inplace=True)
-        dff = dff[dff["type_of_stations"] == str(station)]
 
-        center_lat = coordinates["latitude"]
-        center_lon = coordinates["longitude"]
-
-        # plot points by their size and color in function of the concentration
-        fig = px.scatter_geo(
-            dff,
-            lat="latitude",
-            lon="longitude",
-            size="point_size",
-            color=concentration,
-            animation_frame="year_int",
-            projection="natural earth",
-            color_continuous_scale="Viridis",
-            labels={
-                concentration: f"{dff_labeling_columns[concentration]} [ug/m<sup>3</sup>] "
-            },
-        )
+def globe_representation(country_to_zoom, station, concentration):
+    dataset = who.current()  # the whole callback uses the same version
+    traces = globe_traces(dataset, concentration, station)
+    updates = {}
+    if dash.ctx.triggered_id not in (None, "country"):
+        updates = {
+            ("data",): traces["data"],
+            ("frames",): traces["frames"],
+            ("layout", "coloraxis"): traces["layout"]["coloraxis"],
+            ("layout", "sliders"): traces["layout"]["sliders"],
+            ("layout", "updatemenus"): traces["layout"]["updatemenus"],
+        }
+    updates.update(
+        globe_centering_updates(dataset, country_to_zoom, len(traces["data"]) - 1)
+    )
+    updates[("layout", "title", "text")] = globe_title(
+        country_to_zoom, station, concentration
+    )
+    if dash.ctx.triggered_id is None:
+        return helper_functions.apply_figure_updates(traces, updates)
+    return helper_functions.patch_figure(updates)
 
-        # Update colors and globe in function of the country to zoom in
-        fig.update_geos(
-            center=dict(lat=center_lat, lon=center_lon),
-            projection_scale=5,
-            showcoastlines=True,
-            coastlinecolor="Black",
-            showland=True,
-            landcolor="LightGrey",
-            showcountries=True,
-            countrycolor="Black",
-            showocean=True,
-            oceancolor="LightBlue",
-            showlakes=True,
-            lakecolor="LightBlue",
-            showrivers=True,
-            rivercolor="Blue",
-        )
 
-        # Contour the chosed country in red
-        fig.add_trace(
-            go.Choropleth(
-                locations=[country_to_zoom],
-                locationmode="country names",
-                z=[0],  # Dummy variable for color scale
-                colorscale=[[0, "LightGrey"], [1, "LightGrey"]],
-                showscale=False,
-                marker=dict(line=dict(width=2, color="red")),
-            )
-        )
+@callback(
+    Output("geolocation", "update_now"),
+    Input("locate-me", "n_clicks"),
+    prevent_initial_call=True,
+)
+def locate_me(n_clicks):
+    """
+    Asks the webbrowser for the current position of the user
+    """
+    return True
 
-        fig.update_layout(
-            title=f"{dff_labeling_columns[concentration]} on {station} stations over the years centered on {country_to_zoom} on a 2D world map",
-        )
 
-    fig.update_layout(
-        width=1000,
-        height=800,
-        sliders=[{"currentvalue": {"prefix": "Year: "}}],
+@callback(
+    Output("nearest-stations", "children"),
+    Input("geolocation", "position"),
+    prevent_initial_call=True,
+)
+def nearest_stations(position):
+    """
+    Lists the stations nearest to the position of the user, using the spatial index of the WHO data
+    """
+    if position is None:
+        return html.P("Your position is not available.")
+    stations = who.current().derived("WHO plots").nearest_stations(
+        position["lat"], position["lon"], k=5
     )
-    fig.update_traces(
-        customdata=customdata,
-        hovertemplate="<b>%{customdata[1]} </b><br>Concentration: %{customdata[0]} ug/m<sup>3</sup><br><extra></extra>",
+    return html.Ul(
+        [
+            html.Li(
+                f"{station['city']} ({station['country_name']}): {station['distance_km']:.1f} km"
+            )
+            for _, station in stations.iterrows()
+        ]
     )
-    return fig
 
 
 @callback(
@@ -604,21 +536,9 @@ def globe_representation(country_to_zoom, station, concentration):
 
 
 def update_graph(selected_value):
-    if selected_value == "pm10_concentration":
-        title = "mean PM10 value over the years"
-    elif selected_value == "pm25_concentration":
-        title = "mean PM25 value over the years"
-    else:
-        title = "mean NO2 value over the years"
-
-    df_pivot = whodata.df.pivot_table(
-        index="year", values=selected_value, aggfunc="mean"
-    )
+    return trend_figure(who.current(), selected_value)
 
-    fig = px.line(
-        x=df_pivot.index,
-        y=df_pivot[selected_value],
-        labels={"x": "year", "y": selected_value},
-        title=title,
-    )
-    return fig
+
+@flights.coalesced()
+def trend_figure(dataset, selected_value):
+    return figures.trend_figure(dataset.derived("WHO plots").df, selected_value)
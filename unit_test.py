@@ -1,7 +1,68 @@
+import contextlib
+import gc
+import importlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
-from air_quality_dashboard.data_parser.local_data import LocalData
+from unittest import mock
+from air_quality_dashboard import cli, reports, startup
+from air_quality_dashboard.dashboard import (
+    admin,
+    datasets,
+    events,
+    export,
+    helper_functions,
+    memory,
+    profiling,
+)
+from air_quality_dashboard.dashboard.result_store import ResultStore, query_key
+from air_quality_dashboard.dashboard.single_flight import SingleFlight, flight_key
+from air_quality_dashboard.dashboard.text_index import TextIndex
+from air_quality_dashboard.data_parser import (
+    artifacts,
+    atomic,
+    comparison,
+    fetch,
+    forecast,
+    local_data,
+    retention,
+)
+from air_quality_dashboard.data_parser.exceedances import ExceedanceEvaluator
+from air_quality_dashboard.data_parser.forecast import LinearTrendModel, LocalForecaster
+from air_quality_dashboard.data_parser.local_data import LocalData, ingest_local_data
+from air_quality_dashboard.data_parser.range_query import GroupRangeMax, RangeMaxIndex
+from air_quality_dashboard.data_parser.snapshot_store import SnapshotStore
+from air_quality_dashboard.data_parser.sources import (
+    POLLUTANT_COLUMNS,
+    NabelSource,
+    fetch_snapshots,
+)
+from air_quality_dashboard.data_parser.statistics import RunningStatistics
+from air_quality_dashboard.data_parser.who_data import WHOData
+from air_quality_dashboard.data_parser.spatial_index import SpatialIndex, haversine_km
+from data_for_unit_testing.fixture_server import FixtureServer
+import dash
+import flask
+import numpy as np
 import pandas as pd
 
+# the requests of the tests are mirrored into a temporary directory, not into data/mirror
+_mirror = tempfile.TemporaryDirectory()
+
+
+def setUpModule():
+    patcher = mock.patch.object(
+        fetch, "shared_fetcher", return_value=fetch.Fetcher(directory=_mirror.name)
+    )
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+    unittest.addModuleCleanup(_mirror.cleanup)
+
 
 class TestLocalData(unittest.TestCase):
 
@@ -45,5 +106,1044 @@ class TestLocalData(unittest.TestCase):
         self.assertRaises(SystemExit, LocalData, "no_valid_url_supplied", "Switzerland")
 
 
+class TestLocalSources(unittest.TestCase):
+
+    def test_nabel_source_snapshot(self):
+        with FixtureServer() as server:
+            source = NabelSource(server.url("nabel_snapshot.html"), "UnitTest")
+            snapshot = source.get_snapshot()
+        # the row with the ambient air quality standard is not a site
+        self.assertEqual(len(snapshot), 16)
+        self.assertEqual(snapshot["timestamp"].iloc[0], pd.Timestamp("2024-01-05 21:00"))
+        self.assertTrue(pd.isna(snapshot.loc[0, "SO2"]))  # "-" is converted to NAN
+        self.assertEqual(snapshot.loc[0, "PM10"], 50)
+
+    def test_fetch_snapshots(self):
+        with FixtureServer() as server:
+            snapshots = fetch_snapshots(
+                [
+                    NabelSource(server.url("nabel_snapshot.html"), "valid"),
+                    NabelSource(server.url("missing.html"), "missing"),
+                    NabelSource(server.url("slow/nabel_snapshot.html"), "slow"),
+                ],
+                timeout=1,
+            )
+        self.assertIsInstance(snapshots["valid"], pd.DataFrame)
+        self.assertIsInstance(snapshots["missing"], Exception)
+        self.assertIsInstance(snapshots["slow"], TimeoutError)
+
+    def test_ingest_local_data(self):
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            source = NabelSource(server.url("nabel_snapshot.html"), "UnitTest")
+            ingest_local_data([source], data_directory=directory)
+            # ingesting the same snapshot twice does not duplicate it
+            local_data = ingest_local_data([source], data_directory=directory)
+            self.assertEqual(len(local_data["UnitTest"].df), 16)
+            self.assertEqual(local_data["UnitTest"].min_date(), "2024-01-05 21:00")
+
+
+class TestFetch(unittest.TestCase):
+
+    def test_mirror_and_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with FixtureServer() as server:
+                url = server.url("nabel_snapshot.html")
+                fetcher = fetch.Fetcher(directory, retries=0)
+                content = fetcher.get(url)
+                self.assertEqual(fetcher.get(url, max_age=None), content)  # local read
+                self.assertEqual(fetcher.get(url), content)  # not modified
+                self.assertEqual(
+                    dict(fetcher.stats), {"fetched": 1, "mirrored": 1, "revalidated": 1}
+                )
+                with self.assertRaises(fetch.requests.exceptions.HTTPError):
+                    fetcher.get(server.url("missing.html"))
+            # the same content is stored once
+            self.assertEqual(len(os.listdir(os.path.join(directory, "objects"))), 1)
+            # without network
+            replay = fetch.Fetcher(directory, mode="replay")
+            self.assertEqual(replay.get(url), content)
+            with self.assertRaises(fetch.MirrorMissError):
+                replay.get(server.url("missing.html"))
+            with mock.patch.object(fetch, "shared_fetcher", return_value=replay):
+                snapshot = NabelSource(url, "UnitTest").get_snapshot()
+            self.assertEqual(len(snapshot), 16)
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.latitude = rng.uniform(-90, 90, 5000)
+        self.longitude = rng.uniform(-180, 180, 5000)
+        self.index = SpatialIndex(self.latitude, self.longitude)
+
+    def test_bbox(self):
+        # box crossing the antimeridian
+        indices = self.index.bbox(-10, 30, 170, -170)
+        expected = np.where(
+            (self.latitude >= -10)
+            & (self.latitude <= 30)
+            & ((self.longitude >= 170) | (self.longitude <= -170))
+        )[0]
+        self.assertEqual(set(indices), set(expected))
+
+    def test_radius_and_nearest(self):
+        distances = haversine_km(46.95, 7.44, self.latitude, self.longitude)
+        indices, _ = self.index.radius(46.95, 7.44, 1000)
+        self.assertEqual(set(indices), set(np.where(distances <= 1000)[0]))
+        _, nearest_distances = self.index.nearest(46.95, 7.44, k=10)
+        np.testing.assert_allclose(nearest_distances, np.sort(distances)[:10])
+
+
+class TestComparison(unittest.TestCase):
+
+    def test_yearly_means(self):
+        yearly = comparison.YearlyMeans(["PM10"])
+        df = pd.DataFrame(
+            {
+                "timestamp": pd.to_datetime(
+                    ["2023-01-01 00:00", "2023-02-01 00:00", "2024-01-01 10:00"]
+                ),
+                "Location": ["Bern"] * 3,
+                "PM10": [10.0, 40.0, 5.0],
+            }
+        )
+        yearly.update(df.iloc[:1], 24 * 31)  # monthly mean
+        yearly.update(df.iloc[1:2], 24)  # daily mean
+        yearly.add_snapshot(df.iloc[2:])
+        yearly.add_snapshot(df.iloc[2:])  # included already
+        self.assertEqual(
+            yearly.means()["PM10"].tolist(), [(10 * 24 * 31 + 40 * 24) / (24 * 32), 5.0]
+        )
+
+    def test_comparison(self):
+        whodata = WHOData.from_dataframe(
+            pd.DataFrame(
+                {
+                    "country_name": ["Switzerland"] * 4 + ["Germany"],
+                    "city": ["Bern/CHE", "Bern/CHE", "Basel/CHE", "Basel/CHE", "Weil/DEU"],
+                    "latitude": [46.95, 46.95, 47.56, 47.56, 47.545],
+                    "longitude": [7.44, 7.44, 7.59, 7.59, 7.585],
+                    "year": pd.to_datetime(["2020", "2021", "2020", "2021", "2021"]),
+                    "year_int": [2020.0, 2021.0, 2020.0, 2021.0, 2021.0],
+                    "pm10_concentration": [20.0, 18.0, 22.0, np.nan, 30.0],
+                    "pm25_concentration": np.nan,
+                    "no2_concentration": [30.0, 28.0, 25.0, 24.0, 40.0],
+                }
+            )
+        )
+        sites = pd.DataFrame(
+            {
+                "Location": ["Bern-Bollwerk", "Basel-Binningen", "Jungfraujoch"],
+                "Latitude": [46.951, 47.541, 46.548],
+                "Longitude": [7.44, 7.583, 7.985],
+            }
+        )
+        matches = comparison.match_sites(sites, whodata, "Switzerland")
+        # the nearest city of the same country, Jungfraujoch has no city within the radius
+        self.assertEqual(
+            dict(zip(matches["Location"], matches["city"])),
+            {"Bern-Bollwerk": "Bern/CHE", "Basel-Binningen": "Basel/CHE"},
+        )
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            source = NabelSource(server.url("nabel_snapshot.html"), "Switzerland")
+            snapshot = source.get_snapshot()
+            localdata = LocalData(source=source, update_on_load=False, data_directory=directory)
+            localdata.append_snapshot(snapshot)
+            site_comparison = comparison.Comparison(whodata, localdata, sites)
+            table = site_comparison.table("pm10_concentration")
+            bern = table[table["Location"] == "Bern-Bollwerk"]
+            self.assertEqual(bern["year"].tolist(), [2020, 2021, 2024])
+            self.assertEqual(bern["WHO"].tolist()[:2], [20.0, 18.0])
+            measured = snapshot.loc[snapshot["Location"] == "Bern-Bollwerk", "PM10"].iloc[0]
+            self.assertEqual(bern["local"].iloc[-1], measured)
+            # the yearly means follow the new snapshots
+            localdata.append_snapshot(
+                snapshot.assign(timestamp=snapshot["timestamp"] + pd.Timedelta(days=366))
+            )
+            self.assertIn(2025, site_comparison.table("no2_concentration")["year"].tolist())
+
+
+class TestReports(unittest.TestCase):
+
+    def test_render_and_resume(self):
+        whodata = WHOData.from_dataframe(
+            pd.DataFrame(
+                {
+                    "country_name": ["Switzerland", "Switzerland", "Germany"],
+                    "city": ["Bern/CHE", "Bern/CHE", "Berlin/DEU"],
+                    "latitude": [46.95, 46.95, 52.52],
+                    "longitude": [7.44, 7.44, 13.4],
+                    "year": pd.to_datetime(["2020", "2021", "2021"]),
+                    "year_int": [2020.0, 2021.0, 2021.0],
+                    "pm10_concentration": [20.0, 18.0, 25.0],
+                    "pm25_concentration": [10.0, 9.0, np.nan],
+                    "no2_concentration": [30.0, 28.0, 40.0],
+                }
+            )
+        )
+        geocodes = pd.DataFrame(
+            {"Location": ["Bern"], "Latitude": [46.95], "Longitude": [7.44]}
+        )
+        snapshot = pd.DataFrame(
+            {
+                "timestamp": pd.to_datetime(["2024-05-01 10:00"]),
+                "Location": ["Bern"],
+                "NO2": [30.0],
+                "PM10": [15.0],
+            }
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            # the O3 map fails, as the snapshot has no O3 column
+            with contextlib.redirect_stdout(io.StringIO()):
+                manifest = reports.render_reports(
+                    whodata, snapshot, geocodes, directory, workers=2
+                )
+            self.assertEqual(len(manifest["jobs"]), 2 * 4 + 3)
+            failed = [job for job, state in manifest["jobs"].items() if state["status"] != "done"]
+            self.assertEqual(failed, ["map/O3"])
+            name = reports.figure_name("trend/Germany/no2_concentration")
+            figure = os.path.join(directory, "figures", f"{name}.html")
+            self.assertTrue(os.path.exists(figure))
+            self.assertTrue(os.path.exists(os.path.join(directory, "index.html")))
+            # the next run only renders the failed figure
+            with contextlib.redirect_stdout(io.StringIO()):
+                manifest = reports.render_reports(
+                    whodata, snapshot.assign(O3=[60.0]), geocodes, directory, workers=2
+                )
+            rendered = [job for job, state in manifest["jobs"].items() if state["run"] == 2]
+            self.assertEqual(rendered, ["map/O3"])
+            self.assertEqual(manifest["jobs"]["map/O3"]["status"], "done")
+
+    def test_figure_name(self):
+        self.assertEqual(reports.slug("trend/Côte d'Ivoire"), "trend_cote_d_ivoire")
+        # jobs with the same slug are written to different files
+        self.assertEqual(reports.slug("Curaçao"), reports.slug("Curacao"))
+        self.assertNotEqual(reports.figure_name("Curaçao"), reports.figure_name("Curacao"))
+
+
+class TestTextIndex(unittest.TestCase):
+
+    def test_mask(self):
+        cities = pd.Series(["Bern/CHE", "Berlin/DEU", None, "Oberhausen/DEU", "Basel/CHE"] * 3)
+        index = TextIndex(cities)
+        for substring in ["BER", "be", "/deu", "x"]:
+            expected = cities.str.contains(substring, case=False, regex=False)
+            np.testing.assert_array_equal(
+                index.mask(substring), expected.fillna(False).to_numpy(dtype=bool)
+            )
+
+
+class TestRangeQuery(unittest.TestCase):
+
+    def test_range_max_index(self):
+        rng = np.random.default_rng(0)
+        values = rng.integers(0, 5, size=(4, 13)).astype(float)
+        values[rng.random(values.shape) < 0.3] = np.nan
+        index = RangeMaxIndex(values)
+        for first in range(13):
+            for last in range(first, 13):
+                maxima, positions = index.query(np.arange(4), first, last)
+                window = values[:, first : last + 1]
+                for series in range(4):
+                    if np.isnan(window[series]).all():
+                        self.assertTrue(np.isnan(maxima[series]))
+                        self.assertEqual(positions[series], -1)
+                    else:
+                        self.assertEqual(maxima[series], np.nanmax(window[series]))
+                        # the first position of the max on ties
+                        self.assertEqual(
+                            positions[series], first + np.nanargmax(window[series])
+                        )
+
+    def test_group_range_max(self):
+        df = pd.DataFrame(
+            {
+                "country": ["A", "A", "A", "B", "B"],
+                "year": [2010.0, 2011.0, 2011.0, 2012.0, 2014.0],
+                "pm10": [5.0, 7.0, 9.0, np.nan, np.nan],
+                "no2": [3.0, np.nan, 1.0, 4.0, 2.0],
+            }
+        )
+        index = GroupRangeMax(df, "country", "year", ["pm10", "no2"])
+        result = index.query(["B", "A", "C"], 2011, 2014)
+        self.assertEqual(list(result["country"]), ["A", "B", "A", "B"])
+        np.testing.assert_array_equal(result["value"], [9.0, np.nan, 1.0, 4.0])
+        np.testing.assert_array_equal(result["year"], [2011.0, np.nan, 2011.0, 2012.0])
+        self.assertEqual(index.key_span(["A", "B"], 2011, 2013), (2011.0, 2012.0))
+        self.assertEqual(index.key_span(["A"], 2012, 2014), (None, None))
+        self.assertTrue(index.query(["A"], 2012, 2014).empty)
+
+
+class TestResultStore(unittest.TestCase):
+
+    def test_query_positions(self):
+        df = pd.DataFrame(
+            {"city": ["Bern", "Basel", "Genf", "Biel"], "pm10": [3.0, 1.0, 2.0, 5.0]},
+            index=[10, 11, 12, 13],
+        )
+        positions = helper_functions.query_positions(
+            df,
+            "{city} contains b",
+            [{"column_id": "pm10", "direction": "desc"}],
+            ["city"],
+        )
+        np.testing.assert_array_equal(positions, [3, 0, 1])
+
+    def test_ttl_and_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.sqlite")
+            store = ResultStore(path, ttl=60, max_bytes=100)
+            first = query_key("session", "who_data", 1, "{year_int} > 2015", [])
+            second = query_key("session", "who_data", 1, "{year_int} > 2016", [])
+            self.assertNotEqual(first, second)
+            store.put(first, np.arange(20))  # 80 bytes
+            # shared with other processes through the file
+            np.testing.assert_array_equal(ResultStore(path).get(first), np.arange(20))
+            store.put(second, np.arange(10))  # exceeds max_bytes, the older entry is evicted
+            self.assertIsNone(store.get(first))
+            self.assertEqual(len(store.get(second)), 10)
+            self.assertIsNone(ResultStore(path, ttl=0).get(second))  # expired
+
+
+class TestExport(unittest.TestCase):
+
+    def test_chunked_export(self):
+        df = pd.DataFrame({"city": [f"city {i}" for i in range(25)], "pm10": np.arange(25.0)})
+        export.register_table("unit_test", lambda: (df, {}), ["city"])
+        self.addCleanup(export._tables.pop, "unit_test")  # pylint: disable=protected-access
+        app = flask.Flask(__name__)
+        app.register_blueprint(export.blueprint)
+        with mock.patch.object(export, "CHUNK_SIZE", 4):
+            response = app.test_client().get(
+                "/export/unit_test",
+                query_string={
+                    "format": "ndjson",
+                    "filter_query": "{pm10} > 10",
+                    "sort_by": '[{"column_id": "pm10", "direction": "desc"}]',
+                },
+            )
+            lines = response.get_data(as_text=True).splitlines()
+        # the chunks are slices of the row positions, in the sorted order
+        self.assertEqual([json.loads(line)["pm10"] for line in lines], list(range(24, 10, -1)))
+
+
+class TestDatasets(unittest.TestCase):
+
+    def test_swap(self):
+        loaded = {"version": "v1", "loads": 0}
+
+        def load():
+            loaded["loads"] += 1
+            return pd.DataFrame({"value": [loaded["loads"]]})
+
+        handle = datasets.DatasetHandle("unit test", load, lambda: loaded["version"])
+        handle.derive("total", lambda dataset: int(dataset.data["value"].sum()))
+        swapped = []
+        handle.add_listener(swapped.append)
+        in_flight = handle.current()  # taken by a callback
+        self.assertEqual(str(in_flight), "unit test@v1")
+        self.assertIs(handle.reload(), in_flight)  # same version, nothing loaded
+        loaded["version"] = "v2"
+        current = handle.reload()
+        # the callback in flight finishes on its version, the new one is derived already
+        self.assertEqual(in_flight.derived("total"), 1)
+        self.assertEqual(current.derived("total"), 2)
+        self.assertEqual(swapped, [current])
+        self.assertEqual([version.version for version in handle.versions()], ["v2", "v1"])
+        # the old version is freed once the callback is done
+        del in_flight
+        gc.collect()
+        self.assertEqual([version.version for version in handle.versions()], ["v2"])
+        self.assertEqual((loaded["loads"], handle.swaps), (2, 1))
+
+    def test_artifact(self):
+        # the artifacts are loaded from the build of the version, not from the current build
+        built = datasets.DatasetVersion("unit test", None, "build 20240101-000000", {})
+        with mock.patch.object(artifacts, "load_artifact", return_value={"a": 1}) as load:
+            self.assertEqual(built.artifact("lookup"), {"a": 1})
+            load.assert_called_once_with("lookup", version="20240101-000000")
+            # a version loaded from a file has no artifacts, they are derived from the data
+            self.assertIsNone(
+                datasets.DatasetVersion("unit test", None, "file 1", {}).artifact("lookup")
+            )
+            load.assert_called_once()
+            load.side_effect = artifacts.ArtifactError("pruned")
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertIsNone(built.artifact("lookup"))
+
+    def test_reloading(self):
+        versions = iter(["v1", RuntimeError("broken build"), "v2"])
+
+        def version():
+            value = next(versions, "v2")
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        handle = datasets.register(datasets.DatasetHandle("unit test", dict, version))
+        self.addCleanup(datasets._handles.pop, "unit test")  # pylint: disable=protected-access
+        handle.current()
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            stop = handle.start_reloading(interval=0.01)
+            deadline = time.monotonic() + 5
+            while handle.swaps == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            stop.set()
+        # an unexpected error is reported and the next check swaps anyway
+        self.assertIn("RuntimeError: broken build", output.getvalue())
+        self.assertEqual(handle.current().version, "v2")
+        app = flask.Flask(__name__)
+        app.register_blueprint(datasets.blueprint)
+        client = app.test_client()
+        proxied = {"X-Forwarded-For": "203.0.113.7"}
+        self.assertEqual(
+            client.post("/admin/datasets/unit test/reload", headers=proxied).status_code, 403
+        )
+        self.assertEqual(client.post("/admin/datasets/unit test/reload").json["version"], "v2")
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls(self):
+        with tempfile.TemporaryDirectory() as directory:
+            flights = SingleFlight(directory)
+            calls = []
+
+            @flights.coalesced(version=lambda: "v1")
+            def compute(countries):
+                calls.append(countries)
+                time.sleep(0.2)
+                return {"countries": countries}
+
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(compute(["CH", "ES"])))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(calls, [["CH", "ES"]])
+            self.assertEqual(results, [{"countries": ["CH", "ES"]}] * 8)
+            self.assertEqual(flights.stats["computed"], 1)
+            self.assertEqual(flights.stats["coalesced"], 7)
+            # another worker process (same directory) gets the result instead of computing it
+            key = flight_key("compute", "v1", [["CH"]])
+            self.assertEqual(flights.do(key, lambda: "first"), "first")
+            other = SingleFlight(directory)
+            self.assertEqual(other.do(key, lambda: "second"), "first")
+            self.assertEqual(other.stats["shared"], 1)
+
+    def test_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            flights = SingleFlight(directory, max_shared_bytes=1000)
+            other = SingleFlight(directory, max_shared_bytes=1000)  # another worker process
+            started = threading.Event()
+
+            def compute(value):
+                started.set()
+                time.sleep(0.2)
+                return value
+
+            key = flight_key("compute", "v1", [])
+            leader = threading.Thread(target=flights.do, args=(key, compute, "first"))
+            leader.start()
+            started.wait()
+            # no lock is held while computing, another key is computed right away
+            self.assertEqual(other.do(flight_key("other", "v1", []), lambda: "other"), "other")
+            # the same key waits for the result of the other process
+            self.assertEqual(other.do(key, compute, "second"), "first")
+            leader.join()
+            self.assertEqual(other.stats["shared"], 1)
+            # large results are computed by each process
+            large = flight_key("large", "v1", [])
+            self.assertEqual(len(flights.do(large, bytes, 10_000)), 10_000)
+            self.assertEqual(len(other.do(large, bytes, 20_000)), 20_000)
+            self.assertEqual(other.stats["computed"], 2)
+
+    def test_error(self):
+        flights = SingleFlight(shared=False)
+        started = threading.Event()
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("no data")
+
+        errors = []
+
+        def call():
+            try:
+                flights.do("key", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=call)
+        follower.start()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(flights.stats["computed"], 1)
+
+
+class TestRunningStatistics(unittest.TestCase):
+
+    def test_incremental_update(self):
+        # updating snapshot by snapshot gives the same result as the whole dataset at once
+        df = pd.read_pickle(
+            "data_for_unit_testing/local_air_quality_data_Switzerland.xz",
+            compression="xz",
+        )
+        columns = ["O3", "NO2", "PM10"]
+        statistics = RunningStatistics("Location", columns, distinct_columns=["timestamp"])
+        for _, snapshot in df.groupby("timestamp"):
+            statistics.update(snapshot)
+        expected = df.groupby("Location")[columns]
+        pd.testing.assert_frame_equal(
+            statistics.mean_per_group().sort_index(),
+            expected.mean().sort_index(),
+            check_names=False,
+        )
+        pd.testing.assert_frame_equal(
+            statistics.maxima.sort_index().astype(float),
+            expected.max().sort_index().astype(float),
+            check_names=False,
+        )
+        self.assertEqual(statistics.n_distinct("timestamp"), df["timestamp"].nunique())
+        self.assertEqual(statistics.min_time, df["timestamp"].min())
+
+
+class TestExceedanceEvaluator(unittest.TestCase):
+
+    def test_rolling_counts(self):
+        df = pd.read_pickle(
+            "data_for_unit_testing/local_air_quality_data_Switzerland.xz",
+            compression="xz",
+        )
+        limits = pd.Series({"O3": 120, "NO2": 80, "NOX": np.nan, "PM10": 50})
+        evaluator = ExceedanceEvaluator(limits, window=5)
+        for _, snapshot in df.groupby("timestamp"):
+            evaluator.update(snapshot)
+        # count the exceedances of the last 5 snapshots directly
+        last = df[df["timestamp"].isin(np.sort(df["timestamp"].unique())[-5:])]
+        expected = (
+            (last[["O3", "NO2", "PM10"]] > limits[["O3", "NO2", "PM10"]])
+            .groupby(last["Location"])
+            .sum()
+        )
+        counts = evaluator.rolling_counts()
+        self.assertNotIn("NOX", counts.columns)  # no limit, no evaluation
+        pd.testing.assert_frame_equal(
+            counts.loc[expected.index],
+            expected.astype(counts.dtypes.iloc[0]),
+            check_names=False,
+            check_index_type=False,
+            check_column_type=False,
+        )
+        self.assertEqual(len(evaluator.alerts()), evaluator.current().to_numpy().sum())
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.read_pickle(
+            "data_for_unit_testing/local_air_quality_data_Switzerland.xz",
+            compression="xz",
+        ).sort_values("timestamp", kind="stable")
+        self.timestamps = self.df["timestamp"].unique()
+
+    def assert_same_rows(self, left, right):
+        pd.testing.assert_frame_equal(
+            left, right, check_dtype=False, check_column_type=False, check_index_type=False
+        )
+
+    def test_round_trip(self):
+        for arguments in ({}, {"delta": False}, {"keyframe_interval": 5}):
+            store = SnapshotStore.from_dataframe(self.df, POLLUTANT_COLUMNS, **arguments)
+            self.assert_same_rows(store.to_dataframe(), self.df)
+            first, last = self.timestamps[7], self.timestamps[13]
+            self.assert_same_rows(
+                store.time_range(first, last),
+                self.df[(self.df["timestamp"] >= first) & (self.df["timestamp"] <= last)],
+            )
+            self.assert_same_rows(
+                store.snapshot(last), self.df[self.df["timestamp"] == last]
+            )
+
+    def test_save_load_append(self):
+        old = self.df["timestamp"] < self.timestamps[-3]
+        store = SnapshotStore.from_dataframe(self.df[old], POLLUTANT_COLUMNS)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "store.xz")
+            store.save(path)
+            store = SnapshotStore.load(path)
+        for _, snapshot in self.df[~old].groupby("timestamp"):
+            store.append(snapshot)
+        self.assert_same_rows(store.to_dataframe(), self.df)
+        with self.assertRaises(ValueError):  # older snapshot
+            store.append(self.df[old])
+
+    def test_duplicated_site(self):
+        first, second = (self.df[self.df["timestamp"] == t] for t in self.timestamps[:2])
+        store = SnapshotStore.from_dataframe(first, POLLUTANT_COLUMNS)
+        duplicated = pd.concat([second, second.iloc[:1].assign(O3=999.0)])
+        with self.assertRaises(ValueError):  # the deltas of the site would be wrong
+            store.append(duplicated)
+        # the rejected snapshot left no trace, the next one is encoded from the stored ones
+        store.append(second)
+        self.assert_same_rows(store.to_dataframe(), pd.concat([first, second]))
+        self.assert_same_rows(store.snapshot(self.timestamps[1]), second)
+
+
+class TestRetention(unittest.TestCase):
+
+    def test_downsample(self):
+        df = pd.DataFrame(
+            {
+                "Type of site": ["Urban"] * 3,
+                "Location": ["Bern"] * 3,
+                "O3": [1.0, 3.0, 10.0],
+                "timestamp": pd.to_datetime(
+                    ["2024-01-05 21:00", "2024-01-05 22:00", "2024-01-06 00:00"]
+                ),
+            }
+        )
+        daily = retention.downsample(df, "D")
+        self.assertEqual(list(daily.columns), list(df.columns))
+        self.assertEqual(daily["O3"].tolist(), [2.0, 10.0])
+        self.assertEqual(retention.downsample(daily, "M")["O3"].tolist(), [6.0])
+
+    def test_compaction(self):
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            source = NabelSource(server.url("nabel_snapshot.html"), "UnitTest")
+            snapshot = source.get_snapshot()
+            localdata = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            localdata.df = pd.concat(
+                [
+                    snapshot.assign(
+                        timestamp=snapshot["timestamp"] + pd.Timedelta(hours=hour)
+                    )
+                    for hour in range(24 * 100)
+                ],
+                ignore_index=True,
+            )
+            compactor = retention.Compactor(
+                localdata, pd.Timedelta(days=10), pd.Timedelta(days=40)
+            )
+            metrics = compactor.run()
+            self.assertEqual(metrics["progress"], 1.0)
+            self.assertGreater(metrics["storage"]["monthly"], 0)
+            ranges = localdata.tier_ranges()
+            # the last snapshot is from 2024-04-14 20:00
+            self.assertEqual(ranges["raw"][0], pd.Timestamp("2024-04-04"))
+            self.assertEqual(ranges["daily"][0], pd.Timestamp("2024-03-01"))
+            self.assertEqual(localdata.df["timestamp"].min(), pd.Timestamp("2024-04-04"))
+            history = localdata.history()
+            self.assertTrue(history["timestamp"].is_monotonic_increasing)
+            self.assertFalse(history.duplicated(subset=["timestamp", "Location"]).any())
+            # two monthly, 34 daily and 10 days and 21 hours of hourly snapshots
+            self.assertEqual(history["timestamp"].nunique(), 2 + 34 + 24 * 10 + 21)
+            compactor.run()  # nothing new to downsample
+            pd.testing.assert_frame_equal(
+                localdata.history().reset_index(drop=True),
+                history.reset_index(drop=True),
+            )
+            restarted = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            # the rows count as the hourly snapshots they replace, see test_compacted_statistics
+            self.assertEqual(
+                restarted.statistics.n_distinct("timestamp"), history["timestamp"].nunique()
+            )
+            self.assertEqual(restarted.min_date(), "2024-01-01 00:00")
+            # monthly mean, daily mean and first hourly snapshot of a date
+            for date, timestamp in [
+                ("2024-01-20", "2024-01-01"),
+                ("2024-03-20", "2024-03-20"),
+                ("2024-04-10 12:00", "2024-04-10"),
+            ]:
+                snapshot = restarted.snapshot_on(date)
+                self.assertEqual(len(snapshot), 16)
+                self.assertEqual(snapshot["timestamp"].iloc[0], pd.Timestamp(timestamp))
+
+    def test_compacted_statistics(self):
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            source = NabelSource(server.url("nabel_snapshot.html"), "UnitTest")
+            snapshot = source.get_snapshot()
+            localdata = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            # whole days and months, with values changing over the day and between the days
+            start = pd.Timestamp("2024-01-01")
+            localdata.df = pd.concat(
+                [
+                    snapshot.assign(
+                        timestamp=start + pd.Timedelta(hours=hour),
+                        O3=snapshot["O3"] + hour % 24 + hour // 24 % 7,
+                    )
+                    for hour in range(24 * 100)
+                ],
+                ignore_index=True,
+            )
+            means = localdata.caclulate_mean_per_site()
+            n_rows = localdata.statistics.n_rows
+            retention.Compactor(localdata, pd.Timedelta(days=10), pd.Timedelta(days=40)).run()
+            self.assertGreater(len(localdata.history_files("monthly")), 0)
+            # after a restart the statistics are read from the compacted history
+            restarted = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            pd.testing.assert_frame_equal(
+                restarted.caclulate_mean_per_site(), means, check_dtype=False
+            )
+            self.assertEqual(restarted.statistics.n_rows, n_rows)
+
+
+class TestForecast(unittest.TestCase):
+
+    def test_linear_trend(self):
+        x = np.arange(2010, 2020)
+        y = np.vstack([2 * x - 4000, np.full(len(x), 7.0)])
+        y[0, 3] = np.nan  # missing values are ignored
+        model = LinearTrendModel(2)
+        model.partial_fit(x, y)
+        np.testing.assert_allclose(model.predict([2025]), [[50], [7]])
+
+    def test_incremental_refit(self):
+        # refitting snapshot by snapshot gives the same model as fitting the whole archive
+        df = pd.read_pickle(
+            "data_for_unit_testing/local_air_quality_data_Switzerland.xz",
+            compression="xz",
+        )
+        last = df["timestamp"] == df["timestamp"].max()
+        forecaster = LocalForecaster(df[~last], ["O3", "PM10"])
+        forecaster.update(df[last])
+        expected = LocalForecaster(df, ["O3", "PM10"])
+        pd.testing.assert_frame_equal(forecaster.forecast(), expected.forecast())
+
+    def test_parallel_fit(self):
+        # the chunks fitted in parallel processes give the same model as one process
+        hours = np.arange(48) % 24
+        y = np.random.default_rng(0).random((6, 48))
+        serial = forecast.fit_model(forecast.HourlyProfileModel, hours, y, n_jobs=1)
+        with mock.patch.object(forecast, "PARALLEL_MIN_OBSERVATIONS", 0):
+            parallel = forecast.fit_model(forecast.HourlyProfileModel, hours, y, n_jobs=2)
+        np.testing.assert_allclose(parallel.predict(range(24)), serial.predict(range(24)))
+
+
+class TestBuild(unittest.TestCase):
+
+    def test_build_and_validate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = cli.build(
+                local_inputs=[
+                    "data_for_unit_testing/local_air_quality_data_Switzerland.xz",
+                    "data_for_unit_testing/nabel_snapshot.html",
+                ],
+                output=directory,
+                geocode=False,
+            )
+            self.assertEqual(artifacts.validate(directory=directory), [])
+            archive = artifacts.load_current(
+                "local_air_quality_data_Switzerland", directory
+            )
+            entry = manifest["artifacts"]["local_air_quality_data_Switzerland"]
+            self.assertEqual(len(archive), entry["rows"])
+            self.assertIn(pd.Timestamp("2024-01-05 21:00"), set(archive["timestamp"]))
+
+            # a modified artifact is detected and not used
+            path = os.path.join(directory, manifest["version"], "who_stations.xz")
+            with open(path, "ab") as file:
+                file.write(b"corrupted")
+            self.assertEqual(len(artifacts.validate(directory=directory)), 1)
+            self.assertIsNone(artifacts.load_current("who_stations", directory))
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_parse_importtime(self):
+        output = "\n".join(
+            [
+                "import time: self [us] | cumulative | imported package",
+                "import time:       100 |        100 | site",
+                "import time:       200 |        200 |     numpy.core",
+                "import time:       300 |        500 |   numpy",
+                "import time:       400 |        400 |     bs4",
+                "import time:       100 |        500 |   air_quality_dashboard.data_parser",
+                "import time:        50 |       1050 | main",
+            ]
+        )
+        # only the libraries imported directly by the dashboard are reported
+        self.assertEqual(startup.parse_importtime(output), {"numpy": 5e-4, "bs4": 4e-4})
+
+    def test_find_regressions(self):
+        baseline = {"total": 2.0, "imports": 1.0, "phases": {"load": 0.5, "index": 0.01}}
+        result = {"total": 2.1, "imports": 1.5, "phases": {"load": 0.5, "index": 0.03}}
+        regressions = startup.find_regressions(result, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("imports"))
+
+
+class TestEvents(unittest.TestCase):
+
+    def test_listener_on_new_snapshot(self):
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            source = NabelSource(server.url("nabel_snapshot.html"), "UnitTest")
+            localdata = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            broker = events.EventBroker()
+            snapshots = []
+            localdata.add_listener(snapshots.append)
+            localdata.add_listener(
+                lambda snapshot: broker.publish("snapshot", {"rows": len(snapshot)})
+            )
+            localdata.update_local_air_quality_data()
+            localdata.update_local_air_quality_data()  # same snapshot, no event
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(broker.events_after(0), [(1, "snapshot", {"rows": 16})])
+        self.assertEqual(broker.events_after(1, timeout=0), [])  # nothing new
+
+    def test_stream(self):
+        app = flask.Flask(__name__)
+        app.register_blueprint(events.blueprint)
+        event_id = events.broker.publish("snapshot", {"source": "UnitTest"})
+        # a reconnecting webbrowser gets the events it missed
+        response = app.test_client().get(
+            "/events/snapshots", headers={"Last-Event-ID": str(event_id - 1)}
+        )
+        self.assertEqual(response.mimetype, "text/event-stream")
+        stream = response.response
+        self.assertTrue(next(stream).startswith(b"retry:"))
+        self.assertEqual(
+            next(stream),
+            f'id: {event_id}\nevent: snapshot\ndata: {{"source": "UnitTest"}}\n\n'.encode(),
+        )
+        response.close()
+
+
+class TestAtomic(unittest.TestCase):
+
+    def test_commit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "data.json")
+            atomic.write_json({"version": 1}, path)
+            version = atomic.file_version(path)
+            with self.assertRaises(ValueError):
+                with atomic.commit(path) as temporary_path:
+                    with open(temporary_path, "w", encoding="utf-8") as file:
+                        file.write("partial")
+                    raise ValueError("failed write")
+            # the old version is kept and the temporary file is removed
+            self.assertEqual(os.listdir(directory), ["data.json"])
+            self.assertEqual(atomic.file_version(path), version)
+            atomic.write_json({"version": 2}, path)
+            self.assertNotEqual(atomic.file_version(path), version)
+            # a new file gets the mode of open() (not only readable by its owner),
+            # a committed file keeps the mode of the file it replaces
+            with open(os.path.join(directory, "opened"), "w", encoding="utf-8"):
+                pass
+            new_path = os.path.join(directory, "new.json")
+            atomic.write_json({}, new_path)
+            self.assertEqual(
+                os.stat(new_path).st_mode, os.stat(os.path.join(directory, "opened")).st_mode
+            )
+            os.chmod(path, 0o640)
+            atomic.write_json({"version": 3}, path)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+
+    @unittest.skipIf(not hasattr(os, "getuid"), "no file owners")
+    def test_private_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            private = os.path.join(directory, "private")
+            self.assertEqual(atomic.private_directory(private), private)
+            self.assertEqual(os.stat(private).st_mode & 0o777, 0o700)
+            # e.g. created by another user in the shared temporary directory
+            shared = os.path.join(directory, "shared")
+            os.mkdir(shared)
+            os.chmod(shared, 0o777)
+            with contextlib.redirect_stdout(io.StringIO()):
+                fallback = atomic.private_directory(shared)
+            self.assertNotEqual(fallback, shared)
+            self.assertEqual(os.stat(fallback).st_mode & 0o777, 0o700)
+            os.rmdir(fallback)
+
+    @unittest.skipIf(atomic.fcntl is None, "no file locks")
+    def test_single_writer(self):
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            writer, reader = (
+                LocalData(
+                    source=NabelSource(server.url("nabel_snapshot.html"), "UnitTest"),
+                    update_on_load=False,
+                    data_directory=directory,
+                )
+                for _process in range(2)
+            )
+            snapshots = []
+            reader.add_listener(snapshots.append)
+            writer.update_local_air_quality_data()
+            with mock.patch.object(reader.source, "get_snapshot") as get_snapshot:
+                reader.update_local_air_quality_data()
+            get_snapshot.assert_not_called()  # only the writer fetches
+            self.assertFalse(reader.writer.held)
+            self.assertEqual(len(snapshots), 1)
+            self.assertEqual(len(reader.df), 16)
+            self.assertIsNotNone(reader.exceedances)  # limits stored with the snapshots
+            self.assertEqual(reader.refresh(), 0)  # nothing new
+            # the reader takes over when the writer stops
+            writer.writer.release()
+            reader.update_local_air_quality_data()
+            self.assertTrue(reader.writer.held)
+            self.assertFalse(writer.writer.acquire())
+            reader.writer.release()
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profiled_requests(self):
+        def slow_sum():
+            return sum(range(200_000))
+
+        app = flask.Flask(__name__)
+        app.add_url_rule("/work", "work", lambda: str(slow_sum()))
+        with tempfile.TemporaryDirectory() as directory:
+            profiling.enable_profiling(
+                app, directory=directory, max_profiles=2, allow_requests=True
+            )
+            client = app.test_client()
+            client.get("/work")  # not requested
+            # only the admins can ask for a profile, i.e. not through the proxy
+            proxied = {"X-Profile": "1", "X-Forwarded-For": "203.0.113.7"}
+            client.get("/work", headers=proxied)
+            self.assertEqual(profiling.list_profiles(directory), [])
+            self.assertEqual(client.get("/admin/profiles/", headers=proxied).status_code, 403)
+            with mock.patch.object(admin, "ADMIN_TOKEN", "secret"):
+                client.get("/work", headers={"X-Profile": "1"})  # without the token
+                self.assertEqual(profiling.list_profiles(directory), [])
+            for _ in range(3):
+                client.get("/work", headers={"X-Profile": "1"})
+            profiles = profiling.list_profiles(directory)
+            self.assertEqual(len(profiles), 2)  # the oldest is removed
+            self.assertEqual(profiles[0]["name"], "/work")
+            self.assertGreaterEqual(profiles[0]["duration"], profiles[1]["duration"])
+            flame_graph = client.get(f"/admin/profiles/{profiles[0]['id']}.svg")
+            self.assertIn(b"slow_sum", flame_graph.data)
+            self.assertIn(profiles[0]["id"].encode(), client.get("/admin/profiles/").data)
+            # the query flag profiles the following requests of the webbrowser as well
+            client.get("/work?profile=1")
+            client.get("/work")
+            profiled = {profile["id"] for profile in profiling.list_profiles(directory)}
+            self.assertTrue(profiled.isdisjoint(profile["id"] for profile in profiles))
+
+
+class TestMemory(unittest.TestCase):
+
+    def test_sized_cache(self):
+        calls = []
+
+        @memory.sized_cache("unit test", max_entries=3, max_bytes=20_000)
+        def compute(n):
+            calls.append(n)
+            return np.zeros(n)
+
+        compute(1000)  # 8000 bytes
+        compute(1000)
+        self.assertEqual(calls, [1000])
+        compute(1600)  # 12800 bytes, the least recently used result is evicted
+        self.assertEqual(compute.cache_len(), 1)
+        self.assertEqual(memory.accounting()["caches"]["unit test"], compute.cache_bytes())
+        self.assertGreaterEqual(compute.cache_bytes(), 12800)
+
+    def test_tracemalloc_diff(self):
+        self.assertIsNone(memory.tracemalloc_diff())  # not started
+        memory.start_tracemalloc()
+        allocated = [bytes(1000) for _ in range(1000)]
+        top = memory.tracemalloc_diff()
+        memory.stop_tracemalloc()
+        self.assertEqual(top[0]["file"], __file__)
+        self.assertGreaterEqual(top[0]["size_diff"], 1_000_000)
+        self.assertEqual(len(allocated), 1000)
+
+    def test_admin_only(self):
+        app = flask.Flask(__name__)
+        app.register_blueprint(memory.blueprint)
+        client = app.test_client()
+        proxied = {"X-Forwarded-For": "203.0.113.7"}
+        self.assertEqual(client.get("/admin/memory/", headers=proxied).status_code, 403)
+        self.assertEqual(
+            client.post("/admin/memory/tracemalloc", headers=proxied).status_code, 403
+        )
+        # a GET reports, but never starts the tracing
+        self.assertEqual(client.get("/admin/memory/tracemalloc").json["tracing"], False)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(client.post("/admin/memory/tracemalloc").json["tracing"], True)
+        self.assertEqual(client.get("/admin/memory/tracemalloc").json["tracing"], True)
+        client.post("/admin/memory/tracemalloc?stop=1")
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_evict_history(self):
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            source = NabelSource(server.url("nabel_snapshot.html"), "UnitTest")
+            snapshot = source.get_snapshot()
+            localdata = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            localdata.memory_ceiling = memory.dataframe_bytes(snapshot) * 4
+            with mock.patch.object(local_data, "MIN_HOT_SNAPSHOTS", 2):
+                for hour in range(10):
+                    localdata.append_snapshot(
+                        snapshot.assign(timestamp=snapshot["timestamp"] + pd.Timedelta(hours=hour))
+                    )
+            self.assertLessEqual(localdata.memory_usage(), localdata.memory_ceiling)
+            self.assertEqual(len(localdata.history()), 160)
+            self.assertEqual(len(localdata.history(end="2024-01-05 22:00")), 32)
+            self.assertEqual(localdata.statistics.n_rows, 160)
+            # after a restart the statistics still cover the history
+            restarted = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            self.assertLess(len(restarted.df), 160)
+            self.assertEqual(restarted.statistics.n_rows, 160)
+            self.assertEqual(restarted.min_date(), "2024-01-05 21:00")
+            # and the forecast is fitted on the evicted snapshots as well
+            self.assertEqual(restarted.forecaster.n_snapshots, 10)
+
+
+
+class TestLocalDataPage(unittest.TestCase):
+
+    def test_layout_per_page_load(self):
+        with FixtureServer() as server, tempfile.TemporaryDirectory() as directory:
+            source = NabelSource(server.url("nabel_snapshot.html"), "UnitTest")
+            snapshot = source.get_snapshot()
+            localdata = LocalData(
+                source=source, update_on_load=False, data_directory=directory
+            )
+            localdata.append_snapshot(snapshot)
+            # the pages are only registered on an app with pages
+            dash.Dash(__name__, use_pages=True, pages_folder="")
+            with mock.patch.object(
+                local_data, "shared_local_data", return_value=localdata
+            ), mock.patch.object(local_data, "site_geocodes", return_value=pd.DataFrame()):
+                page = importlib.import_module("pages.plots_local_data")
+
+            def date_options():
+                dropdown = page.layout().children[2].children[1]
+                return [option["label"] for option in dropdown.options]
+
+            self.assertEqual(date_options(), ["2024-01-05"])
+            localdata.append_snapshot(
+                snapshot.assign(timestamp=snapshot["timestamp"] + pd.Timedelta(days=1))
+            )
+            self.assertEqual(date_options(), ["2024-01-05", "2024-01-06"])
+
+
 if __name__ == "__main__":
     unittest.main()